@@ -1,8 +1,45 @@
+from .aio import html_match_async
+
+from .batch import (
+    BatchMatch,
+    html_match_many
+)
+
+from .cache import ResultCache
+
+from .compiler import (
+    CompiledSpec,
+    compile_spec,
+    set_max_compiled_specs
+)
+
+from .document import Document
+
+from .files import html_match_file
+
 from .matchers import (
-    linear_match as html_match,
+    html_match,
+    linear_match,
+    matcher_named,
     prune_unmatched_elements
 )
 
+from .parsers import (
+    DEFAULT_PARSER,
+    PARSERS,
+    parse_html
+)
+
+from .reports import ReportLimits
+
+from .stats import MatchStats
+
+from .streaming import stream_match
+
+from .structural import structural_match
+
+from .xpath import xpath_match
+
 from .spec import (
     a,
     accordion,
@@ -23,5 +60,8 @@ from .spec import (
 
 from .formatters import (
     pretty_html,
-    pretty_spec
+    pretty_spec,
+    write_spec
 )
+
+from .version import __version__
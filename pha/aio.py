@@ -0,0 +1,121 @@
+import asyncio
+import os
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+
+from .batch import _definition_indexes, _result_from_summary, _summary
+from .compiler import compile_spec
+from .document import Document
+from .matchers import html_match
+
+
+# How many matches can be offloaded at once unless told otherwise, which leaves the default executor free for
+# everything else the event loop offloads to it (such as DNS lookups) when a test fires off many assertions together
+DEFAULT_MAX_CONCURRENT = os.cpu_count() or 1
+
+# The semaphores limiting each event loop's matches, by limit
+_SEMAPHORES = weakref.WeakKeyDictionary()
+
+
+async def html_match_async(spec, html_src, matcher=None, executor=None, max_concurrent=DEFAULT_MAX_CONCURRENT,
+                           **options):
+    """
+    Matches the html against the spec as html_match does, parsing and matching in an executor so that the event loop
+    carries on with everything else in the meantime.
+
+    The executor is the event loop's default (a thread pool) unless another is given. With a process pool the match
+    doesn't hold the GIL either, but as with html_match_many the result comes back slimmed down, so a failed result has
+    no parsed tree, and its report shows the full source but not the pruned source. The spec and the matcher are sent
+    to the process, so a matcher given as a function must be one which can be pickled.
+
+    No more than max_concurrent matches (None for no limit) are offloaded at once from each event loop, and the others
+    wait their turn without holding a worker.
+
+    The html can also be an async iterator of bytes or str chunks, such as the body of a response from an async http
+    client, which is matched with the stream matcher (unless another matcher is provided) in a thread as the chunks
+    arrive, fetching each one on the event loop. The matcher stops reading as soon as the match is decided. With a
+    process pool the chunks are all read first.
+    """
+
+    loop = asyncio.get_running_loop()
+    async with _limit(loop, max_concurrent):
+        if isinstance(executor, ProcessPoolExecutor):
+            if hasattr(html_src, '__aiter__'):
+                html_src = await _read_chunks(html_src)
+            elif isinstance(html_src, Document):
+                # A parsed tree is no use in another process, so the source is sent and parsed there the same way
+                options = dict(options, parser=options.get('parser') or html_src.parser,
+                               encoding=options.get('encoding') or html_src.encoding)
+                html_src = html_src.html_src
+            summary = await loop.run_in_executor(executor, _match_summary, spec, html_src, matcher, options)
+            return _result_from_summary(spec, compile_spec(spec).element_defs_for(spec), html_src, summary)
+
+        if hasattr(html_src, '__aiter__'):
+            return await loop.run_in_executor(executor, _match_chunks, spec, _chunks_from(html_src, loop), matcher,
+                                              options)
+        return await loop.run_in_executor(executor, lambda: html_match(spec, html_src, matcher=matcher, **options))
+
+
+class _Unlimited(object):
+
+    async def __aenter__(self):
+        pass
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+def _limit(loop, max_concurrent):
+    if max_concurrent is None:
+        return _Unlimited()
+    semaphores = _SEMAPHORES.setdefault(loop, {})
+    if max_concurrent not in semaphores:
+        semaphores[max_concurrent] = asyncio.Semaphore(max_concurrent)
+    return semaphores[max_concurrent]
+
+
+def _match_summary(spec, html_src, matcher, options):
+    """ Matches the html in a worker process, returning a small summary rather than the result itself. """
+
+    compiled_spec = compile_spec(spec)
+    result = html_match(compiled_spec, html_src, matcher=matcher, **options)
+    return _summary(_definition_indexes(compiled_spec), html_src, result)
+
+
+async def _read_chunks(async_chunks):
+    chunks = [chunk async for chunk in async_chunks]
+    return ''.join(chunks) if not chunks or isinstance(chunks[0], str) else b''.join(chunks)
+
+
+def _match_chunks(spec, chunks, matcher, options):
+    # The matcher can stop before the last chunk, so the chunks are closed here rather than whenever they are collected
+    try:
+        return html_match(spec, chunks, matcher=matcher, **options)
+    finally:
+        chunks.close()
+
+
+def _chunks_from(async_chunks, loop):
+    """
+    The chunks of the async iterator, for a matcher running in another thread, each one fetched on the loop.
+
+    Closing the chunks before the last one closes the async iterator too (such as the body of a response), on the loop.
+    """
+
+    iterator = async_chunks.__aiter__()
+    try:
+        while True:
+            chunk = asyncio.run_coroutine_threadsafe(_next_chunk(iterator), loop).result()
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        if hasattr(iterator, 'aclose'):
+            asyncio.run_coroutine_threadsafe(iterator.aclose(), loop).result()
+
+
+async def _next_chunk(iterator):
+    try:
+        return await iterator.__anext__()
+    except StopAsyncIteration:
+        return None
@@ -0,0 +1,214 @@
+import os
+import time
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from .compiler import compile_spec
+from .document import Document
+from .matchers import MatcherResult, html_match
+
+
+MatchedDocument = namedtuple('MatchedDocument', ['index', 'document', 'result'])
+MatchedDocument.__doc__ = """ The result of matching one document in a batch, with its position in the batch. """
+
+# Each worker compiles the spec once, when it starts, and keeps it here for every document it is sent
+_worker_spec = None
+_worker_matcher = None
+_worker_options = None
+
+
+class BatchMatch(object):
+    """
+    Matches a spec against many documents, spread across a pool of worker processes.
+
+    Iterating over the batch runs it, yielding a MatchedDocument for each document, in the order the documents were
+    given unless ordered is False, in which case they come as soon as they are matched. Once a document has been
+    yielded the counts and throughput below include it, so they can be reported while the batch is still running.
+
+    Results from the workers are slimmed down to which definitions failed, so a failed result has no parsed tree, and
+    its report shows the full source but not the pruned source. Results for documents given as paths only have their
+    source read back, for the report, when they fail.
+    """
+
+    def __init__(self, spec, documents, workers=None, matcher=None, ordered=True, chunk_size=16, **options):
+        self.spec = spec
+        self.documents = documents
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.matcher = matcher
+        self.ordered = ordered
+        self.chunk_size = chunk_size
+        self.options = options
+        self.matched = 0
+        self.passed = 0
+        self.failed = 0
+        self.bytes_matched = 0
+        self.started = None
+        self.finished = None
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def documents_per_second(self):
+        return self.matched / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def megabytes_per_second(self):
+        return self.bytes_matched / 1e6 / self.elapsed if self.elapsed else 0.0
+
+    def results(self):
+        """ Runs the batch, returning every result in the order the documents were given. """
+
+        return [matched.result for matched in sorted(self, key=lambda matched: matched.index)]
+
+    def __iter__(self):
+        compiled_spec = compile_spec(self.spec)
+        element_defs = compiled_spec.element_defs_for(self.spec)
+        self.matched = self.passed = self.failed = self.bytes_matched = 0
+        self.started = time.perf_counter()
+        self.finished = None
+        for chunk, summaries in self._matched_chunks(compiled_spec):
+            for (index, document), summary in zip(chunk, summaries):
+                result = _result_from_summary(self.spec, element_defs, document, summary)
+                self.matched += 1
+                self.passed += result.passed
+                self.failed += result.failed
+                self.bytes_matched += summary[0]
+                yield MatchedDocument(index, document, result)
+        self.finished = time.perf_counter()
+
+    def __repr__(self):
+        return 'BatchMatch[workers={0},matched={1},passed={2},failed={3}]'.format(self.workers, self.matched,
+                                                                                  self.passed, self.failed)
+
+    def __str__(self):
+        return 'Matched {0} documents in {1:.2f}s ({2:.1f} documents/s, {3:.2f} MB/s): {4} passed, {5} failed'.format(
+            self.matched, self.elapsed, self.documents_per_second, self.megabytes_per_second, self.passed, self.failed)
+
+    def _matched_chunks(self, compiled_spec):
+        """ Yields each chunk of documents along with the summaries of their results. """
+
+        chunks = _chunks(enumerate(self.documents), self.chunk_size)
+        if self.workers <= 1:
+            _init_worker(compiled_spec, self.matcher, self.options)
+            for chunk in chunks:
+                yield chunk, _match_chunk(chunk)
+            return
+
+        # Only a few chunks per worker are in flight at once, so a large corpus is never all in memory
+        with ProcessPoolExecutor(self.workers, initializer=_init_worker,
+                                 initargs=(compiled_spec, self.matcher, self.options)) as executor:
+            pending = deque()
+            for chunk in chunks:
+                pending.append((chunk, executor.submit(_match_chunk, chunk)))
+                if len(pending) >= self.workers * 2:
+                    for matched_chunk in self._finished(pending):
+                        yield matched_chunk
+            while pending:
+                for matched_chunk in self._finished(pending):
+                    yield matched_chunk
+
+    def _finished(self, pending):
+        """ Takes at least one finished chunk off the queue, waiting for the first chunk when they come in order. """
+
+        if self.ordered:
+            chunk, future = pending.popleft()
+            yield chunk, future.result()
+            while pending and pending[0][1].done():
+                chunk, future = pending.popleft()
+                yield chunk, future.result()
+        else:
+            done, _ = wait([future for _, future in pending], return_when=FIRST_COMPLETED)
+            for chunk, future in [item for item in pending if item[1] in done]:
+                pending.remove((chunk, future))
+                yield chunk, future.result()
+
+
+def html_match_many(spec, documents, workers=None, matcher=None, ordered=True, chunk_size=16, **options):
+    """
+    Matches the spec against each of the documents, which may be html sources or paths to html files.
+
+    Documents which are strings or bytes are html sources, and pathlib paths (or anything os.PathLike) are files. The
+    spec is sent to each worker process once. Returns a BatchMatch, which runs as it is iterated over.
+    """
+
+    return BatchMatch(spec, documents, workers=workers, matcher=matcher, ordered=ordered, chunk_size=chunk_size,
+                      **options)
+
+
+def _chunks(items, chunk_size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _init_worker(compiled_spec, matcher, options):
+    global _worker_spec, _worker_matcher, _worker_options
+    _worker_spec = compiled_spec
+    _worker_matcher = matcher
+    _worker_options = options
+
+
+def _match_chunk(chunk):
+    """ Matches a chunk of documents in a worker, returning small summaries rather than the results themselves. """
+
+    definition_indexes = _definition_indexes(_worker_spec)
+    summaries = []
+    for _, document in chunk:
+        html_src = _read_document(document)
+        result = html_match(_worker_spec, html_src, matcher=_worker_matcher, **_worker_options)
+        summaries.append(_summary(definition_indexes, html_src, result))
+    return summaries
+
+
+def _definition_indexes(compiled_spec):
+    return dict((id(element_def), index) for index, element_def in enumerate(compiled_spec.element_defs))
+
+
+def _summary(definition_indexes, html_src, result):
+    """ A small summary of the result, sent back from a worker in place of the result itself. """
+
+    if isinstance(html_src, Document):
+        html_src = html_src.html_src
+    return (len(html_src),
+            result.passed,
+            tuple(definition_indexes[id(element_def)] for element_def in result.element_defs_not_found),
+            definition_indexes.get(id(result.failed_on_def)),
+            definition_indexes.get(id(result.unmatched_def)),
+            result.bytes_consumed)
+
+
+def _result_from_summary(spec, element_defs, document, summary):
+    _, passed, not_found_indexes, failed_on_index, unmatched_index, bytes_consumed = summary
+    html_src = document
+    if isinstance(document, Document):
+        html_src = document.html_src
+    elif _is_path(document):
+        html_src = None if passed else _read_document(document)
+    return MatcherResult(spec,
+                         html_src,
+                         None,
+                         passed=passed,
+                         element_defs_not_found=[element_defs[index] for index in not_found_indexes],
+                         failed_on_def=None if failed_on_index is None else element_defs[failed_on_index],
+                         unmatched_def=None if unmatched_index is None else element_defs[unmatched_index],
+                         bytes_consumed=bytes_consumed)
+
+
+def _is_path(document):
+    return isinstance(document, os.PathLike)
+
+
+def _read_document(document):
+    if not _is_path(document):
+        return document
+    with open(document, 'rb') as html_file:
+        return html_file.read()
@@ -0,0 +1 @@
+""" Benchmarks for the matchers, each runnable as a module, e.g. python -m pha.benchmarks.spec_size """
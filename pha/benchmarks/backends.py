@@ -0,0 +1,65 @@
+""" Compares the parser backends, timing a match with each and checking they agree with the default parser. """
+
+import random
+import timeit
+
+from pha import elem, html, html_match, text
+from pha.parsers import DEFAULT_PARSER, PARSERS
+
+
+DOCUMENT_ROWS = 2000
+SPEC_ROWS = 50
+
+
+def build_document(row_count, seed=0):
+    rnd = random.Random(seed)
+    rows = ['<tr class="row r{0}"><td><a href="/item/{0}">Item {0}</a></td><td>&pound;{1}</td></tr>'.format(
+        index, rnd.randint(1, 1000)) for index in range(row_count)]
+    return ('<!DOCTYPE html><html><head><meta charset="utf-8"><title>Items</title>'
+            '<script>var items = {0};</script></head>'
+            '<body><h1>Café items</h1><!-- listing --><table>{1}</table></body></html>').format(row_count,
+                                                                                                   ''.join(rows))
+
+
+def build_specs(row_count, spec_rows, seed=0):
+    rnd = random.Random(seed)
+    rows = sorted(rnd.sample(range(row_count), spec_rows))
+    passing = html(text('Café items'),
+                   elem('table', *[elem('tr', elem('a', content='Item {0}'.format(row)), class_='r{0}'.format(row))
+                                   for row in rows]))
+    failing = html(elem('table', *[elem('tr', content='Item {0}'.format(row)) for row in reversed(rows)]))
+    return passing, failing
+
+
+def summarise(result):
+    return result.passed, len(result.element_defs_not_found)
+
+
+def time_match(spec, html_src, options, repeat=3):
+    return min(timeit.repeat(lambda: html_match(spec, html_src, **options), number=1, repeat=repeat))
+
+
+def main():
+    html_src = build_document(DOCUMENT_ROWS)
+    html_bytes = html_src.encode('utf-8')
+    specs = build_specs(DOCUMENT_ROWS, SPEC_ROWS)
+    expected = [summarise(html_match(spec, html_src, parser=DEFAULT_PARSER)) for spec in specs]
+
+    print('Matching a document of {0} rows against specs of {1} rows'.format(DOCUMENT_ROWS, SPEC_ROWS))
+    print('{0:>12} {1:>10} {2:>12} {3:>16} {4:>7}'.format('parser', 'str (s)', 'bytes (s)', 'bytes utf-8 (s)',
+                                                            'agrees'))
+    for parser in PARSERS:
+        try:
+            results = [summarise(html_match(spec, html_src, parser=parser)) for spec in specs]
+        except Exception as error:
+            print('{0:>12} unavailable: {1}'.format(parser, error))
+            continue
+        from_str = sum(time_match(spec, html_src, {'parser': parser}) for spec in specs)
+        from_bytes = sum(time_match(spec, html_bytes, {'parser': parser}) for spec in specs)
+        from_declared = sum(time_match(spec, html_bytes, {'parser': parser, 'encoding': 'utf-8'}) for spec in specs)
+        print('{0:>12} {1:>10.4f} {2:>12.4f} {3:>16.4f} {4:>7}'.format(parser, from_str, from_bytes, from_declared,
+                                                                        'yes' if results == expected else 'NO'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+""" Shows how batch matching scales with the number of worker processes. """
+
+import os
+
+from pha import html_match_many
+from pha.benchmarks.backends import build_document, build_specs
+
+
+DOCUMENTS = 200
+DOCUMENT_ROWS = 200
+SPEC_ROWS = 20
+
+
+def main():
+    documents = [build_document(DOCUMENT_ROWS, seed=seed) for seed in range(DOCUMENTS)]
+    spec, _ = build_specs(DOCUMENT_ROWS, SPEC_ROWS)
+    worker_counts = sorted(set([1, 2, 4, os.cpu_count() or 1]))
+
+    print('Matching {0} documents of {1} rows on {2} cores'.format(DOCUMENTS, DOCUMENT_ROWS, os.cpu_count()))
+    print('{0:>8} {1:>12} {2:>14} {3:>8}'.format('workers', 'elapsed (s)', 'documents/s', 'speedup'))
+    single = None
+    for workers in worker_counts:
+        batch = html_match_many(spec, documents, workers=workers)
+        for _ in batch:
+            pass
+        single = single or batch.elapsed
+        print('{0:>8} {1:>12.2f} {2:>14.1f} {3:>7.1f}x'.format(workers, batch.elapsed, batch.documents_per_second,
+                                                                single / batch.elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+""" Shows how finding content scales with the number of text definitions, testing needles in turn or all at once. """
+
+import random
+import timeit
+
+from bs4 import BeautifulSoup
+
+from pha.index import DocumentIndex
+from pha.textsearch import NeedleSearch
+
+
+NEEDLE_COUNTS = [10, 100, 1000]
+DOCUMENT_ROWS = 5000
+
+
+def build_document(row_count, seed=0):
+    rnd = random.Random(seed)
+    rows = ['<tr><td>Row {0}</td><td>Value {1}</td></tr>'.format(index, rnd.randint(0, 10 ** 6))
+            for index in range(row_count)]
+    return '<html><table>{0}</table></html>'.format(''.join(rows))
+
+
+def build_needles(needle_count, seed=0):
+    rnd = random.Random(seed)
+    return ['Value {0}'.format(rnd.randint(0, 10 ** 6)) for _ in range(needle_count)]
+
+
+def search_in_turn(document_index, needles):
+    for needle in needles:
+        document_index._needle_hits(needle)
+
+
+def search_at_once(document_index, needles):
+    document_index.search_needles(NeedleSearch(needles))
+
+
+def time_search(search, html_src, needles, number=3):
+    root_element = BeautifulSoup(html_src, 'html.parser')
+    return min(timeit.repeat(lambda: search(DocumentIndex(root_element), needles), number=1, repeat=number))
+
+
+def main():
+    html_src = build_document(DOCUMENT_ROWS)
+    print('Finding content in a document of {0} rows'.format(DOCUMENT_ROWS))
+    print('{0:>8} {1:>14} {2:>14} {3:>8}'.format('needles', 'in turn (s)', 'at once (s)', 'speedup'))
+    for needle_count in NEEDLE_COUNTS:
+        needles = build_needles(needle_count)
+        in_turn = time_search(search_in_turn, html_src, needles)
+        at_once = time_search(search_at_once, html_src, needles)
+        print('{0:>8} {1:>14.4f} {2:>14.4f} {3:>7.1f}x'.format(needle_count, in_turn, at_once, in_turn / at_once))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+""" Seeded generators for synthetic documents, and for specs which match them (or deliberately don't). """
+
+import random
+
+from pha import elem, html
+
+
+TAG_NAMES = ['div', 'section', 'ul', 'li', 'p', 'span', 'table', 'tr', 'td', 'a', 'strong', 'em']
+WORDS = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing', 'elit', 'sed', 'eiusmod', 'tempor',
+         'incididunt', 'labore', 'dolore', 'magna', 'aliqua']
+
+# Content which no generated document has, for specs which should fail
+MISSING_CONTENT = '[missing]'
+
+
+class GeneratedElement(object):
+    """ An element of a generated document, numbered in document order, with a marker in its text unique to it. """
+
+    __slots__ = ('number', 'name', 'attrs', 'text', 'children')
+
+    def __init__(self, number, name, attrs, text):
+        self.number = number
+        self.name = name
+        self.attrs = attrs
+        self.text = text
+        self.children = []
+
+    @property
+    def marker(self):
+        return '[e{0}]'.format(self.number)
+
+    def descendants(self):
+        """ The element and everything below it, in document order. """
+
+        stack = [self]
+        while stack:
+            element = stack.pop()
+            yield element
+            stack.extend(reversed(element.children))
+
+    def render(self, parts):
+        parts.append('<{0}'.format(self.name))
+        for key, value in self.attrs:
+            parts.append(' {0}="{1}"'.format(key, value))
+        parts.append('>')
+        parts.append(self.text)
+        for child in self.children:
+            child.render(parts)
+        parts.append('</{0}>'.format(self.name))
+
+
+def generate_tree(depth=4, fan_out=6, text_words=4, attributes=2, seed=0):
+    """
+    Generates the tree of a document, with a body holding depth levels of elements below it.
+
+    Each element has up to fan_out children (fan_out on average, and at least one until the last level), text_words
+    words of text and, besides an id and a class, the given number of data attributes.
+    """
+
+    rnd = random.Random(seed)
+    numbers = iter(range(1, 2 ** 62))
+
+    def new_element(name):
+        number = next(numbers)
+        attrs = [('id', 'e{0}'.format(number)), ('class', 'c{0} c{1}'.format(rnd.randrange(10), rnd.randrange(10)))]
+        attrs.extend(('data-a{0}'.format(index), 'v{0}'.format(rnd.randrange(1000))) for index in range(attributes))
+        words = ' '.join(rnd.choice(WORDS) for _ in range(text_words))
+        return GeneratedElement(number, name, attrs, '{0} [e{1}]'.format(words, number))
+
+    root = GeneratedElement(0, 'html', [], '')
+    body = new_element('body')
+    root.children.append(body)
+    level = [body]
+    for _ in range(depth):
+        next_level = []
+        for parent in level:
+            for _ in range(max(1, rnd.randint(0, 2 * fan_out))):
+                child = new_element(rnd.choice(TAG_NAMES))
+                parent.children.append(child)
+                next_level.append(child)
+        level = next_level
+    return root
+
+
+def render_document(root):
+    parts = ['<!DOCTYPE html>']
+    root.render(parts)
+    return ''.join(parts)
+
+
+def generate_document(depth=4, fan_out=6, text_words=4, attributes=2, seed=0):
+    """ Generates a document as html. """
+
+    return render_document(generate_tree(depth, fan_out, text_words, attributes, seed))
+
+
+def generate_spec(root, definitions=50, nested=True, content=True, passing=True, seed=0):
+    """
+    Generates a spec for the generated document, with a definition for each of a random sample of its elements.
+
+    A nested spec keeps the elements' ancestry, each definition being a child of the definition of its nearest sampled
+    ancestor, where a shallow spec puts every definition directly under the html. Content definitions match the text
+    marker unique to each element, where attribute definitions match its tag name, id and class. A failing spec has
+    one more definition, at the very end, whose content is in no generated document, so a matcher has to read
+    everything before it can fail.
+    """
+
+    rnd = random.Random(seed)
+    elements = list(root.descendants())[2:]
+    sampled = set(rnd.sample(range(len(elements)), min(definitions, len(elements))))
+    sampled_numbers = set(elements[index].number for index in sampled)
+
+    def element_def(element, children):
+        if content:
+            return elem(element.name, *children, content=element.marker)
+        attrs = dict(element.attrs[:2])
+        attrs['class'] = attrs['class'].split()[0]
+        return elem(element.name, *children, **attrs)
+
+    def spec_children(element):
+        children = []
+        for child in element.children:
+            grandchildren = spec_children(child) if nested else []
+            if child.number in sampled_numbers:
+                children.append(element_def(child, grandchildren))
+            else:
+                children.extend(grandchildren)
+        return children
+
+    if nested:
+        children = spec_children(root)
+    else:
+        children = [element_def(element, []) for element in root.descendants() if element.number in sampled_numbers]
+    if not passing:
+        children.append(elem('p', content=MISSING_CONTENT))
+    return html(*children)
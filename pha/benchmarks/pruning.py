@@ -0,0 +1,50 @@
+""" Compares pruning by removing elements from the tree with marking the elements kept and rendering from the marks. """
+
+import timeit
+
+from bs4 import BeautifulSoup
+
+from pha import compile_spec
+from pha.benchmarks.spec_size import build_document, build_spec
+from pha.index import DocumentIndex
+from pha.matchers import _extract_pruned_elements, _prune_unmatched_elements
+
+
+DOCUMENT_SIZES = [1000, 5000, 20000]
+SPEC_SIZE = 100
+
+
+def prune_by_extracting(root_element, compiled_spec):
+    _extract_pruned_elements(_prune_unmatched_elements(DocumentIndex(root_element), compiled_spec))
+
+
+def prune_by_marking(root_element, compiled_spec):
+    _prune_unmatched_elements(DocumentIndex(root_element), compiled_spec)
+
+
+def prune_by_marking_and_render(root_element, compiled_spec):
+    _prune_unmatched_elements(DocumentIndex(root_element), compiled_spec).render(pretty=True)
+
+
+def time_prune(prune, html_src, compiled_spec, repeat=3):
+    # Extracting changes the tree, so each run needs a freshly parsed one, whose parse time is taken off
+    def run():
+        prune(BeautifulSoup(html_src, 'html.parser'), compiled_spec)
+    parse_time = min(timeit.repeat(lambda: BeautifulSoup(html_src, 'html.parser'), number=1, repeat=repeat))
+    return min(timeit.repeat(run, number=1, repeat=repeat)) - parse_time
+
+
+def main():
+    compiled_spec = compile_spec(build_spec(SPEC_SIZE))
+    print('Pruning for a spec of {0} definitions'.format(SPEC_SIZE))
+    print('{0:>9} {1:>14} {2:>12} {3:>22}'.format('elements', 'extract (s)', 'marks (s)', 'marks and render (s)'))
+    for document_size in DOCUMENT_SIZES:
+        html_src = build_document(document_size)
+        extracting = time_prune(prune_by_extracting, html_src, compiled_spec)
+        marking = time_prune(prune_by_marking, html_src, compiled_spec)
+        rendering = time_prune(prune_by_marking_and_render, html_src, compiled_spec)
+        print('{0:>9} {1:>14.4f} {2:>12.4f} {3:>22.4f}'.format(document_size, extracting, marking, rendering))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+""" Shows the time and memory taken to build large generated specs, with shared element defs and with plain ones. """
+
+import re
+import timeit
+import tracemalloc
+
+from pha import elem, html
+
+
+ROWS = 10000
+CELLS = 5
+
+
+class PlainElementDef(object):
+    """ The original element def, a plain object with its own attribute dict, list of children and name regex. """
+
+    def __init__(self, name_regex, *children, **attrs):
+        self.name_regex = name_regex
+        self.name_matcher = re.compile(name_regex)
+        self.parent = None
+        self.children = [child for child in children if child]
+        self.content = attrs.pop('content', None)
+        self.attrs = dict((key.replace('_', '') if key.endswith('_') else key, value) for key, value in attrs.items())
+        for child in self.children:
+            child.parent = self
+
+
+def plain_elem(name, *children, **attrs):
+    return PlainElementDef(r'^{0}$'.format(name), *children, **attrs)
+
+
+def plain_html(*children, **attrs):
+    return PlainElementDef(r'^html$', *children, **attrs)
+
+
+def distinct_cells(make_elem, row, cell):
+    return make_elem('td', content='Row {0} cell {1}'.format(row, cell))
+
+
+def repeated_cells(make_elem, row, cell):
+    return make_elem('td', content='Cell {0}'.format(cell))
+
+
+def attributed_cells(make_elem, row, cell):
+    return make_elem('td', id='cell-{0}-{1}'.format(row, cell), class_='cell')
+
+
+CASES = [('distinct cells', distinct_cells), ('repeated cells', repeated_cells), ('attributed cells', attributed_cells)]
+
+
+def build_table(make_html, make_elem, make_cell):
+    """ A spec for a table of ROWS rows of CELLS cells, as a parametrized test would generate it. """
+
+    return make_html(make_elem('table', *[make_elem('tr', *[make_cell(make_elem, row, cell) for cell in range(CELLS)])
+                                          for row in range(ROWS)]))
+
+
+def time_build(make_html, make_elem, make_cell, repeat=5):
+    return min(timeit.repeat(lambda: build_table(make_html, make_elem, make_cell), number=1, repeat=repeat))
+
+
+def memory_held(make_html, make_elem, make_cell):
+    """ The memory still held by a built spec, in MB. """
+
+    tracemalloc.start()
+    try:
+        spec = build_table(make_html, make_elem, make_cell)
+        held, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del spec
+    return held / 1024 / 1024
+
+
+def main():
+    print('Building a spec for a table of {0} rows of {1} cells'.format(ROWS, CELLS))
+    print('{0:>18} {1:>11} {2:>11} {3:>11} {4:>11}'.format('', 'plain (s)', 'shared (s)', 'plain (MB)', 'shared (MB)'))
+    for name, make_cell in CASES:
+        print('{0:>18} {1:>11.3f} {2:>11.3f} {3:>11.1f} {4:>11.1f}'.format(
+            name,
+            time_build(plain_html, plain_elem, make_cell),
+            time_build(html, elem, make_cell),
+            memory_held(plain_html, plain_elem, make_cell),
+            memory_held(html, elem, make_cell)))
+
+
+if __name__ == '__main__':
+    main()
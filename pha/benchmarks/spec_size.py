@@ -0,0 +1,88 @@
+""" Shows how pruning scales with the size of the spec, with and without the tag name and text indexes. """
+
+import random
+import timeit
+
+from bs4 import BeautifulSoup
+
+from pha import compile_spec, div, elem, heading, html, text
+from pha.index import DocumentIndex
+from pha.matchers import _attributes_match, prune_unmatched_elements
+
+
+TAG_NAMES = ['div', 'span', 'p', 'a', 'li', 'td', 'tr', 'table', 'ul', 'h2', 'strong', 'em']
+SPEC_SIZES = [10, 100, 1000]
+DOCUMENT_ELEMENTS = 2000
+
+
+def build_document(element_count, seed=0):
+    rnd = random.Random(seed)
+    parts = ['<html><body>']
+    for index in range(element_count):
+        name = rnd.choice(TAG_NAMES)
+        parts.append('<{0} id="e{1}" class="c{2}">text {1}</{0}>'.format(name, index, index % 7))
+    parts.append('</body></html>')
+    return ''.join(parts)
+
+
+def build_spec(definition_count, seed=0):
+    rnd = random.Random(seed)
+    children = []
+    for index in range(definition_count - 1):
+        kind = rnd.random()
+        if kind < 0.1:
+            children.append(heading('text {0}'.format(index)))
+        elif kind < 0.2:
+            children.append(text('missing {0}'.format(index)))
+        else:
+            children.append(elem(rnd.choice(TAG_NAMES), id='e{0}'.format(index)))
+    return html(div(*children))
+
+
+def matches_without_index(element_def, element):
+    return element_def.name_matcher.match(element.name) \
+        and _attributes_match(element_def, element) \
+        and (not element_def.content or any(element_def.content in string for string in element.strings))
+
+
+def prune_without_index(element, all_element_definitions):
+    """ The original pruning, testing every element against every definition. """
+
+    i_match_anything = any(matches_without_index(elem_def, element) for elem_def in all_element_definitions)
+    child_matched_anything = False
+    for child_element in [child for child in element.children if child.name]:
+        if prune_without_index(child_element, all_element_definitions):
+            child_matched_anything = True
+        else:
+            child_element.extract()
+    return i_match_anything or child_matched_anything
+
+
+def prune_with_index(root_element, compiled_spec):
+    prune_unmatched_elements(root_element, compiled_spec)
+
+
+def time_prune(prune, html_src, spec_arg, repeat=3):
+    # Pruning removes elements from the tree, so each run needs a freshly parsed tree, which is parsed untimed
+    parsed = {}
+
+    def parse():
+        parsed['root'] = BeautifulSoup(html_src, 'html.parser')
+
+    return min(timeit.repeat(lambda: prune(parsed['root'], spec_arg), setup=parse, number=1, repeat=repeat))
+
+
+def main():
+    html_src = build_document(DOCUMENT_ELEMENTS)
+    element_count = len(DocumentIndex(BeautifulSoup(html_src, 'html.parser'))) - 1
+    print('Pruning a document of {0} elements'.format(element_count))
+    print('{0:>12} {1:>14} {2:>14} {3:>8}'.format('definitions', 'all defs (s)', 'indexed (s)', 'speedup'))
+    for spec_size in SPEC_SIZES:
+        compiled_spec = compile_spec(build_spec(spec_size))
+        unindexed = time_prune(prune_without_index, html_src, compiled_spec.definitions)
+        indexed = time_prune(prune_with_index, html_src, compiled_spec)
+        print('{0:>12} {1:>14.4f} {2:>14.4f} {3:>7.1f}x'.format(spec_size, unindexed, indexed, unindexed / indexed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+""" Shows how the structural matcher scales on wide and deep documents, against a naive recursive search. """
+
+import time
+
+from pha import Document, elem, html, html_match, structural_match
+
+
+WIDE_ROWS = [10, 100, 1000, 5000]
+DEEP_LEVELS = [10, 50, 200, 800]
+
+# The naive search is exponential, so it is only run while it still finishes in reasonable time
+NAIVE_LIMIT = 12
+
+
+def wide_case(rows):
+    """ A table of identical rows, with a spec asking for all but one of them, which fails on the last cell. """
+
+    html_src = '<html><table>{0}</table></html>'.format(''.join('<tr><td>Row</td><td>Cell</td></tr>'
+                                                                 for _ in range(rows)))
+    spec = html(elem('table', *([elem('tr', elem('td', content='Row'), elem('td', content='Cell'))] * (rows - 1)
+                                + [elem('tr', elem('td', content='Missing'))])))
+    return html_src, spec
+
+
+def deep_case(levels):
+    """ Nested divs, with a spec of half as many nested divs which can be placed in many ways, and then fails. """
+
+    html_src = '<html>{0}{1}</html>'.format('<div>' * levels, '</div>' * levels)
+    spec = elem('span')
+    for _ in range(levels // 2):
+        spec = elem('div', spec)
+    return html_src, html(spec)
+
+
+def naive_match(spec, document):
+    """ The original recursive matcher, which tries every way of placing each def. """
+
+    index = document.index
+
+    def labelled(element_def, position):
+        return element_def.name_matcher.match(index.elements[position].name) \
+            and all(key in index.elements[position].attrs and value in index.elements[position].attrs[key]
+                    for key, value in element_def.attrs.items()) \
+            and (not element_def.content or index.content_contains(position, str(element_def.content)))
+
+    def embeds(element_def, position):
+        return labelled(element_def, position) and forest(element_def.children, position + 1, index.ends[position])
+
+    def forest(element_defs, start, end):
+        if not element_defs:
+            return True
+        return any(embeds(element_defs[0], position) and forest(element_defs[1:], index.ends[position], end)
+                   for position in range(start, end))
+
+    return any(embeds(spec, position) for position in range(1, len(index)))
+
+
+def time_run(function):
+    started = time.perf_counter()
+    function()
+    return time.perf_counter() - started
+
+
+def run_cases(title, build_case, sizes):
+    print(title)
+    print('{0:>8} {1:>16} {2:>12}'.format('size', 'structural (s)', 'naive (s)'))
+    for size in sizes:
+        html_src, spec = build_case(size)
+        document = Document(html_src)
+        structural = time_run(lambda: html_match(spec, document, matcher=structural_match))
+        naive = time_run(lambda: naive_match(spec, document)) if size <= NAIVE_LIMIT else None
+        print('{0:>8} {1:>16.4f} {2:>12}'.format(size, structural, '-' if naive is None else '{0:.4f}'.format(naive)))
+    print('')
+
+
+def main():
+    run_cases('Wide documents (rows in a table)', wide_case, WIDE_ROWS)
+    run_cases('Deep documents (levels of nesting)', deep_case, DEEP_LEVELS)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""
+Times the matcher and the formatters on generated documents and specs, saving the timings as JSON and comparing them
+with a baseline saved from an earlier run, e.g.
+
+    python -m pha.benchmarks.suite --output baseline.json
+    python -m pha.benchmarks.suite --baseline baseline.json
+
+Exits with a status of 1 when anything is slower than the baseline by more than the threshold.
+"""
+
+import argparse
+import json
+import platform
+import sys
+import timeit
+from collections import namedtuple
+
+import bs4
+
+from pha import linear_match, pretty_html, pretty_spec, prune_unmatched_elements
+from pha.benchmarks.generators import generate_spec, generate_tree, render_document
+from pha.parsers import parse_html
+
+
+Case = namedtuple('Case', ['name', 'document', 'spec'])
+Case.__doc__ = """ A benchmark, with the arguments for generate_tree and generate_spec. """
+
+DOCUMENTS = {
+    'wide': dict(depth=2, fan_out=40, text_words=4, attributes=2),
+    'deep': dict(depth=7, fan_out=2, text_words=4, attributes=2),
+    'text': dict(depth=3, fan_out=8, text_words=60, attributes=0),
+    'attributes': dict(depth=3, fan_out=8, text_words=1, attributes=12),
+}
+
+SPECS = {
+    'shallow-content': dict(nested=False, content=True),
+    'nested-content': dict(nested=True, content=True),
+    'shallow-attributes': dict(nested=False, content=False),
+    'nested-attributes': dict(nested=True, content=False),
+}
+
+SPEC_DEFINITIONS = 50
+
+OPERATIONS = ['linear_match', 'prune_unmatched_elements', 'pretty_html', 'pretty_spec']
+
+DEFAULT_THRESHOLD = 1.25
+
+# Timings this close to the baseline are never regressions, as the quickest operations are mostly noise
+MIN_DIFFERENCE = 0.001
+
+
+def build_cases(document_names=None):
+    cases = []
+    for document_name in document_names or sorted(DOCUMENTS):
+        for spec_name in sorted(SPECS):
+            for passing in (True, False):
+                spec_args = dict(SPECS[spec_name], definitions=SPEC_DEFINITIONS, passing=passing)
+                name = '{0}/{1}/{2}'.format(document_name, spec_name, 'pass' if passing else 'fail')
+                cases.append(Case(name, DOCUMENTS[document_name], spec_args))
+    return cases
+
+
+def time_case(case, repeat, seed=0):
+    """ The best of repeat timings of each operation for the case, in seconds. """
+
+    root = generate_tree(seed=seed, **case.document)
+    html_src = render_document(root)
+    spec = generate_spec(root, seed=seed, **case.spec)
+    result = linear_match(spec, html_src)
+    if result.passed != case.spec['passing']:
+        raise AssertionError('Generated spec for {0} {1} unexpectedly'.format(case.name, result.result_text.lower()))
+
+    def best(run, setup=lambda: None):
+        return min(timeit.repeat(run, setup=setup, number=1, repeat=repeat))
+
+    # Pruning removes elements from the tree, so each run needs a freshly parsed tree, which is parsed untimed
+    parsed = {}
+
+    def parse():
+        parsed['root'] = parse_html(html_src)
+
+    return {
+        'linear_match': best(lambda: linear_match(spec, html_src)),
+        'prune_unmatched_elements': best(lambda: prune_unmatched_elements(parsed['root'], spec), setup=parse),
+        'pretty_html': best(lambda: pretty_html(html_src)),
+        'pretty_spec': best(lambda: pretty_spec(spec)),
+    }
+
+
+def run_suite(cases, repeat, progress=None):
+    timings = {}
+    for case in cases:
+        timings[case.name] = time_case(case, repeat)
+        if progress:
+            progress(case.name, timings[case.name])
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'beautifulsoup4': bs4.__version__,
+        },
+        'repeat': repeat,
+        'timings': timings,
+    }
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """ Each timing against the baseline as (case, operation, baseline, timing, ratio, regressed) tuples. """
+
+    comparisons = []
+    for name, timings in sorted(results['timings'].items()):
+        baseline_timings = baseline['timings'].get(name, {})
+        for operation in OPERATIONS:
+            if operation not in baseline_timings:
+                continue
+            baseline_timing, timing = baseline_timings[operation], timings[operation]
+            ratio = timing / baseline_timing if baseline_timing else 1.0
+            regressed = ratio > threshold and timing - baseline_timing > MIN_DIFFERENCE
+            comparisons.append((name, operation, baseline_timing, timing, ratio, regressed))
+    return comparisons
+
+
+def print_timings(name, timings):
+    print('{0:<40} {1}'.format(name, ' '.join('{0:>12.4f}'.format(timings[operation]) for operation in OPERATIONS)))
+
+
+def print_comparisons(comparisons, threshold):
+    print('\nCompared with the baseline (slower by more than {0:.0%} is a regression)'.format(threshold - 1))
+    print('{0:<40} {1:<26} {2:>12} {3:>12} {4:>8}'.format('case', 'operation', 'baseline (s)', 'now (s)', 'ratio'))
+    for name, operation, baseline_timing, timing, ratio, regressed in comparisons:
+        print('{0:<40} {1:<26} {2:>12.4f} {3:>12.4f} {4:>7.2f}x{5}'.format(name, operation, baseline_timing, timing,
+                                                                         ratio, ' REGRESSED' if regressed else ''))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Times the matcher and formatters on generated documents.')
+    parser.add_argument('--output', help='save the timings to this JSON file')
+    parser.add_argument('--baseline', help='compare the timings with those saved in this JSON file')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='the ratio to the baseline above which a timing is a regression')
+    parser.add_argument('--repeat', type=int, default=3, help='time each operation this many times, taking the best')
+    parser.add_argument('--documents', nargs='+', choices=sorted(DOCUMENTS), help='only time these documents')
+    args = parser.parse_args(argv)
+
+    print('{0:<40} {1}'.format('case', ' '.join('{0:>12}'.format(operation[:12]) for operation in OPERATIONS)))
+    results = run_suite(build_cases(args.documents), args.repeat, progress=print_timings)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        comparisons = compare(results, baseline, args.threshold)
+        print_comparisons(comparisons, args.threshold)
+        if any(regressed for _, _, _, _, _, regressed in comparisons):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
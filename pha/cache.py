@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+import weakref
+
+import bs4
+
+from .batch import _result_from_summary, _summary
+from .compiler import compile_spec, spec_fingerprint, spec_root
+from .document import Document
+from .matchers import html_match
+from .version import __version__
+
+
+# Cached results are only used by the same versions of pha and BeautifulSoup which matched them
+_SALT = 'pha {0}, beautifulsoup4 {1}'.format(__version__, bs4.__version__)
+
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+
+# The digests of the specs seen so far, which are the same for every spec with the same structure
+_SPEC_DIGESTS = weakref.WeakKeyDictionary()
+
+
+class ResultCache(object):
+    """
+    Results of matches kept on disk, so that a spec matched against the same html in a later run (such as the next CI
+    build) gets its result without parsing anything.
+
+    Results are keyed by a digest of the html, a digest of the structure of the spec, the matcher and its options, and
+    the versions of pha and BeautifulSoup, and the cache is a single SQLite database which any number of processes
+    (such as pytest-xdist workers) can share. Only the verdict and a compact summary of a failure are kept, so a cached
+    failure says which definitions failed and weren't found, but not where they first matched, and its report shows the
+    full source (parsed only when the report is rendered) but not the pruned source. Once the entries add up to more
+    than max_bytes, the least recently used are evicted.
+
+    Html given as a stream, matches asked for stats, and matchers which can't be imported by name (such as lambdas),
+    are always matched rather than cached.
+    """
+
+    # A result is only marked as used again once its last mark is this many seconds old, so which results were used
+    # least recently is only known to within this
+    used_resolution = 60
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = os.fspath(path)
+        self.max_bytes = max_bytes
+        self._connection = None
+        self._pid = None
+
+    def match(self, spec, html_src, matcher=None, **options):
+        """ The cached result of matching the html against the spec, matching it (and caching the result) on a miss. """
+
+        key = self.key(spec, html_src, matcher, options)
+        result = None if key is None else self.get(key, spec, html_src)
+        if result is None:
+            result = html_match(spec, html_src, matcher=matcher, **options)
+            if key is not None:
+                self.put(key, spec, html_src, result)
+        return result
+
+    def key(self, spec, html_src, matcher=None, options=None):
+        """ The key the result of the match is cached under, or None when it can't be cached. """
+
+        options = dict(options or {})
+        if isinstance(html_src, Document):
+            options.setdefault('parser', html_src.parser)
+            options.setdefault('encoding', html_src.encoding)
+            html_src = html_src.html_src
+        matcher_name = _matcher_name(matcher)
+        if not isinstance(html_src, (str, bytes)) or options.get('stats') or matcher_name is None:
+            return None
+
+        html_digest = hashlib.sha256(html_src.encode('utf-8', 'surrogatepass') if isinstance(html_src, str)
+                                     else html_src)
+        # The same characters given as a string and as bytes aren't the same html, as bytes have to be decoded
+        html_digest.update(b's' if isinstance(html_src, str) else b'b')
+        options = sorted((name, repr(value)) for name, value in options.items() if value is not None)
+        key = [_SALT, html_digest.hexdigest(), spec_digest(spec), matcher_name, options]
+        return hashlib.sha256(json.dumps(key).encode('utf-8')).hexdigest()
+
+    def get(self, key, spec, html_src):
+        """ The cached result for the key, or None. """
+
+        connection = self._connect()
+        row = connection.execute('SELECT summary, used FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        # Marking it takes the database's write lock, which every process sharing the cache would take turns on
+        now = time.time()
+        if now - row[1] >= self.used_resolution:
+            connection.execute('UPDATE results SET used = ? WHERE key = ?', (now, key))
+        if isinstance(html_src, Document):
+            html_src = html_src.html_src
+        element_defs = compile_spec(spec).element_defs_for(spec_root(spec))
+        return _result_from_summary(spec, element_defs, html_src, json.loads(row[0]))
+
+    def put(self, key, spec, html_src, result):
+        """ Caches the result under the key, evicting the least recently used results to keep within max_bytes. """
+
+        element_defs = compile_spec(spec).element_defs_for(spec_root(spec))
+        definition_indexes = dict((id(element_def), index) for index, element_def in enumerate(element_defs))
+        summary = json.dumps(_summary(definition_indexes, html_src, result))
+        connection = self._connect()
+        connection.execute('INSERT OR REPLACE INTO results (key, summary, size, used) VALUES (?, ?, ?, ?)',
+                           (key, summary, len(key) + len(summary), time.time()))
+        self._evict(connection)
+
+    def clear(self):
+        self._connect().execute('DELETE FROM results')
+
+    def __len__(self):
+        return self._connect().execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    def __repr__(self):
+        return 'ResultCache[path={0},max_bytes={1}]'.format(self.path, self.max_bytes)
+
+    def _evict(self, connection):
+        size = connection.execute('SELECT TOTAL(size) FROM results').fetchone()[0]
+        if size <= self.max_bytes:
+            return
+        evicted = []
+        for key, entry_size in connection.execute('SELECT key, size FROM results ORDER BY used'):
+            if size <= self.max_bytes:
+                break
+            evicted.append((key,))
+            size -= entry_size
+        connection.executemany('DELETE FROM results WHERE key = ?', evicted)
+
+    def _connect(self):
+        # A connection can't be shared with a forked process, so each process opens its own
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+            self._connection.execute('CREATE TABLE IF NOT EXISTS results '
+                                     '(key TEXT PRIMARY KEY, summary TEXT NOT NULL, size INTEGER NOT NULL, '
+                                     'used REAL NOT NULL)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS results_used ON results (used)')
+            self._pid = os.getpid()
+        return self._connection
+
+    def __getstate__(self):
+        return {'path': self.path, 'max_bytes': self.max_bytes, '_connection': None, '_pid': None}
+
+
+def spec_digest(spec):
+    """ A digest of the structure of the spec, which is the same in every run for specs with the same structure. """
+
+    spec = spec_root(spec)
+    digest = _SPEC_DIGESTS.get(spec)
+    if digest is None:
+        digest = _fingerprint_digest(spec_fingerprint(spec), {})
+        _SPEC_DIGESTS[spec] = digest
+    return digest
+
+
+def _fingerprint_digest(fingerprint, digests):
+    # Shared element defs share their fingerprints, so each is only digested once however many times it appears
+    digest = digests.get(id(fingerprint))
+    if digest is None:
+        name_regex, content, attrs, children = fingerprint
+        digest = hashlib.sha256(json.dumps([name_regex, content, attrs, [
+            _fingerprint_digest(child, digests) for child in children]]).encode('utf-8')).hexdigest()
+        digests[id(fingerprint)] = digest
+    return digest
+
+
+def _matcher_name(matcher):
+    """ The name the matcher can be imported by, or None if it can't be (so it can't be told apart from others). """
+
+    if matcher is None or isinstance(matcher, str):
+        return matcher or 'linear'
+    module_name = getattr(matcher, '__module__', None)
+    qualname = getattr(matcher, '__qualname__', None)
+    if module_name is None or qualname is None:
+        return None
+    target = sys.modules.get(module_name)
+    for name in qualname.split('.'):
+        target = getattr(target, name, None)
+    return '{0}.{1}'.format(module_name, qualname) if target is matcher else None
@@ -0,0 +1,172 @@
+import re
+import weakref
+from collections import OrderedDict, namedtuple
+
+from .textsearch import NeedleSearch
+
+
+CompiledElementDef = namedtuple('CompiledElementDef', ['name_matcher', 'attrs', 'content'])
+CompiledElementDef.__doc__ = """ The parts of an element def used when matching, with attrs as (key, value) pairs. """
+
+
+# Compiled specs are shared by every spec with the same structure for as long as any of them is in use, and remembered
+# against each spec object we have compiled, so recompiling the same spec object doesn't even need to walk it. A
+# compiled spec holds on to its spec, so both are held weakly, and only the most recently used compiled specs are kept
+# alive by the cache itself (RECENTLY_COMPILED_MAX of them, which set_max_compiled_specs changes).
+_COMPILED_BY_FINGERPRINT = weakref.WeakValueDictionary()
+_COMPILED_BY_SPEC = weakref.WeakKeyDictionary()
+_RECENTLY_COMPILED = OrderedDict()
+RECENTLY_COMPILED_MAX = 512
+
+# Name regexes which just match a single literal tag name, such as those built by elem()
+_LITERAL_NAME_REGEX = re.compile(r'^\^([\w:-]+)\$$')
+
+
+class CompiledSpec(object):
+    """ A spec flattened and prepared for matching, which can be reused for any number of matches. """
+
+    __slots__ = ('spec', 'fingerprint', 'element_defs', 'definitions', 'defs_by_name', 'defs_by_regex',
+                 'needle_search', '_candidates_by_name', '__weakref__')
+
+    def __init__(self, spec, fingerprint):
+        element_defs = []
+        _flatten_element_definitions_rec(spec, element_defs)
+        compiled_defs = {}
+        definitions = tuple(compiled_defs.get(id(element_def)) or
+                            compiled_defs.setdefault(id(element_def), _compile_element_def(element_def))
+                            for element_def in element_defs)
+
+        # Definitions are bucketed by their literal tag name, and the few with a real regex (such as heading or text)
+        # are kept to one side, so each element only needs testing against the definitions which could match it.
+        defs_by_name = {}
+        defs_by_regex = []
+        for index, element_def in enumerate(element_defs):
+            literal_name = _LITERAL_NAME_REGEX.match(element_def.name_regex)
+            if literal_name:
+                defs_by_name.setdefault(literal_name.group(1), []).append(index)
+            else:
+                defs_by_regex.append(index)
+
+        object.__setattr__(self, 'spec', spec)
+        object.__setattr__(self, 'fingerprint', fingerprint)
+        object.__setattr__(self, 'element_defs', tuple(element_defs))
+        object.__setattr__(self, 'definitions', definitions)
+        object.__setattr__(self, 'defs_by_name', dict((name, tuple(indexes))
+                                                      for name, indexes in defs_by_name.items()))
+        object.__setattr__(self, 'defs_by_regex', tuple(defs_by_regex))
+        object.__setattr__(self, 'needle_search', NeedleSearch(definition.content for definition in definitions))
+        object.__setattr__(self, '_candidates_by_name', {})
+
+    def __setattr__(self, name, value):
+        raise AttributeError('CompiledSpec is immutable')
+
+    def __len__(self):
+        return len(self.definitions)
+
+    def __reduce__(self):
+        # Only the spec is sent when pickling, and compiled again (or found in the cache) on the other side
+        return compile_spec, (self.spec,)
+
+    def __repr__(self):
+        return 'CompiledSpec[definitions={0},spec={1!r}]'.format(len(self.definitions), self.spec)
+
+    def candidates(self, name):
+        """ The indexes of the definitions whose name matches the given tag name, in spec order. """
+
+        candidates = self._candidates_by_name.get(name)
+        if candidates is None:
+            regex_matches = [index for index in self.defs_by_regex if self.definitions[index].name_matcher.match(name)]
+            candidates = tuple(sorted(self.defs_by_name.get(name, ()) + tuple(regex_matches)))
+            self._candidates_by_name[name] = candidates
+        return candidates
+
+    def element_defs_for(self, spec):
+        """ The flattened element defs of the given spec, which may be a different spec with the same structure. """
+
+        if spec is self or spec is self.spec:
+            return self.element_defs
+        return _flatten_element_definitions(spec)
+
+
+def compile_spec(spec):
+    """ Compiles the spec, returning a previously compiled spec if one with the same structure has been seen. """
+
+    if isinstance(spec, CompiledSpec):
+        return spec
+
+    compiled_ref = _COMPILED_BY_SPEC.get(spec)
+    compiled_spec = None if compiled_ref is None else compiled_ref()
+    if compiled_spec is None:
+        fingerprint = spec_fingerprint(spec)
+        compiled_spec = _COMPILED_BY_FINGERPRINT.get(fingerprint)
+        if compiled_spec is None:
+            compiled_spec = CompiledSpec(spec, fingerprint)
+            _COMPILED_BY_FINGERPRINT[fingerprint] = compiled_spec
+        _COMPILED_BY_SPEC[spec] = weakref.ref(compiled_spec)
+
+    # Keyed by id, as hashing a fingerprint walks the whole spec, and the entry keeps the id from being reused
+    _RECENTLY_COMPILED.pop(id(compiled_spec), None)
+    _RECENTLY_COMPILED[id(compiled_spec)] = compiled_spec
+    _forget_least_recently_compiled()
+    return compiled_spec
+
+
+def set_max_compiled_specs(max_compiled_specs):
+    """ Sets how many of the most recently used compiled specs compile_spec keeps, forgetting any beyond that. """
+
+    global RECENTLY_COMPILED_MAX
+    RECENTLY_COMPILED_MAX = max_compiled_specs
+    _forget_least_recently_compiled()
+
+
+def _forget_least_recently_compiled():
+    while len(_RECENTLY_COMPILED) > RECENTLY_COMPILED_MAX:
+        _RECENTLY_COMPILED.popitem(last=False)
+
+
+def spec_root(spec):
+    """ The root element def of a spec, which may have been compiled. """
+
+    return spec.spec if isinstance(spec, CompiledSpec) else spec
+
+
+def spec_fingerprint(spec):
+    """ A hashable value which is equal for any two specs with the same structure. """
+
+    if isinstance(spec, CompiledSpec):
+        return spec.fingerprint
+    return _element_def_fingerprint(spec, {})
+
+
+def _element_def_fingerprint(element_def, fingerprints):
+    # Identical element defs are shared, so each is only fingerprinted once however many times it appears
+    fingerprint = fingerprints.get(id(element_def))
+    if fingerprint is None:
+        fingerprint = (element_def.name_regex,
+                       repr(element_def.content),
+                       tuple(sorted((key, repr(value)) for key, value in element_def.attrs.items())),
+                       tuple(_element_def_fingerprint(child, fingerprints) for child in element_def.children))
+        fingerprints[id(element_def)] = fingerprint
+    return fingerprint
+
+
+def _compile_element_def(element_def):
+    content = str(element_def.content) if element_def.content else None
+    return CompiledElementDef(element_def.name_matcher, tuple(element_def.attrs.items()), content)
+
+
+def _flatten_element_definitions(spec):
+    """ Flattens the spec from a tree to a list using a depth first search. """
+
+    if isinstance(spec, CompiledSpec):
+        return list(spec.element_defs)
+
+    all_element_definitions = []
+    _flatten_element_definitions_rec(spec, all_element_definitions)
+    return all_element_definitions
+
+
+def _flatten_element_definitions_rec(current_element_def, all_element_definitions):
+    all_element_definitions.append(current_element_def)
+    for child in current_element_def.children:
+        _flatten_element_definitions_rec(child, all_element_definitions)
@@ -0,0 +1,25 @@
+from .index import DocumentIndex
+from .parsers import parse_html, read_html
+
+
+class Document(object):
+    """
+    An html document parsed and indexed once, which can be matched against any number of specs.
+
+    Matching never changes the document, so every match sees the page as it was parsed, and needles found for one
+    spec are remembered for the next.
+    """
+
+    def __init__(self, html_src, parser=None, encoding=None, root_element=None):
+        self.html_src = read_html(html_src)
+        self.parser = parser
+        self.encoding = encoding
+        # A matcher which has already parsed the html hands over its tree, rather than having it parsed again
+        self.root_element = parse_html(self.html_src, parser, encoding) if root_element is None else root_element
+        self.index = DocumentIndex(self.root_element)
+
+    def __len__(self):
+        return len(self.index) - 1
+
+    def __repr__(self):
+        return 'Document[parser={0},elements={1}]'.format(self.parser, len(self))
@@ -0,0 +1,192 @@
+import codecs
+import mmap
+import re
+from html.entities import html5
+
+from .compiler import compile_spec
+from .matchers import MatcherResult, html_match
+from .parsers import HTML_PARSER, _MIN_ENCODING_SAMPLE, _detect_encoding
+from .textsearch import NeedleSearch, _build_trie
+from .xpath import xpath_match
+
+
+# Where a needle isn't in the file as it is, it could still be there written with character references, which each
+# stand for one character, apart from these few named references which stand for two
+_REFERENCE = b'&[#\\w]+;?'
+_TWO_CHARACTER_REFERENCES = frozenset(value for value in html5.values() if len(value) == 2)
+
+# The encodings where every character is always written the same way, so text can be found in the encoded file
+_SINGLE_BYTE_ENCODING = re.compile(r'^(ascii|iso8859-\d+|cp125\d)$')
+
+# The characters which parsers other than html.parser change: newlines are normalized, NUL is dropped or replaced, and
+# html5lib reads the C1 controls as windows-1252
+_NORMALIZED_CHARACTERS = re.compile('[\r\n\x00\x80-\x9f]')
+
+
+def html_match_file(spec, path, matcher=None, encoding=None, **options):
+    """
+    Matches the html file against the spec, without ever reading it all into memory.
+
+    The file is memory mapped, and the content the spec needs is first looked for in the mapped bytes. When some of it
+    is nowhere in the file the match fails straight away, without parsing anything, and the result lists the
+    definitions whose content is missing. Otherwise the file is matched with the stream matcher (unless another matcher
+    is provided), which parses views onto the mapped file a chunk at a time. The result of a failed match keeps the
+    path, and only reads the file again if its report is rendered.
+    """
+
+    with open(path, 'rb') as html_file:
+        if not html_file.seek(0, 2):
+            # An empty file can't be memory mapped
+            return _without_source(html_match(spec, b'', matcher=matcher or 'stream', encoding=encoding, **options))
+
+        with mmap.mmap(html_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            compiled_spec = compile_spec(spec)
+            missing_indexes = _missing_content_indexes(compiled_spec, mapped, encoding,
+                                                       _keeps_characters(matcher, options.get('parser')))
+            if missing_indexes:
+                element_defs = compiled_spec.element_defs_for(spec)
+                return MatcherResult(spec,
+                                     None,
+                                     None,
+                                     passed=False,
+                                     element_defs_not_found=[element_defs[index] for index in missing_indexes],
+                                     unmatched_def=element_defs[missing_indexes[0]],
+                                     bytes_consumed=len(mapped))
+
+            with memoryview(mapped) as view:
+                result = html_match(spec, view, matcher=matcher or 'stream', encoding=encoding, **options)
+            result = _without_source(result)
+            if result.failed:
+                result.html_path = path
+            return result
+
+
+def _without_source(result):
+    result.html_src = None
+    return result
+
+
+def _keeps_characters(matcher, parser):
+    # Every parser but html.parser normalizes newlines and replaces some control characters, and the xpath matcher
+    # always parses with lxml
+    return parser in (None, HTML_PARSER) and matcher not in ('xpath', xpath_match)
+
+
+def _missing_content_indexes(compiled_spec, mapped, encoding, keeps_characters=True):
+    """
+    The indexes of the definitions whose content is certainly nowhere in the mapped html.
+
+    Content is looked for in the encoded bytes, so this only checks content we know how the file encodes. When the
+    encoding isn't given we only know that for ASCII content, as the encoding we'd detect from the start of the file
+    could turn out to be wrong. Unless the parser keeps every character as it is in the file, content with characters
+    the parser could have changed isn't checked either.
+    """
+
+    sample = mapped[:_MIN_ENCODING_SAMPLE]
+    encoding_name = codecs.lookup(encoding or _detect_encoding(sample, len(sample) == len(mapped))[1]).name
+    if encoding_name != 'utf-8' and not _SINGLE_BYTE_ENCODING.match(encoding_name):
+        return []
+    encoding = encoding or 'ascii'
+
+    # The definitions looking for each needle, and the needles we can look for as they would be written in the file
+    indexes_by_needle = {}
+    for index, definition in enumerate(compiled_spec.definitions):
+        if definition.content:
+            indexes_by_needle.setdefault(definition.content, []).append(index)
+    encoded_needles = {}
+    for needle in indexes_by_needle:
+        encoded_needle = _encoded_needle(needle, encoding, keeps_characters)
+        if encoded_needle is not None:
+            encoded_needles[needle] = encoded_needle
+    if not encoded_needles:
+        return []
+
+    # Every needle is looked for in a single pass over the file, and those not found in another pass for them all
+    found = NeedleSearch(encoded_needles.values()).needles_in(mapped)
+    not_found = [needle for needle, encoded_needle in encoded_needles.items() if encoded_needle not in found]
+    if not_found and mapped.find(b'&') != -1:
+        written_with_references = _written_with_references(not_found, mapped, encoding)
+        not_found = [needle for needle in not_found if needle not in written_with_references]
+    return sorted(index for needle in not_found for index in indexes_by_needle[needle])
+
+
+def _encoded_needle(needle, encoding, keeps_characters):
+    """ The needle as it would be written in the file, or None if it could be written some other way. """
+
+    # Strings of nothing but whitespace are collapsed when parsing, and bytes which can't be decoded are replaced, so
+    # neither may be in the file as they are
+    if not needle.strip() or '\ufffd' in needle:
+        return None
+    if not keeps_characters and _NORMALIZED_CHARACTERS.search(needle):
+        return None
+    try:
+        return needle.encode(encoding)
+    except UnicodeEncodeError:
+        return None
+
+
+def _written_with_references(needles, mapped, encoding):
+    """ The needles which could be in the mapped html written with character references. """
+
+    written = set(needle for needle in needles
+                  if any(needle[start:start + 2] in _TWO_CHARACTER_REFERENCES for start in range(len(needle) - 1)))
+    patterns = dict((needle, re.compile(_reference_regex(_build_trie([needle]), encoding)))
+                    for needle in needles if needle not in written)
+
+    # The first place any needle left could be written is found with one regex for them all, then the needles which
+    # could be written there are dropped and the search carries on from there, so the file is only read through once
+    position = 0
+    while patterns:
+        try:
+            match = re.compile(_first_reference_regex(_build_trie(patterns), encoding)).search(mapped, position)
+        except (RecursionError, re.error):
+            # Pathological needles, nested too deeply for the regex engine, are looked for in turn instead
+            written.update(needle for needle, pattern in patterns.items() if pattern.search(mapped, position))
+            break
+        if match is None:
+            break
+        position = match.start()
+        for needle, pattern in list(patterns.items()):
+            if pattern.match(mapped, position):
+                written.add(needle)
+                del patterns[needle]
+        position += 1
+    return written
+
+
+def _reference_regex(node, encoding):
+    """
+    A regex matching wherever any needle in the trie could be written, with any of its characters written as a
+    character reference.
+    """
+
+    if None in node:
+        # A needle ends here, so it's been found
+        return b''
+    branches = [_reference_character(char, encoding) + rest for char, rest in _reference_branches(node, encoding)]
+    return branches[0] if len(branches) == 1 else b'(?:' + b'|'.join(branches) + b')'
+
+
+def _first_reference_regex(trie, encoding):
+    # Every needle could start with a character reference, which is only matched the once rather than for each needle,
+    # and otherwise starts with a character the regex engine can skip ahead to
+    branches = list(_reference_branches(trie, encoding))
+    return b'(?:' + b'|'.join([re.escape(char.encode(encoding)) + rest for char, rest in branches] +
+                              [_REFERENCE + b'(?:' + b'|'.join(rest for _, rest in branches) + b')']) + b')'
+
+
+def _reference_branches(node, encoding):
+    """ The first character of each branch from the node, with a regex for the rest of the branch. """
+
+    for char, child in node.items():
+        # Runs of characters without any choice are written out in a loop, so only branches and ends need recursion
+        chars = []
+        while len(child) == 1 and None not in child:
+            (next_char, child), = child.items()
+            chars.append(next_char)
+        rest = b''.join(_reference_character(rest_char, encoding) for rest_char in chars)
+        yield char, rest + _reference_regex(child, encoding)
+
+
+def _reference_character(char, encoding):
+    return b'(?:' + re.escape(char.encode(encoding)) + b'|' + _REFERENCE + b')'
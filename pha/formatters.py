@@ -1,8 +1,13 @@
+import io
+import re
+
 from bs4 import BeautifulSoup
 
+from .parsers import _BUILDER, _VOID_ELEMENTS, HTML_PARSER, parse_html
+
 
-def pretty_html(html_src):
-    parsed_html = BeautifulSoup(html_src)
+def pretty_html(html_src, parser=None, encoding=None):
+    parsed_html = parse_html(html_src, parser, encoding)
     return parsed_html.prettify()
 
 
@@ -23,18 +28,176 @@ _POST_PARSE_REPLACEMENTS = {
     '&gt;': '>'
 }
 
+# The spec is written out as BeautifulSoup would prettify it once parsed as html, which we can do directly unless
+# parsing it would change it: names and keys html.parser would read differently, values and content with markup or
+# entities in them, and the elements whose content is not parsed or not pretty printed (such as script and pre). A
+# title or textarea is only safe without children, as some versions of html.parser read everything inside it as text.
+_SAFE_NAME = re.compile(r'^[a-zA-Z][^\s/>\x00<&"\'=]*$')
+_SAFE_KEY = re.compile(r'^[a-zA-Z_:][-\w:.]*$')
+_UNSAFE_VALUE = re.compile('["&\r\x00]')
+_UNSAFE_CONTENT = re.compile('[<&\r\x00]')
+_UNFORMATTED_ELEMENTS = frozenset(['iframe', 'noembed', 'noframes', 'noscript', 'plaintext', 'script', 'style', 'xmp'])\
+    .union(getattr(_BUILDER, 'preserve_whitespace_tags', ()))
+_TEXT_ELEMENTS = frozenset(['textarea', 'title'])
+# Attributes BeautifulSoup splits into a list of values, which are then written out separated by single spaces
+_LIST_ATTRIBUTES = frozenset(key for keys in getattr(_BUILDER, 'cdata_list_attributes', {}).values() for key in keys)
+
+
+def pretty_spec(spec, max_depth=None, max_width=None):
+    """
+    The spec as indented html, with the name regexes simplified (so ^(h1|h2)$ is written as h1|h2).
+
+    With max_depth set only that many levels of the spec are written, and with max_width set only that many children of
+    each element def, each with a comment saying how many element defs were left out in their place.
+    """
+
+    writer = io.StringIO()
+    write_spec(spec, writer, max_depth, max_width)
+    return writer.getvalue()
+
+
+def write_spec(spec, writer, max_depth=None, max_width=None):
+    """
+    Writes the spec to the writer (anything with a write method, such as an open file) a line at a time, as
+    pretty_spec formats it.
+
+    The lines are written straight from the element defs, and a shared element def is only formatted once however
+    often it appears. A spec which html.parser would read differently from how it is written, such as one with markup
+    in its content, is formatted by parsing it as pretty_spec always used to.
+    """
+
+    formatted = _formatted_defs(spec)
+    if formatted is None:
+        writer.write(_parsed_spec_html(spec, max_depth, max_width))
+        return
+
+    subtree_sizes = {}
+    stack = [(spec, 1, 0)]
+    while stack:
+        element_def, depth, level = stack.pop()
+        if isinstance(element_def, str):
+            writer.write(element_def)
+            continue
+
+        open_tag, content, close_tag = formatted[id(element_def)]
+        writer.write(' ' * level + open_tag + '\n')
+        # Void elements can't hold anything, so what is inside them in the spec is parsed as following them
+        inner_level = level if close_tag is None else level + 1
+        if close_tag is not None:
+            stack.append((' ' * level + close_tag + '\n', None, None))
+        shown, omitted = _shown_children(element_def, depth, max_depth, max_width, subtree_sizes)
+        if omitted:
+            stack.append((' ' * inner_level + _omitted_comment(omitted) + '\n', None, None))
+        stack.extend((child, depth + 1, inner_level) for child in reversed(shown))
+        if content:
+            writer.write(' ' * inner_level + content + '\n')
+
+
+def _formatted_defs(spec):
+    """ The opening tag, content and closing tag of each element def in the spec by id, or None if any is unsafe. """
+
+    formatted = {}
+    stack = [spec]
+    while stack:
+        element_def = stack.pop()
+        if id(element_def) in formatted:
+            continue
+        formatted_def = _formatted_def(element_def)
+        if formatted_def is None:
+            return None
+        formatted[id(element_def)] = formatted_def
+        stack.extend(element_def.children)
+    return formatted
+
+
+def _formatted_def(element_def):
+    name = _spec_name(element_def)
+    if not _SAFE_NAME.match(name):
+        return None
+    name = name.lower()
+    if name in _UNFORMATTED_ELEMENTS or (name in _TEXT_ELEMENTS and element_def.children):
+        return None
+
+    attrs = {}
+    for key, value in element_def.attrs.items():
+        value = '{0}'.format(value)
+        if not _SAFE_KEY.match(key) or key.lower() in attrs or _UNSAFE_VALUE.search(value):
+            return None
+        if key.lower() in _LIST_ATTRIBUTES and value != ' '.join(value.split()):
+            return None
+        attrs[key.lower()] = value
+    attr_string = ''.join(' {0}="{1}"'.format(key, value) for key, value in sorted(attrs.items()))
+
+    content = element_def.content
+    if content:
+        if isinstance(content, bytes):
+            try:
+                content = content.decode('utf-8')
+            except UnicodeDecodeError:
+                return None
+        if not isinstance(content, str) or _UNSAFE_CONTENT.search(content):
+            return None
+        content = _replaced(content.strip())
 
-def pretty_spec(spec):
-    pretty_spec_html = BeautifulSoup(_build_spec_html(spec)).prettify()
+    if name in _VOID_ELEMENTS:
+        return _replaced('<{0}{1}/>'.format(name, attr_string)), content, None
+    return _replaced('<{0}{1}>'.format(name, attr_string)), content, _replaced('</{0}>'.format(name))
+
+
+def _spec_name(element_def):
+    element_name = element_def.name_regex[1:-1]
+    for before, after in _PRE_PARSE_REPLACEMENTS.items():
+        element_name = element_name.replace(before, after)
+    return element_name
+
+
+def _replaced(pretty_spec_html):
     for before, after in _POST_PARSE_REPLACEMENTS.items():
         pretty_spec_html = pretty_spec_html.replace(before, after)
     return pretty_spec_html
 
 
-def _build_spec_html(spec):
-    element_name = spec.name_regex[1:-1]
-    for before, after in _PRE_PARSE_REPLACEMENTS.items():
-        element_name = element_name.replace(before, after)
+def _shown_children(element_def, depth, max_depth, max_width, subtree_sizes):
+    """ The children of the element def which are written, and how many element defs are left out in their place. """
+
+    children = element_def.children
+    if max_depth is not None and depth >= max_depth:
+        shown = ()
+    elif max_width is not None and len(children) > max_width:
+        shown = children[:max_width]
+    else:
+        return children, 0
+    return shown, sum(_subtree_size(child, subtree_sizes) for child in children[len(shown):])
+
+
+def _subtree_size(element_def, subtree_sizes):
+    """ How many element defs there are in the flattened subtree, counting each place a shared one appears. """
+
+    stack = [(element_def, False)]
+    while stack:
+        element_def, children_sized = stack.pop()
+        if id(element_def) in subtree_sizes:
+            continue
+        if children_sized:
+            subtree_sizes[id(element_def)] = 1 + sum(subtree_sizes[id(child)] for child in element_def.children)
+        else:
+            stack.append((element_def, True))
+            stack.extend((child, False) for child in element_def.children)
+    return subtree_sizes[id(element_def)]
+
+
+def _omitted_comment(omitted):
+    return '<!-- {0} more element def{1} -->'.format(omitted, '' if omitted == 1 else 's')
+
+
+def _parsed_spec_html(spec, max_depth, max_width):
+    pretty_spec_html = BeautifulSoup(_build_spec_html(spec, max_depth, max_width), HTML_PARSER).prettify()
+    return _replaced(pretty_spec_html)
+
+
+def _build_spec_html(spec, max_depth=None, max_width=None, depth=1, subtree_sizes=None):
+    subtree_sizes = {} if subtree_sizes is None else subtree_sizes
+    element_name = _spec_name(spec)
 
     attr_string = ''
     for key, value in spec.attrs.items():
@@ -47,8 +210,11 @@ def _build_spec_html(spec):
         except:
             html_string += spec.content
 
-    for child in spec.children:
-        html_string += _build_spec_html(child)
+    shown, omitted = _shown_children(spec, depth, max_depth, max_width, subtree_sizes)
+    for child in shown:
+        html_string += _build_spec_html(child, max_depth, max_width, depth + 1, subtree_sizes)
+    if omitted:
+        html_string += _omitted_comment(omitted)
     html_string += '</{0}>'.format(element_name)
 
     return html_string
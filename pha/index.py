@@ -0,0 +1,278 @@
+import copy
+from bisect import bisect_left, bisect_right
+
+from bs4.element import NavigableString, Tag
+
+from .parsers import _MAIN_STRING_TYPES
+from .textsearch import NeedleSearch
+
+
+class DocumentIndex(object):
+    """
+    A flat, one pass index of a parsed document, shared by the pruning, the linear scan and the failure diagnostics.
+
+    Elements are numbered in document order with the root at position zero, so the descendants of an element are
+    the positions up to its end, and the strings inside it are the text nodes between its text start and text end.
+    Content checks look up which text nodes contain a needle rather than walking the element's strings each time.
+    """
+
+    def __init__(self, root_element):
+        self.elements = [root_element]
+        self.parents = [-1]
+        self.ends = []
+        self.text_starts = [0]
+        self.text_ends = []
+        self.texts = []
+        self.text_types = []
+        self.text_owners = []
+        self.kept = None
+        self._hits = {}
+        self._kept_hits = {}
+        self._attribute_values = {}
+        self._attribute_hits = {}
+
+        positions = {id(root_element): 0}
+        for node, parent, string_type in _index_nodes(root_element):
+            if string_type is None:
+                positions[id(node)] = len(self.elements)
+                self.elements.append(node)
+                self.parents.append(positions[id(parent)])
+                self.text_starts.append(len(self.texts))
+            else:
+                self.texts.append(node)
+                self.text_types.append(string_type)
+                self.text_owners.append(positions[id(parent)])
+
+        # Children come after their parents, so working backwards we always see a child before its parent
+        self.ends = [position + 1 for position in range(len(self.elements))]
+        self.text_ends = list(self.text_starts)
+        for text_position, owner in enumerate(self.text_owners):
+            self.text_ends[owner] = text_position + 1
+        for position in range(len(self.elements) - 1, 0, -1):
+            parent = self.parents[position]
+            self.ends[parent] = max(self.ends[parent], self.ends[position])
+            self.text_ends[parent] = max(self.text_ends[parent], self.text_ends[position])
+
+    def __len__(self):
+        return len(self.elements)
+
+    def content_contains(self, position, needle, pruned=False):
+        """
+        Checks whether any string inside the element contains the needle.
+
+        When pruned is set, only strings belonging to elements which survived the pruning count, as if the pruned
+        elements had been removed from the tree.
+        """
+
+        start, end = self.text_starts[position], self.text_ends[position]
+        string_types = _string_types(self.elements[position])
+        if string_types != _MAIN_STRING_TYPES:
+            return any(self.text_types[text_position] in string_types
+                       and needle in self.texts[text_position]
+                       and (not pruned or self.kept[self.text_owners[text_position]])
+                       for text_position in range(start, end))
+
+        hits = self._kept_needle_hits(needle) if pruned else self._needle_hits(needle)
+        hit = bisect_left(hits, start)
+        return hit < len(hits) and hits[hit] < end
+
+    def search_needles(self, needle_search):
+        """ Finds the text nodes containing each of the spec's needles, in one pass over the text for large specs. """
+
+        needles = [needle for needle in needle_search.needles if needle not in self._hits]
+        if not needles:
+            return
+        if len(needles) < len(needle_search.needles):
+            needle_search = NeedleSearch(needles)
+        main_texts = [(text_position, text) for text_position, text in enumerate(self.texts)
+                      if self.text_types[text_position] in _MAIN_STRING_TYPES]
+        hits = needle_search.search([text for _, text in main_texts])
+        for needle, needle_hits in hits.items():
+            self._hits[needle] = [main_texts[hit][0] for hit in needle_hits]
+
+    def attribute_positions(self, key, value):
+        """
+        The positions of the elements whose attribute contains the value, in document order.
+
+        This has the semantics of matching a def's attribute, so for attributes with several values, such as class, the
+        value must be one of them, and otherwise it can be any part of the attribute. The values are indexed by key
+        the first time the key is looked up, and the positions are remembered for each value.
+        """
+
+        if not isinstance(value, str):
+            # Anything else is tested against each element with the attribute, just as when matching
+            return [position for position in self._attribute_index(key).positions
+                    if value in self.elements[position].attrs[key]]
+
+        positions = self._attribute_hits.get((key, value))
+        if positions is None:
+            positions = self._attribute_index(key).positions_containing(value)
+            self._attribute_hits[key, value] = positions
+        return positions
+
+    def has_attribute_index(self, key):
+        return key in self._attribute_values
+
+    def set_kept(self, kept):
+        self.kept = kept
+        self._kept_hits = {}
+
+    def with_kept(self, kept):
+        """
+        A view of the index with the given elements kept, leaving this index as it is.
+
+        The view shares everything else with this index, including the needles already searched for, so one document
+        can be pruned for any number of specs.
+        """
+
+        view = copy.copy(self)
+        view.set_kept(kept)
+        return view
+
+    def render(self, pretty=False):
+        """ Renders the document as if the elements which weren't kept had been removed, without changing the tree. """
+
+        root_element = self.elements[0]
+        if self.kept is None:
+            return root_element.prettify() if pretty else str(root_element)
+        if not isinstance(root_element, Tag):
+            return root_element.render_kept(self.kept, pretty)
+
+        dropped = set(id(element) for position, element in enumerate(self.elements) if not self.kept[position])
+        return root_element.decode(indent_level=0 if pretty else None, iterator=_kept_soup_nodes(root_element, dropped))
+
+    def _attribute_index(self, key):
+        attribute_index = self._attribute_values.get(key)
+        if attribute_index is None:
+            attribute_index = _AttributeIndex(key, self.elements)
+            self._attribute_values[key] = attribute_index
+        return attribute_index
+
+    def _needle_hits(self, needle):
+        """ The text nodes which contain the needle, and count as element content, in document order. """
+
+        hits = self._hits.get(needle)
+        if hits is None:
+            hits = [text_position for text_position, text in enumerate(self.texts)
+                    if needle in text and self.text_types[text_position] in _MAIN_STRING_TYPES]
+            self._hits[needle] = hits
+        return hits
+
+    def _kept_needle_hits(self, needle):
+        hits = self._kept_hits.get(needle)
+        if hits is None:
+            hits = [text_position for text_position in self._needle_hits(needle)
+                    if self.kept[self.text_owners[text_position]]]
+            self._kept_hits[needle] = hits
+        return hits
+
+
+class _AttributeIndex(object):
+    """
+    The values of one attribute across a document.
+
+    Attributes with several values are indexed by each of their values. The distinct values of the other attributes
+    are joined into one string, so the values containing a string can be found by searching that one string rather
+    than testing each value.
+    """
+
+    __slots__ = ('positions', 'token_positions', 'values', 'value_positions', 'joined', 'offsets')
+
+    SEPARATOR = '\x00'
+
+    def __init__(self, key, elements):
+        self.token_positions = {}
+        value_positions = {}
+        attribute_values = [(position, element.attrs[key]) for position, element in enumerate(elements)
+                            if key in element.attrs]
+        for position, value in attribute_values:
+            if value.__class__ is str:
+                positions = value_positions.get(value)
+                if positions is None:
+                    value_positions[value] = [position]
+                else:
+                    positions.append(position)
+            elif isinstance(value, list):
+                for token in (value if len(value) == 1 else set(value)):
+                    positions = self.token_positions.get(token)
+                    if positions is None:
+                        self.token_positions[token] = [position]
+                    else:
+                        positions.append(position)
+            else:
+                value_positions.setdefault(value, []).append(position)
+        self.positions = [position for position, _ in attribute_values]
+
+        self.values = list(value_positions)
+        self.value_positions = [value_positions[value] for value in self.values]
+        self.joined = self.SEPARATOR.join(self.values) if all(isinstance(value, str) for value in self.values) else None
+        self.offsets = []
+        offset = 0
+        for value in self.values:
+            self.offsets.append(offset)
+            offset += len(value) + 1
+
+    def positions_containing(self, value):
+        token_positions = self.token_positions.get(value, [])
+        value_indexes = self._values_containing(value)
+        if not value_indexes:
+            return token_positions
+        if len(value_indexes) == 1 and not token_positions:
+            return self.value_positions[value_indexes[0]]
+        positions = list(token_positions)
+        for value_index in value_indexes:
+            positions.extend(self.value_positions[value_index])
+        positions.sort()
+        return positions
+
+    def _values_containing(self, value):
+        if not self.values:
+            return []
+        if self.joined is None:
+            return [value_index for value_index, each in enumerate(self.values) if value in each]
+
+        value_indexes = []
+        found = self.joined.find(value)
+        while found != -1:
+            value_index = bisect_right(self.offsets, found) - 1
+            value_end = self.offsets[value_index] + len(self.values[value_index])
+            # A match running over the end of a value, through the separator into the next one, doesn't count
+            if found + len(value) <= value_end:
+                value_indexes.append(value_index)
+                found = self.joined.find(value, value_end + 1)
+            else:
+                found = self.joined.find(value, found + 1)
+        return value_indexes
+
+
+def _index_nodes(root_element):
+    """ The elements and strings below the root in document order, as (node, parent, string type) triples. """
+
+    if not isinstance(root_element, Tag):
+        # Trees from other parsers know how to walk themselves
+        return root_element.index_nodes()
+    return _soup_index_nodes(root_element)
+
+
+def _soup_index_nodes(root_element):
+    for node in root_element.descendants:
+        if isinstance(node, Tag):
+            yield node, node.parent, None
+        elif isinstance(node, NavigableString):
+            yield str(node), node.parent, type(node)
+
+
+def _kept_soup_nodes(root_element, dropped):
+    """ The nodes of the tree in document order, skipping the dropped elements and everything inside them. """
+
+    for node in root_element.self_and_descendants:
+        if id(node) in dropped:
+            continue
+        if node.parent is not None and id(node.parent) in dropped:
+            dropped.add(id(node))
+            continue
+        yield node
+
+
+def _string_types(element):
+    return getattr(element, 'interesting_string_types', None) or _MAIN_STRING_TYPES
@@ -1,19 +1,78 @@
-from bs4 import BeautifulSoup
-from bs4.element import Tag
+import io
 
+from .compiler import compile_spec, spec_root
+from .document import Document
 from .formatters import pretty_html, pretty_spec
+from .index import DocumentIndex
+from .parsers import is_html_stream, parse_html, read_html
+from .reports import ReportLimits, write_report
+from .stats import MatchStats, phase
+
+
+# Below this many (attributed definition, element) pairs, indexing the document's attributes costs more than it saves
+_ATTRIBUTE_INDEX_MIN_WORK = 200000
 
 
 class MatcherResult(object):
-    """ Pass/fail result for an attempted match, along with debugging information. """
+    """
+    Pass/fail result for an attempted match, along with debugging information.
+
+    The result also says how much of the html the matcher read before deciding, in bytes for html given as bytes and
+    in characters for a string, which is all of it unless the matcher can stop early. When the matcher was asked for
+    stats (with stats=True) they are kept too, as a MatchStats.
+
+    The report sections are only rendered when first asked for, and then remembered, so a result costs nothing extra
+    until someone reads it. Matching never changes the tree, so the root element is the whole document, and when the
+    matcher hands over its document index the pruned html is rendered from the elements it kept, while the full source
+    is rendered from the tree already parsed rather than parsing it again.
+
+    The full report of a failure on a large document can run to megabytes, so write_report writes a windowed report
+    instead, showing only the html around the last element matched and the nearest candidate for the def the match
+    stopped at, within ReportLimits. Setting report_limits (on the class, for every result) makes str() give the
+    windowed report too.
+    """
+
+    report_limits = None
 
-    def __init__(self, spec, html_src, root_element, passed=True, element_defs_not_found=None, failed_on_def=None):
+    def __init__(self, spec, html_src, root_element, passed=True, element_defs_not_found=None, failed_on_def=None,
+                 first_matches=None, unmatched_def=None, document_index=None, bytes_consumed=None, stats=None,
+                 last_match=None, html_path=None, html_file=None):
         self.spec = spec
         self.html_src = html_src
-        self.root_element = root_element
+        self.html_path = html_path
+        self.html_file = html_file
         self.passed = passed
         self.element_defs_not_found = [] if not element_defs_not_found else element_defs_not_found
         self.failed_on_def = failed_on_def
+        self.first_matches = {} if not first_matches else first_matches
+        self.unmatched_def = unmatched_def
+        self.root_element = root_element
+        self.bytes_consumed = bytes_consumed
+        self.stats = stats
+        self.last_match = last_match
+        self._document_index = document_index
+        self._rendered = {}
+
+    @property
+    def html_src(self):
+        """
+        The html matched. When the result only has the file the html was kept in, or its path, the html is read from
+        there when first asked for.
+        """
+
+        if self._html_src is None and self.html_file is not None:
+            self.html_file.seek(0)
+            self._html_src = self.html_file.read()
+            self.html_file.close()
+            self.html_file = None
+        if self._html_src is None and self.html_path is not None:
+            with open(self.html_path, 'rb') as html_file:
+                self._html_src = html_file.read()
+        return self._html_src
+
+    @html_src.setter
+    def html_src(self, html_src):
+        self._html_src = html_src
 
     @property
     def failed(self):
@@ -23,108 +82,366 @@ class MatcherResult(object):
     def result_text(self):
         return 'Passed' if self.passed else 'Failed'
 
+    @property
+    def kept_elements(self):
+        """ The elements which survived the pruning, in document order, or None when the matcher didn't say. """
+
+        if self._document_index is None:
+            return None
+        return [self._document_index.elements[position] for position in _kept_positions(self._document_index)]
+
+    @property
+    def nearest_candidate(self):
+        """ The element most like the def the match stopped at, or None when the matcher didn't say. """
+
+        return self._render('nearest_candidate', self._find_nearest_candidate)
+
     def pretty_spec(self):
-        return pretty_spec(self.spec)
+        return self._render('spec', lambda: pretty_spec(spec_root(self.spec)))
 
     def pretty_html_src(self):
-        return pretty_html(self.html_src)
+        return self._render('html_src', self._render_html_src)
+
+    def pretty_pruned_html(self):
+        return self._render('pruned_html', self._render_pruned_html)
+
+    def _render_html_src(self):
+        if self.root_element is not None:
+            return self.root_element.prettify()
+        return None if self.html_src is None else pretty_html(self.html_src)
+
+    def _render_pruned_html(self):
+        return None if self._document_index is None else self._document_index.render(pretty=True)
+
+    def _find_nearest_candidate(self):
+        if self.unmatched_def is None or self._document_index is None:
+            return None
+        document_index = self._document_index
+        after = next((position for position, element in enumerate(document_index.elements)
+                      if element is self.last_match), 0)
+        position = _nearest_candidate_position(self.unmatched_def, document_index, after)
+        return None if position is None else document_index.elements[position]
+
+    def _render(self, section, render):
+        if section not in self._rendered:
+            self._rendered[section] = render()
+        return self._rendered[section]
 
     def __repr__(self):
         return 'MatcherResult[passed={0},elem_defs_not_found={1},failed_on_def={2}'.format(self.passed,
                                                                                            self.element_defs_not_found,
                                                                                            self.failed_on_def)
+
     def __str__(self):
-        result = 'HTML Matching: {0}\n\n'.format(self.result_text.upper())
+        if self.report_limits is not None:
+            return self._render('windowed_report', lambda: self.windowed_report(self.report_limits))
+        return self._render('report', self._render_report)
 
-        if self.failed:
-            if self.failed_on_def:
-                result += 'Failed when attempting to match against {0}\n'.format(self.failed_on_def)
-            if self.element_defs_not_found:
-                result += 'Some element definitions were not found anywhere in the HTML:\n'
-                for element_def in self.element_defs_not_found:
-                    result += ' - {0}\n'.format(element_def)
-            result += '\n'
+    def write_report(self, writer, limits=None):
+        """ Writes the windowed report to the writer (anything with a write method) as it is generated. """
 
-            result += 'Specification:\n{0}\n\n'.format(self.pretty_spec())
-            result += 'Pruned HTML Source:\n{0}\n\n'.format(self.root_element.prettify())
-            result += 'Full HTML Source:\n{0}\n\n'.format(self.pretty_html_src())
+        write_report(self, writer, limits or ReportLimits())
 
-        return result
+    def windowed_report(self, limits=None):
+        writer = io.StringIO()
+        self.write_report(writer, limits)
+        return writer.getvalue()
 
+    def failure_lines(self):
+        """ The lines describing why the match failed, which start the report. """
 
-def linear_match(spec, html_src):
-    """ Flattens the html and the spec, and check all spec elements appear in order. """
+        if self.failed_on_def:
+            yield 'Failed when attempting to match against {0}\n'.format(self.failed_on_def)
+        if self.unmatched_def in self.first_matches:
+            yield '{0} is in the HTML, but not in order, first matching {1}\n'.format(
+                self.unmatched_def, _describe_element(self.first_matches[self.unmatched_def]))
+        if self.element_defs_not_found:
+            yield 'Some element definitions were not found anywhere in the HTML:\n'
+            for element_def in self.element_defs_not_found:
+                yield ' - {0}\n'.format(element_def)
 
-    root_element = BeautifulSoup(html_src)
-    all_element_definitions = _flatten_element_definitions(spec)
-    _prune_unmatched_elements(root_element, all_element_definitions)
+    def _render_report(self):
+        result = ['HTML Matching: {0}\n\n'.format(self.result_text.upper())]
 
-    element_def_index = 0
-    current_element_def = None
-    for element in _descendant_elements(root_element):
-        current_element_def = all_element_definitions[element_def_index]
-        if _matches(current_element_def, element):
-            element_def_index += 1
-            if element_def_index == len(all_element_definitions):
-                return MatcherResult(spec, html_src, root_element, passed=True)
+        if self.failed:
+            result.extend(self.failure_lines())
+            result.append('\n')
 
-    # We didn't match everything. We report the matcher we failed on, and also check generally for matchers which
-    # do not match a single element
-    element_defs_not_found = []
-    for element_def in all_element_definitions:
-        if not any(element for element in _descendant_elements(root_element) if _matches(element_def, element)):
-            element_defs_not_found.append(element_def)
+            result.append('Specification:\n{0}\n\n'.format(self.pretty_spec()))
+            pruned_html = self.pretty_pruned_html()
+            if pruned_html is not None:
+                result.append('Pruned HTML Source:\n{0}\n\n'.format(pruned_html))
+            html_src = self.pretty_html_src()
+            if html_src is not None:
+                result.append('Full HTML Source:\n{0}\n\n'.format(html_src))
 
-    return MatcherResult(spec,
-                         html_src,
-                         root_element,
-                         passed=False,
-                         element_defs_not_found=element_defs_not_found,
-                         failed_on_def=current_element_def)
+        return ''.join(result)
 
 
-def _flatten_element_definitions(spec):
-    """ Flattens the spec from a tree to a list using a depth first search. """
+def html_match(spec, html_src, matcher=None, cache=None, **options):
+    """
+    Matches the html against the spec, using the linear matcher unless another matcher is provided.
 
-    all_element_definitions = []
-    _flatten_element_definitions_rec(spec, all_element_definitions)
-    return all_element_definitions
+    The matcher can be any matcher function, or the name of one of ours: linear, stream, structural or xpath. Html
+    given as a file-like object or an iterator of chunks is matched with the stream matcher, unless another matcher is
+    provided. With a ResultCache, a result cached for the same spec and html (in this run or an earlier one) is used
+    rather than matching again.
+    """
 
+    if cache is not None:
+        return cache.match(spec, html_src, matcher=matcher, **options)
+    matcher = matcher or ('stream' if is_html_stream(html_src) else linear_match)
+    if not callable(matcher):
+        matcher = matcher_named(matcher)
+    return matcher(spec, html_src, **options)
 
-def _flatten_element_definitions_rec(current_element_def, all_element_definitions):
-    all_element_definitions.append(current_element_def)
-    for child in current_element_def.children:
-        _flatten_element_definitions_rec(child, all_element_definitions)
 
+def matcher_named(name):
+    """ One of our matchers by name, which are imported here as they are built on this module. """
 
-def prune_unmatched_elements(root_element, spec):
-    return _prune_unmatched_elements(root_element, _flatten_element_definitions(spec))
+    from .streaming import stream_match
+    from .structural import structural_match
+    from .xpath import xpath_match
+    matchers = {'linear': linear_match, 'stream': stream_match, 'structural': structural_match, 'xpath': xpath_match}
+    if name not in matchers:
+        raise ValueError('Unknown matcher {0!r}, expected one of {1}'.format(name, ', '.join(sorted(matchers))))
+    return matchers[name]
 
 
-def _prune_unmatched_elements(element, all_element_definitions):
-    """ Removes elements in the tree which don't match any def or carry children who match any def """
+def linear_match(spec, html_src, parser=None, encoding=None, stats=False):
+    """
+    Flattens the html and the spec, and check all spec elements appear in order.
 
-    i_match_anything = any(_matches(elem_def, element) for elem_def in all_element_definitions)
+    With stats set, the result has a MatchStats with the time taken by each phase and counts of the work done.
+    """
 
-    # Now I find out whether the children match anything
-    children_to_extract = []
-    child_matched_anything = False
-    for child_element in _child_elements(element):
-        if _prune_unmatched_elements(child_element, all_element_definitions):
-            child_matched_anything = True
+    stats = MatchStats() if stats else None
+    with phase(stats, 'parse'):
+        if isinstance(html_src, Document):
+            html_src, root_element, document_index = html_src.html_src, html_src.root_element, html_src.index
         else:
-            children_to_extract.append(child_element)
-    for child_element in children_to_extract:
-        child_element.extract()
+            html_src = read_html(html_src)
+            root_element = parse_html(html_src, parser, encoding)
+            document_index = DocumentIndex(root_element)
+    with phase(stats, 'compile'):
+        compiled_spec = compile_spec(spec)
+
+    matches = _matches
+    if stats is not None:
+        matches = stats.counting_matches(_matches)
+        compiled_spec = stats.counting_spec(compiled_spec)
+        document_index = stats.counting_index(document_index)
+        stats.elements_visited += len(document_index)
+    all_element_definitions = compiled_spec.definitions
+
+    with phase(stats, 'prune'):
+        document_index = _prune_unmatched_elements(document_index, compiled_spec)
+
+    with phase(stats, 'scan'):
+        element_def_index = 0
+        current_element_def_index = None
+        last_match_position = None
+        visited = 0
+        for visited, position in enumerate(_kept_positions(document_index), 1):
+            current_element_def_index = element_def_index
+            if matches(all_element_definitions[element_def_index], document_index, position):
+                element_def_index += 1
+                last_match_position = position
+                if element_def_index == len(all_element_definitions):
+                    break
+    if stats is not None:
+        stats.elements_visited += visited
+    if element_def_index == len(all_element_definitions):
+        return MatcherResult(spec, html_src, root_element, passed=True, document_index=document_index,
+                             bytes_consumed=len(html_src), stats=stats)
 
-    # Let the client know if anything matched
-    return i_match_anything or child_matched_anything
+    # We didn't match everything. We report the matcher we failed on, and also check generally for matchers which
+    # do not match a single element, along with where the others first matched
+    with phase(stats, 'diagnose'):
+        element_defs = compiled_spec.element_defs_for(spec)
+        first_positions = _first_match_positions(compiled_spec, document_index, matches, stats)
+        element_defs_not_found = [element_def for element_def, position in zip(element_defs, first_positions)
+                                  if position is None]
+        first_matches = dict((element_def, document_index.elements[position])
+                             for element_def, position in zip(element_defs, first_positions) if position is not None)
 
+    return MatcherResult(spec,
+                         html_src,
+                         root_element,
+                         passed=False,
+                         element_defs_not_found=element_defs_not_found,
+                         failed_on_def=_element_def_at(element_defs, current_element_def_index),
+                         first_matches=first_matches,
+                         unmatched_def=element_defs[element_def_index],
+                         document_index=document_index,
+                         bytes_consumed=len(html_src),
+                         stats=stats,
+                         last_match=None if last_match_position is None
+                         else document_index.elements[last_match_position])
+
+
+def _element_def_at(element_defs, index):
+    return None if index is None else element_defs[index]
+
+
+def _first_match_positions(compiled_spec, document_index, matches=None, stats=None):
+    """ The position of the first element each definition matches, or None, in one pass over the pruned tree. """
+
+    matches = matches or _matches
+    all_element_definitions = compiled_spec.definitions
+    first_positions = [None] * len(all_element_definitions)
+    unmatched = len(all_element_definitions)
+    visited = 0
+    for visited, position in enumerate(_kept_positions(document_index), 1):
+        for index in compiled_spec.candidates(document_index.elements[position].name):
+            if first_positions[index] is None and matches(all_element_definitions[index], document_index, position):
+                first_positions[index] = position
+                unmatched -= 1
+        if not unmatched:
+            break
+    if stats is not None:
+        stats.elements_visited += visited
+    return first_positions
+
+
+def _nearest_candidate_position(element_def, document_index, after):
+    """
+    The position of the element with the def's name which has the most of its attributes and content, preferring the
+    first one after the given position, and otherwise the last one before it.
+    """
+
+    nearest, nearest_rank = None, None
+    for position in range(1, len(document_index)):
+        element = document_index.elements[position]
+        if not element_def.name_matcher.match(element.name):
+            continue
+        score = sum(1 for key, value in element_def.attrs.items()
+                    if key in element.attrs and value in element.attrs[key])
+        if element_def.content and document_index.content_contains(position, element_def.content):
+            score += 1
+        rank = (score, position > after, -position if position > after else position)
+        if nearest_rank is None or rank > nearest_rank:
+            nearest, nearest_rank = position, rank
+    return nearest
+
+
+def _describe_element(element):
+    """ A short description of an element, its start tag and where it is in the source when we know. """
+
+    description = '<{0}'.format(element.name)
+    for key, value in element.attrs.items():
+        description += ' {0}="{1}"'.format(key, ' '.join(value) if isinstance(value, list) else value)
+    description += '>'
+    if getattr(element, 'sourceline', None) is not None:
+        description += ' on line {0}'.format(element.sourceline)
+    return description
+
+
+def prune_unmatched_elements(root_element, spec):
+    """ Removes the elements which don't match the spec from the tree, leaving a Document as it is. """
+
+    if isinstance(root_element, Document):
+        return _prune_unmatched_elements(root_element.index, compile_spec(spec)).kept[0]
+    document_index = _prune_unmatched_elements(DocumentIndex(root_element), compile_spec(spec))
+    _extract_pruned_elements(document_index)
+    return document_index.kept[0]
+
+
+def _prune_unmatched_elements(document_index, compiled_spec):
+    """ Finds the elements which match any def or carry children who match any def, returning a view keeping them """
+
+    all_element_definitions = compiled_spec.definitions
+    elements = document_index.elements
+    kept = [False] * len(document_index)
+    document_index.search_needles(compiled_spec.needle_search)
+
+    # Definitions with attributes can go straight to the elements which have them, so only the other definitions need
+    # testing against every element
+    indexed = _attribute_indexed(range(len(all_element_definitions)), all_element_definitions, document_index)
+    candidate_sets = {}
+    for index in indexed:
+        element_def = all_element_definitions[index]
+        for position in _attribute_candidates(element_def, document_index):
+            if kept[position]:
+                continue
+            name = elements[position].name
+            if name not in candidate_sets:
+                candidate_sets[name] = frozenset(compiled_spec.candidates(name))
+            kept[position] = index in candidate_sets[name]\
+                and _attributes_match(element_def, elements[position])\
+                and _content_matches(element_def, document_index, position)
+
+    # Working backwards through the document we see children before their parents, so we know whether any child
+    # matched anything by the time we get to the parent
+    indexed = frozenset(indexed)
+    scanned_candidates = {}
+    for position in range(len(document_index) - 1, -1, -1):
+        if not kept[position]:
+            # Only the definitions with a matching name can match, so there is no need to test the others
+            element = elements[position]
+            candidates = scanned_candidates.get(element.name)
+            if candidates is None:
+                candidates = [index for index in compiled_spec.candidates(element.name) if index not in indexed]
+                scanned_candidates[element.name] = candidates
+            kept[position] = any(_attributes_match(all_element_definitions[index], element)
+                                 and _content_matches(all_element_definitions[index], document_index, position)
+                                 for index in candidates)
+        if kept[position] and position:
+            kept[document_index.parents[position]] = True
+    return document_index.with_kept(kept)
+
+
+def _attribute_indexed(indexes, definitions, document_index):
+    """
+    The indexes of the definitions which should find their candidates with the document's attribute index.
+
+    Indexing an attribute takes a pass over the document, so for small specs and documents it is quicker to test each
+    element against the definitions with its name, unless the attributes have already been indexed.
+    """
+
+    attributed = [index for index in indexes if definitions[index].attrs]
+    if len(attributed) * len(document_index) >= _ATTRIBUTE_INDEX_MIN_WORK:
+        return attributed
+    return [index for index in attributed
+            if any(document_index.has_attribute_index(key) for key, _ in definitions[index].attrs)]
+
+
+def _attribute_candidates(element_def, document_index):
+    """ The positions of the elements with the def's most selective attribute, which is all of them it could match. """
+
+    keys = [key for key, _ in element_def.attrs if document_index.has_attribute_index(key)]
+    return min((document_index.attribute_positions(key, value) for key, value in element_def.attrs
+                if not keys or key in keys), key=len)
+
+
+def _extract_pruned_elements(document_index):
+    """ Removes the elements which weren't kept from the tree, for callers who asked for the tree to be pruned. """
+
+    kept = document_index.kept
+    for position in range(1, len(document_index)):
+        parent = document_index.parents[position]
+        if not kept[position] and (kept[parent] or not parent):
+            document_index.elements[position].extract()
+
+
+def _kept_positions(document_index):
+    """ The positions of the elements below the root which survived the pruning, in document order. """
+
+    position = 1
+    while position < len(document_index):
+        if document_index.kept[position]:
+            yield position
+            position += 1
+        else:
+            position = document_index.ends[position]
 
-def _matches(element_def, element):
-    """ Tests whether an element matches an element definition. """
+
+def _matches(element_def, document_index, position):
+    """ Tests whether an element which survived the pruning matches an element definition. """
+
+    element = document_index.elements[position]
     return _name_matches(element_def, element)\
-        and _content_matches(element_def, element)\
+        and _content_matches(element_def, document_index, position, pruned=True)\
         and _attributes_match(element_def, element)
 
 
@@ -136,102 +453,18 @@ def _name_matches(element_def, element):
     return False
 
 
-def _content_matches(element_def, element):
+def _content_matches(element_def, document_index, position, pruned=False):
     """ Checks for match of content (if provided), must partially match one of the text items in the element. """
 
     if not element_def.content:
         return True
-    for string in element.strings:
-        if string and str(element_def.content) in string:
-            return True
-    return False
+    return document_index.content_contains(position, element_def.content, pruned)
 
 
 def _attributes_match(element_def, element):
     """ Checks that the attributes in the def are found in the element, partial match of values is permitted. """
 
-    for key, value in element_def.attrs.items():
+    for key, value in element_def.attrs:
         if key not in element.attrs or value not in element.attrs[key]:
             return False
     return True
-
-
-def _child_elements(element):
-    """ Helper to return the children of an element which are elements themselves. """
-
-    return (child for child in element.children if type(child) is Tag)
-
-
-def _descendant_elements(element):
-    """ Helper to return the descendants of an element which are elements themselves. """
-
-    return (child for child in element.descendants if type(child) is Tag)
-
-
-# def recursive_match(self, element):
-#     # Gather up each element matcher in our spec
-#     all_element_matchers = []
-#     self._gather_matchers(self, all_element_matchers)
-#
-#     # Do a single pass of the element tree, extracting any elements that don't match any matcher
-#     self._matches_any_matcher(element, all_element_matchers)
-#     print element.prettify()
-#
-#     return self._matches(element)
-#
-#
-# def _matches_any_matcher(self, element, all_element_matchers):
-#     # See if I will match anything
-#     i_match_anything = False
-#     for matcher in all_element_matchers:
-#         if matcher._name_matches(element) and matcher._content_matches(element) and matcher._attributes_match(element):
-#             i_match_anything = True
-#             break
-#
-#     # Now I find out whether the children match anything
-#     children_to_extract = []
-#     child_matched_anything = False
-#     for child_element in [child for child in element.children if type(child) is Tag]:
-#         if self._matches_any_matcher(child_element, all_element_matchers):
-#             child_matched_anything = True
-#         else:
-#             children_to_extract.append(child_element)
-#     for child_element in children_to_extract:
-#         child_element.extract()
-#
-#     # Let the client know if anything matched
-#     return i_match_anything or child_matched_anything
-#
-#
-# def _matches(self, element, level=0):
-#     print(('    '*level) + 'Testing: {0} on element {1} {2}'.format(str(self), element.name, element.attrs))
-#     if self._name_matches(element)\
-#             and self._content_matches(element)\
-#             and self._attributes_match(element)\
-#             and self._children_match(element, level):
-#         return True
-#     return self._search_children_for_match(element, level)
-#
-#
-# def _children_match(self, element, level):
-#     level += 1
-#
-#     if not self.children:
-#         return True
-#
-#     element_children = [child for child in element.children if type(child) is Tag]
-#     child_index = 0
-#     for element_child in element_children:
-#         if self.children[child_index]._matches(element_child, level):
-#             child_index += 1
-#         if child_index == len(self.children):
-#             print ('    '*level) + 'All children found!'
-#             return True
-#     return False
-#
-# def _search_children_for_match(self, element, level):
-#     element_children = [child for child in element.children if type(child) is Tag]
-#     for element_child in element_children:
-#         if self._matches(element_child, level):
-#             return True
-#     return False
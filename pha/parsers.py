@@ -0,0 +1,309 @@
+import codecs
+import copy
+import itertools
+import mmap
+
+from bs4 import BeautifulSoup, UnicodeDammit
+from bs4.dammit import EncodingDetector
+from bs4.builder import HTMLParserTreeBuilder
+from bs4.element import CData, NavigableString
+
+try:
+    import lxml.etree
+    import lxml.html
+except ImportError:  # pragma: no cover
+    lxml = None
+
+
+HTML_PARSER = 'html.parser'
+LXML = 'lxml'
+HTML5LIB = 'html5lib'
+LXML_HTML = 'lxml.html'
+
+# The parser the matchers use unless told otherwise. lxml.html is quicker (see pha.benchmarks.backends), but html.parser
+# is always installed, so results don't change with whatever else happens to be installed, and the stream matcher
+# follows its rules.
+DEFAULT_PARSER = HTML_PARSER
+
+PARSERS = (HTML_PARSER, LXML, HTML5LIB, LXML_HTML)
+
+# How much of the source is decoded and fed to an incremental parser at a time
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# How much of the start of a document is used to detect its encoding, when reading it a chunk at a time. BeautifulSoup
+# looks for a declared encoding in the first 5% of a document (and at least the first 2KB), so we look there too.
+_MIN_ENCODING_SAMPLE = 2048
+
+# The rules BeautifulSoup applies to the strings in a tree, which lxml.html trees and the stream matcher follow too
+_BUILDER = HTMLParserTreeBuilder()
+_VOID_ELEMENTS = frozenset(_BUILDER.empty_element_tags or ())
+_STRING_CONTAINERS = dict(getattr(_BUILDER, 'string_containers', {}))
+_PRESERVE_WHITESPACE_ELEMENTS = frozenset(getattr(_BUILDER, 'preserve_whitespace_tags', ()))
+# The strings an element's content is matched against, unless the element asks for other kinds (e.g. a script)
+_MAIN_STRING_TYPES = frozenset([NavigableString, CData])
+_ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+
+# What is on the stack when walking an lxml tree
+_ELEMENT = 'element'
+_STRING = 'string'
+
+
+def parse_html(html_src, parser=None, encoding=None):
+    """
+    Parses the html with the named parser, returning the root of the tree the matchers work on.
+
+    The bs4 parsers return a BeautifulSoup object. The lxml.html parser skips BeautifulSoup altogether, and returns an
+    LxmlDocument which offers the few parts of the BeautifulSoup API the matchers need. When the html is bytes in a
+    known encoding, passing the encoding skips the (slow) encoding detection.
+    """
+
+    parser = parser or DEFAULT_PARSER
+    if parser not in PARSERS:
+        raise ValueError('Unknown parser {0!r}, expected one of {1}'.format(parser, ', '.join(PARSERS)))
+
+    if parser == LXML_HTML:
+        return LxmlDocument.parse(html_src, encoding)
+    if isinstance(html_src, bytes) and encoding:
+        html_src = html_src.decode(encoding)
+    return BeautifulSoup(html_src, parser)
+
+
+def decode_html(html_src, encoding=None):
+    """ The html as a string, using the encoding given or detecting it when the html is bytes. """
+
+    if is_html_buffer(html_src):
+        html_src = bytes(html_src)
+    if not isinstance(html_src, bytes):
+        return html_src
+    if encoding:
+        return html_src.decode(encoding)
+    return UnicodeDammit(html_src, is_html=True).unicode_markup
+
+
+def is_html_buffer(html_src):
+    """ Checks whether the html is a whole document in a buffer other than bytes, such as a memory mapped file. """
+
+    return isinstance(html_src, (bytearray, memoryview, mmap.mmap))
+
+
+def is_html_stream(html_src):
+    """ Checks whether the html is a file-like object or an iterator of chunks, rather than a whole document. """
+
+    return not isinstance(html_src, (str, bytes)) and not is_html_buffer(html_src) \
+        and (hasattr(html_src, 'read') or hasattr(html_src, '__iter__'))
+
+
+def read_html(html_src):
+    """ The whole html as a string or bytes, reading it all when it is a file-like object or an iterator of chunks. """
+
+    if is_html_buffer(html_src):
+        return bytes(html_src)
+    if not is_html_stream(html_src):
+        return html_src
+    if hasattr(html_src, 'read'):
+        return html_src.read()
+    chunks = list(html_src)
+    return ''.join(chunks) if not chunks or isinstance(chunks[0], str) else b''.join(chunks)
+
+
+def html_chunks(html_src, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    The html a chunk at a time, as it comes, from a string, bytes, a file-like object or an iterator of chunks.
+
+    The chunks of a buffer such as a memory mapped file are views onto it, so they are never copied.
+    """
+
+    if is_html_buffer(html_src):
+        html_src = memoryview(html_src)
+    if not is_html_stream(html_src):
+        for start in range(0, len(html_src), chunk_size):
+            yield html_src[start:start + chunk_size]
+    elif hasattr(html_src, 'read'):
+        for chunk in iter(lambda: html_src.read(chunk_size), html_src.read(0)):
+            yield chunk
+    else:
+        for chunk in html_src:
+            if chunk:
+                yield chunk
+
+
+def decode_html_chunks(html_src, encoding=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Decodes the html a chunk at a time, yielding each chunk as a string along with how much of the source it used.
+
+    The html can be anything html_chunks reads. How much of the source has been used is counted in bytes when the html
+    is bytes, and in characters when it is a string. When the html is bytes and no encoding is given, the encoding is
+    detected from the start of the document. That usually agrees with decode_html, but when it turns out to be wrong,
+    decoding raises a UnicodeDecodeError part way through.
+    """
+
+    chunks = html_chunks(html_src, chunk_size)
+    whole_document = isinstance(html_src, bytes) or is_html_buffer(html_src)
+    sample_size = max(chunk_size, _MIN_ENCODING_SAMPLE, len(html_src) // 20 if whole_document else 0)
+    head = []
+    head_size = 0
+    whole = True
+    for chunk in chunks:
+        head.append(chunk)
+        head_size += len(chunk)
+        if isinstance(chunk, str) or encoding or head_size >= sample_size:
+            whole = False
+            break
+    if not head:
+        return
+
+    consumed = 0
+    if isinstance(head[0], str):
+        for chunk in itertools.chain(head, chunks):
+            consumed += len(chunk)
+            yield chunk, consumed
+        return
+
+    if not encoding:
+        sample = b''.join(head)
+        consumed, encoding = _detect_encoding(sample, whole)
+        head = [sample[consumed:]]
+    decoder = codecs.getincrementaldecoder(encoding)()
+    for chunk in itertools.chain(head, chunks):
+        consumed += len(chunk)
+        yield decoder.decode(chunk), consumed
+    yield decoder.decode(b'', final=True), consumed
+
+
+def _detect_encoding(sample, whole):
+    """ Detects the encoding of the html from the start of it, returning the length of any byte order mark too. """
+
+    # Don't let a character cut in half at the end of the sample put detection off (UTF-8 continuation bytes are
+    # 10xxxxxx, and the byte starting a character cut short is 11xxxxxx)
+    if not whole:
+        trimmed = sample.rstrip(bytes(range(0x80, 0xc0)))
+        if trimmed and trimmed[-1] >= 0xc0 and len(sample) - len(trimmed) < 4:
+            sample = trimmed[:-1]
+    stripped_sample, bom_encoding = EncodingDetector.strip_byte_order_mark(sample)
+    encoding = bom_encoding or UnicodeDammit(stripped_sample, is_html=True).original_encoding
+    return len(sample) - len(stripped_sample), encoding or 'utf-8'
+
+
+class LxmlElement(object):
+    """ An element parsed by lxml.html, looking enough like a BeautifulSoup tag for the matchers and the index. """
+
+    __slots__ = ('node', 'name', 'attrs', 'interesting_string_types')
+
+    def __init__(self, node, name, attrs):
+        self.node = node
+        self.name = name
+        self.attrs = attrs
+        self.interesting_string_types = frozenset([_STRING_CONTAINERS[name]]) if name in _STRING_CONTAINERS \
+            else _MAIN_STRING_TYPES
+
+    @property
+    def sourceline(self):
+        return self.node.sourceline
+
+    def extract(self):
+        # Like extract in BeautifulSoup, only the element goes and the text following it stays where it is. The
+        # html element has no parent to be removed from, so the best we can do is to empty it.
+        if self.node.getparent() is None:
+            self.node.clear()
+        else:
+            self.node.drop_tree()
+
+    def prettify(self):
+        return lxml.html.tostring(self.node, pretty_print=True, encoding='unicode')
+
+    def __str__(self):
+        return lxml.html.tostring(self.node, encoding='unicode')
+
+
+class LxmlDocument(LxmlElement):
+    """ The root of a document parsed by lxml.html, standing in for the BeautifulSoup object. """
+
+    __slots__ = ()
+
+    def __init__(self, node):
+        LxmlElement.__init__(self, node, '[document]', {})
+
+    @classmethod
+    def parse(cls, html_src, encoding=None):
+        if lxml is None:
+            raise ImportError('The lxml.html parser needs lxml to be installed')
+        if isinstance(html_src, bytes) and encoding:
+            html_src = html_src.decode(encoding)
+        try:
+            node = lxml.html.document_fromstring(html_src)
+        except lxml.etree.ParserError:
+            # lxml refuses to parse a document with nothing in it
+            node = None
+        return cls(node)
+
+    def extract(self):
+        pass
+
+    def prettify(self):
+        return '' if self.node is None else LxmlElement.prettify(self)
+
+    def __str__(self):
+        return '' if self.node is None else LxmlElement.__str__(self)
+
+    def render_kept(self, kept, pretty=False):
+        """ Renders the document with only the kept elements, from a copy so the document itself is unchanged. """
+
+        if self.node is None:
+            return ''
+        node = copy.deepcopy(self.node)
+        # The copy has the same elements in the same order, so they line up with the positions in the index
+        elements = [element for element in node.iter() if isinstance(element.tag, str)]
+        positions = dict((id(element), position) for position, element in enumerate(elements, 1))
+        dropped = [element for position, element in enumerate(elements, 1) if not kept[position]
+                   and (element.getparent() is None or kept[positions[id(element.getparent())]])]
+        for element in dropped:
+            LxmlElement(element, element.tag, {}).extract()
+        return lxml.html.tostring(node, pretty_print=pretty, encoding='unicode')
+
+    def index_nodes(self):
+        """
+        The elements and strings below the root in document order, as (node, parent, string type) triples.
+
+        Elements come with a string type of None. The strings follow the rules BeautifulSoup uses, so the strings
+        inside a script belong only to the script, and strings of whitespace are collapsed.
+        """
+
+        if self.node is None:
+            return
+        # Elements are stacked with the string container they are in, and strings with their string type
+        stack = [(_ELEMENT, self.node, self, None, False)]
+        while stack:
+            kind, node, parent, container, preserve_whitespace = stack.pop()
+            if kind is _STRING:
+                string, string_type = node, container
+                yield _collapse_whitespace(string, preserve_whitespace), parent, string_type
+                continue
+
+            name = node.tag
+            element = LxmlElement(node, name, _element_attrs(node))
+            container = name if name in _STRING_CONTAINERS else container
+            preserve_whitespace = preserve_whitespace or name in _PRESERVE_WHITESPACE_ELEMENTS
+            string_type = _STRING_CONTAINERS[container] if container else NavigableString
+            yield element, parent, None
+
+            # Comments and processing instructions are skipped, but the text after them still belongs to the element
+            children = []
+            if node.text:
+                children.append((_STRING, node.text, element, string_type, preserve_whitespace))
+            for child in node:
+                if isinstance(child.tag, str):
+                    children.append((_ELEMENT, child, element, container, preserve_whitespace))
+                if child.tail:
+                    children.append((_STRING, child.tail, element, string_type, preserve_whitespace))
+            stack.extend(reversed(children))
+
+
+def _element_attrs(node):
+    attrs = dict(node.attrib)
+    return _BUILDER._replace_cdata_list_attribute_values(node.tag, attrs) if attrs else attrs
+
+
+def _collapse_whitespace(string, preserve_whitespace):
+    if preserve_whitespace or string.strip(_ASCII_SPACES):
+        return string
+    return '\n' if '\n' in string else ' '
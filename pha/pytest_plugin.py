@@ -0,0 +1,188 @@
+import functools
+import time
+from collections import OrderedDict
+
+import pytest
+
+from .cache import ResultCache
+from .compiler import compile_spec, set_max_compiled_specs
+from .document import Document
+from .matchers import html_match, linear_match
+from .parsers import LXML_HTML
+from .reports import ReportLimits
+from .streaming import stream_match
+from .structural import structural_match
+from .xpath import xpath_match
+
+
+# The phases of the matchers which find the elements each def could match, which count as pruning. Every other phase
+# but parsing counts as matching.
+_PRUNE_PHASES = frozenset(['prune', 'label', 'select'])
+_TIMINGS = ('parse', 'prune', 'match', 'report')
+
+# The matchers which can time their phases, by name or as functions
+_OUR_MATCHERS = ('linear', 'stream', 'structural', 'xpath', linear_match, stream_match, structural_match, xpath_match)
+
+# Each test's timings travel with its reports as a user property, which pytest-xdist sends back from its workers
+_TIMINGS_PROPERTY = 'pha_timings'
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('pha', 'html assertions')
+    group.addoption('--pha-slowest', type=int, default=10, metavar='N',
+                    help='list the N tests which spent longest in html assertions (0 for none).')
+    group.addoption('--pha-full-reports', action='store_true',
+                    help='show the whole document when an html assertion fails, rather than windows of it.')
+    group.addoption('--pha-result-cache', metavar='PATH',
+                    help='keep the results of html assertions in this file, for later runs to use.')
+    parser.addini('pha_max_documents', 'how many parsed documents html assertions keep for the session.', default='32')
+    parser.addini('pha_max_compiled_specs', 'how many recently used compiled specs html matches keep.', default='512')
+
+
+def pytest_configure(config):
+    set_max_compiled_specs(int(config.getini('pha_max_compiled_specs')))
+    config.pluginmanager.register(SlowestAssertions(config.getoption('pha_slowest')), 'pha_slowest_assertions')
+
+
+class HtmlMatchCache(object):
+    """
+    The compiled specs and parsed documents shared by the html assertions of a test session (under pytest-xdist, of
+    each worker's session).
+
+    Specs are compiled once and kept for the session, so a spec each test builds afresh is only compiled by the first.
+    Documents are parsed once for each parser and encoding they are matched with, and the max_documents used most
+    recently are kept, so a page several tests assert on is only parsed and indexed once. With a ResultCache, results
+    from earlier runs are used before parsing anything.
+    """
+
+    def __init__(self, max_documents=32, result_cache=None):
+        self.max_documents = max_documents
+        self.result_cache = result_cache
+        self.compiled_specs = {}
+        self.documents = OrderedDict()
+
+    def compiled_spec(self, spec):
+        # compile_spec only holds weakly on to compiled specs it hasn't used lately, and shares a compiled spec between
+        # every spec with the same fingerprint for as long as it is alive, so holding on to it here is enough. There's
+        # one compiled spec for each fingerprint, so its id stands in for the fingerprint, which is slow to hash.
+        compiled_spec = compile_spec(spec)
+        return self.compiled_specs.setdefault(id(compiled_spec), compiled_spec)
+
+    def document(self, html_src, parser=None, encoding=None):
+        key = (html_src, parser, encoding)
+        document = self.documents.pop(key, None)
+        if document is None:
+            document = Document(html_src, parser, encoding)
+        self.documents[key] = document
+        while len(self.documents) > self.max_documents:
+            self.documents.popitem(last=False)
+        return document
+
+
+class SlowestAssertions(object):
+    """
+    Collects the time each test spent in html assertions from its reports, which under pytest-xdist come back from the
+    workers, and lists the slowest tests at the end of the run.
+    """
+
+    def __init__(self, slowest):
+        self.slowest = slowest
+        self.timings = OrderedDict()
+
+    def pytest_runtest_logreport(self, report):
+        if report.when != 'call':
+            return
+        for name, timings in report.user_properties:
+            if name == _TIMINGS_PROPERTY and sum(timings.values()):
+                self.timings[report.nodeid] = timings
+
+    def pytest_terminal_summary(self, terminalreporter):
+        if not self.slowest or not self.timings:
+            return
+        terminalreporter.write_sep('=', 'slowest {0} html assertions'.format(min(self.slowest, len(self.timings))))
+        for line in timings_table(self.timings, self.slowest):
+            terminalreporter.write_line(line)
+
+
+def timings_table(timings, slowest):
+    """ The lines of a table of the tests with the most time in html assertions, by phase, slowest first. """
+
+    lines = ['{0:>9} {1:>9} {2:>9} {3:>9} {4:>9}  test'.format(*(_TIMINGS + ('total',)))]
+    ranked = sorted(timings.items(), key=lambda item: sum(item[1].values()), reverse=True)
+    for nodeid, test_timings in ranked[:slowest]:
+        seconds = [test_timings[name] for name in _TIMINGS] + [sum(test_timings.values())]
+        lines.append('{0}  {1}'.format(' '.join('{0:>8.3f}s'.format(second) for second in seconds), nodeid))
+    return lines
+
+
+@pytest.fixture(scope='session')
+def html_match_cache(pytestconfig):
+    """ The HtmlMatchCache shared by every assert_html_match in the session. """
+
+    result_cache = pytestconfig.getoption('pha_result_cache')
+    return HtmlMatchCache(int(pytestconfig.getini('pha_max_documents')),
+                          ResultCache(result_cache) if result_cache else None)
+
+
+@pytest.fixture
+def assert_html_match(request, html_match_cache):
+    """
+    Asserts the html matches the spec, taking the same arguments as html_match and returning the result.
+
+    Specs and documents come from the session's html_match_cache, and the time spent parsing, pruning, matching and
+    rendering the report of a failure is added up for the test. A failure raises an AssertionError with the windowed
+    report, or the full report with --pha-full-reports.
+    """
+
+    timings = dict.fromkeys(_TIMINGS, 0.0)
+    request.node.user_properties.append((_TIMINGS_PROPERTY, timings))
+    report_limits = None if request.config.getoption('pha_full_reports') else ReportLimits()
+    return functools.partial(_assert_html_match, html_match_cache, timings, report_limits)
+
+
+def _assert_html_match(cache, timings, report_limits, spec, html_src, matcher=None, **options):
+    __tracebackhide__ = True
+
+    started = time.perf_counter()
+    key = result = None
+    if cache.result_cache is not None:
+        key = cache.result_cache.key(spec, html_src, matcher, options)
+        result = None if key is None else cache.result_cache.get(key, spec, html_src)
+    if result is not None:
+        timings['match'] += time.perf_counter() - started
+        return _checked(result, timings, report_limits)
+    cache.compiled_spec(spec)
+    looked_up = time.perf_counter()
+    # The stream matcher works from the source rather than a tree, so its documents aren't parsed up front
+    if isinstance(html_src, (str, bytes)) and matcher not in ('stream', stream_match):
+        parser = options.pop('parser', None)
+        if parser is None and matcher in ('xpath', xpath_match):
+            parser = LXML_HTML
+        html_src = cache.document(html_src, parser, options.pop('encoding', None))
+    parsed = time.perf_counter()
+    timings['match'] += looked_up - started
+    timings['parse'] += parsed - looked_up
+
+    # Our matchers time their own phases, unless told not to, and other matchers are timed as a whole
+    if matcher is None or matcher in _OUR_MATCHERS:
+        options.setdefault('stats', True)
+    result = html_match(spec, html_src, matcher=matcher, **options)
+    if result.stats is None:
+        timings['match'] += time.perf_counter() - parsed
+    else:
+        for name, seconds in result.stats.phases.items():
+            timings['parse' if name == 'parse' else 'prune' if name in _PRUNE_PHASES else 'match'] += seconds
+    if key is not None:
+        cache.result_cache.put(key, spec, html_src, result)
+    return _checked(result, timings, report_limits)
+
+
+def _checked(result, timings, report_limits):
+    __tracebackhide__ = True
+
+    if result.failed:
+        started = time.perf_counter()
+        report = str(result) if report_limits is None else result.windowed_report(report_limits)
+        timings['report'] += time.perf_counter() - started
+        raise AssertionError(report)
+    return result
@@ -0,0 +1,235 @@
+from collections import deque
+
+from bs4.element import NavigableString, Tag
+
+from .compiler import spec_root
+from .formatters import write_spec
+from .index import _kept_soup_nodes
+from .parsers import parse_html
+
+
+# Prettifying a tree a piece at a time follows Tag.decode, using these BeautifulSoup internals (as of 4.13 to 4.15, the
+# versions setup.py allows). Should any be missing, trees are prettified whole.
+_PRETTIFIES_BY_PIECE = all(hasattr(Tag, name) for name in (
+    '_event_stream', '_format_tag', '_should_pretty_print', '_indent_string', 'START_ELEMENT_EVENT',
+    'END_ELEMENT_EVENT', 'EMPTY_ELEMENT_EVENT'))
+
+
+class ReportLimits(object):
+    """
+    How much of a failed match the windowed report shows.
+
+    The html is shown as windows of context_lines lines either side of the last element the matcher matched and of
+    the nearest candidate for the def it stopped at (the start of the document, when the matcher can't say), with the
+    lines in between left out. Each section of the report (why the match failed, the spec, the pruned html and the
+    full html source) is cut off after max_lines lines or max_bytes bytes (encoded as UTF-8), whichever comes first.
+    """
+
+    def __init__(self, context_lines=20, max_lines=400, max_bytes=32 * 1024):
+        self.context_lines = context_lines
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+
+    def __repr__(self):
+        return 'ReportLimits[context_lines={0},max_lines={1},max_bytes={2}]'.format(self.context_lines,
+                                                                                   self.max_lines, self.max_bytes)
+
+
+def write_report(result, writer, limits):
+    """
+    Writes the windowed report of the result to the writer, a line at a time.
+
+    The html is prettified as it is written, and only as far as the last window, so neither the prettified document
+    nor the report is ever held in memory whole.
+    """
+
+    writer.write('HTML Matching: {0}\n\n'.format(result.result_text.upper()))
+    if result.passed:
+        return
+
+    _write_section(writer, None, limits, lambda section: section.write(''.join(result.failure_lines())))
+    _write_section(writer, 'Specification', limits, lambda section: write_spec(spec_root(result.spec), section))
+
+    root_element = result.root_element
+    if root_element is None and result.html_src is not None:
+        root_element = parse_html(result.html_src)
+    # Trees from other parsers are prettified whole, so the lines can't be told apart, and the window is at the start
+    anchors = _anchors(result) if isinstance(root_element, Tag) and _PRETTIFIES_BY_PIECE else []
+    document_index = result._document_index
+    if document_index is not None and document_index.kept is not None:
+        kept_anchors = [element for element in anchors if document_index.kept[_position(document_index, element)]]
+        _write_section(writer, 'Pruned HTML Source', limits, lambda section: _write_windows(
+            _pruned_lines(document_index, kept_anchors), len(kept_anchors), section, limits.context_lines))
+    if root_element is not None:
+        _write_section(writer, 'Full HTML Source', limits, lambda section: _write_windows(
+            _pretty_lines(root_element, anchors), len(anchors), section, limits.context_lines))
+
+
+def _anchors(result):
+    """ The elements the windows are around, the last element matched and the nearest candidate, when known. """
+
+    candidate = result.first_matches.get(result.unmatched_def) or result.nearest_candidate
+    anchors = [element for element in (result.last_match, candidate) if element is not None]
+    return anchors[:1] if len(anchors) == 2 and anchors[0] is anchors[1] else anchors
+
+
+def _position(document_index, element):
+    return next(position for position, indexed in enumerate(document_index.elements) if indexed is element)
+
+
+class _SectionFull(Exception):
+    pass
+
+
+class _SectionWriter(object):
+    """ Writes a section of the report until it reaches the limits, and then stops the section. """
+
+    def __init__(self, writer, max_lines, max_bytes):
+        self.writer = writer
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self.lines = 0
+        self.written = 0
+        self.ends_line = True
+
+    def write(self, text):
+        full = False
+        if self.max_lines is not None and self.lines + text.count('\n') > self.max_lines:
+            text = ''.join(text.splitlines(True)[:self.max_lines - self.lines])
+            full = True
+        encoded = text.encode('utf-8', 'surrogatepass')
+        if self.max_bytes is not None and self.written + len(encoded) > self.max_bytes:
+            # A character cut in two is left out altogether
+            encoded = encoded[:self.max_bytes - self.written]
+            text = encoded.decode('utf-8', 'ignore')
+            full = True
+        if text:
+            self.writer.write(text)
+            self.lines += text.count('\n')
+            self.written += len(text.encode('utf-8', 'surrogatepass'))
+            self.ends_line = text.endswith('\n')
+        if full:
+            raise _SectionFull()
+
+
+def _write_section(writer, title, limits, write):
+    if title:
+        writer.write('{0}:\n'.format(title))
+    section = _SectionWriter(writer, limits.max_lines, limits.max_bytes)
+    try:
+        write(section)
+    except _SectionFull:
+        writer.write('{0}... cut off after {1} lines and {2} bytes\n'.format(
+            '' if section.ends_line else '\n', section.lines, section.written))
+    writer.write('\n\n' if title else '\n')
+
+
+def _write_windows(lines, anchor_count, writer, context_lines):
+    """
+    Writes the lines around each anchored line, noting how many lines are left out between the windows, and stops
+    after the last window. Without anchors, the window is at the start.
+    """
+
+    before = deque(maxlen=context_lines)
+    skipped = following = 0
+    for number, (line, anchored) in enumerate(lines):
+        if anchored or not (anchor_count or number):
+            anchor_count -= anchored
+            if skipped:
+                writer.write(_skipped_lines(skipped))
+            writer.write(''.join(before) + line)
+            before.clear()
+            skipped, following = 0, context_lines
+        elif following:
+            writer.write(line)
+            following -= 1
+        elif anchor_count <= 0:
+            writer.write('...\n')
+            return
+        else:
+            skipped += len(before) == before.maxlen
+            before.append(line)
+    if skipped + len(before):
+        writer.write(_skipped_lines(skipped + len(before)))
+
+
+def _skipped_lines(skipped):
+    return '... {0} line{1} left out ...\n'.format(skipped, '' if skipped == 1 else 's')
+
+
+def _pruned_lines(document_index, anchors):
+    root_element = document_index.elements[0]
+    if not isinstance(root_element, Tag):
+        return _string_lines(document_index.render(pretty=True))
+    dropped = set(id(element) for position, element in enumerate(document_index.elements)
+                  if not document_index.kept[position])
+    return _pretty_lines(root_element, anchors, _kept_soup_nodes(root_element, dropped))
+
+
+def _string_lines(rendered):
+    return ((line, 0) for line in rendered.splitlines(True))
+
+
+def _pretty_lines(root_element, anchors, iterator=None):
+    """
+    The lines of the prettified tree (with only the nodes from the iterator, when given), as root_element.prettify()
+    gives them, each with how many of the anchor elements start on it.
+
+    The tree is prettified as BeautifulSoup does it, a node at a time. Trees from other parsers are prettified whole,
+    as are all trees with versions of BeautifulSoup whose internals we don't know, and then no line is anchored.
+    """
+
+    if not isinstance(root_element, Tag):
+        yield from _string_lines(root_element.prettify())
+        return
+    if not _PRETTIFIES_BY_PIECE:
+        yield from _string_lines(root_element.decode(indent_level=0, iterator=iterator) if iterator is not None
+                                 else root_element.prettify())
+        return
+
+    anchors = set(id(element) for element in anchors)
+    formatter = root_element.formatter_for_name('minimal')
+    line, anchored = [], 0
+    for element, piece in _pretty_pieces(root_element, formatter, iterator):
+        anchored += id(element) in anchors
+        while '\n' in piece:
+            end, piece = piece.split('\n', 1)
+            line.append(end + '\n')
+            yield ''.join(line), anchored
+            line, anchored = [], 0
+        if piece:
+            line.append(piece)
+    if line:
+        yield ''.join(line), anchored
+
+
+def _pretty_pieces(root_element, formatter, iterator):
+    """ The pieces of the prettified tree, following Tag.decode, each with the element it starts (or None). """
+
+    indent_level = 0
+    string_literal_tag = None
+    for event, element in root_element._event_stream(iterator):
+        if event in (Tag.START_ELEMENT_EVENT, Tag.EMPTY_ELEMENT_EVENT):
+            piece = element._format_tag('utf-8', formatter, opening=True)
+        elif event is Tag.END_ELEMENT_EVENT:
+            piece = element._format_tag('utf-8', formatter, opening=False)
+            indent_level -= 1
+        else:
+            piece = element.output_ready(formatter)
+
+        indent_before = indent_after = not string_literal_tag
+        if event is Tag.START_ELEMENT_EVENT and not string_literal_tag and not element._should_pretty_print():
+            indent_before, indent_after = True, False
+            string_literal_tag = element
+        elif event is Tag.END_ELEMENT_EVENT and element is string_literal_tag:
+            indent_before, indent_after = False, True
+            string_literal_tag = None
+
+        if indent_before or indent_after:
+            if isinstance(element, NavigableString):
+                piece = piece.strip()
+            if piece:
+                piece = root_element._indent_string(piece, indent_level, formatter, indent_before, indent_after)
+        if event is Tag.START_ELEMENT_EVENT:
+            indent_level += 1
+        yield (element if event in (Tag.START_ELEMENT_EVENT, Tag.EMPTY_ELEMENT_EVENT) else None), piece
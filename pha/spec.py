@@ -1,43 +1,84 @@
 import re
+import sys
+import weakref
+from collections import OrderedDict
+from operator import attrgetter
+from types import MappingProxyType
 
 
-class ElementDef(object):
-    """ An element we want to match, specifying the name, content, attributes and children we want to assert. """
-
-    def __init__(self, name_regex, *children, **attrs):
-        self.name_regex = name_regex
-        self.name_matcher = re.compile(name_regex)
-        self.parent = None
-        self.children = [child for child in children if child]
-        self.attrs = attrs
-        self.content = self._keyword_attr('content')
-
-        self._init_child_parents()
-        self._handle_escaped_attrs()
-
-    def _keyword_attr(self, attr_name):
-        if attr_name in self.attrs:
-            attr_value = self.attrs[attr_name]
-            del self.attrs[attr_name]
-        else:
-            attr_value = None
-        return attr_value
+# Element defs are immutable, so identical ones are only ever built once. An element def is shared by every spec
+# built with it for as long as any of them is in use, so we only hold weak references to them here, by key.
+_ELEMENT_DEFS = {}
 
-    def _init_child_parents(self):
-        for child in self.children:
-            child.parent = self
+# The compiled name regexes, which are shared by every element def with the same name regex (so every elem('td') shares
+# one). The most recently compiled are kept.
+_NAME_MATCHERS = OrderedDict()
+_NAME_MATCHERS_MAX = 1024
 
-    def _handle_escaped_attrs(self):
-        new_attrs={}
-        for key, value in self.attrs.items():
-            if key.endswith('_'):
-                new_attrs[key.replace('_', '')] = value
-            else:
-                new_attrs[key] = value
-        self.attrs = new_attrs
+# Most element defs have no attributes, and they all share one empty dict
+_NO_ATTRS = {}
+
+
+class ElementDef(object):
+    """
+    An element we want to match, specifying the name, content, attributes and children we want to assert.
+
+    Element defs can't be changed once built, and building one identical to an element def which already exists (with
+    the same name regex, content, attributes and children) returns the existing one, so the repeated parts of a spec,
+    such as its rows or accordion groups, are only stored once. As a shared element def can be a child of many, element
+    defs don't know their parents.
+    """
+
+    __slots__ = ('_name_regex', '_name_matcher', '_children', '_attrs', '_content', '__weakref__')
+
+    name_regex = property(attrgetter('_name_regex'))
+    name_matcher = property(attrgetter('_name_matcher'))
+    children = property(attrgetter('_children'))
+    content = property(attrgetter('_content'))
+
+    @property
+    def attrs(self):
+        return MappingProxyType(self._attrs)
+
+    def __new__(cls, name_regex, *children, **attrs):
+        content = attrs.pop('content', None)
+        if attrs:
+            attrs = _unescaped_attrs(attrs)
+        if children:
+            children = tuple(filter(None, children))
+        name_matcher = _NAME_MATCHERS.get(name_regex)
+        if name_matcher is None:
+            name_matcher = _compile_name_regex(name_regex)
+        name_regex = name_matcher.pattern
+
+        key = _element_def_key(name_regex, children, attrs, content)
+        try:
+            shared = _ELEMENT_DEFS.get(key)
+        except TypeError:
+            # A value which can't be hashed, so this element def can't be shared
+            key = shared = None
+        element_def = None if shared is None else shared()
+        if element_def is not None:
+            return element_def
+
+        element_def = object.__new__(cls)
+        element_def._name_regex = name_regex
+        element_def._name_matcher = name_matcher
+        element_def._children = children
+        element_def._attrs = attrs or _NO_ATTRS
+        element_def._content = content
+        if key is not None:
+            shared = _ElementDefRef(element_def, _forget_element_def)
+            shared.key = key
+            _ELEMENT_DEFS[key] = shared
+        return element_def
+
+    def __reduce__(self):
+        return _element_def, (self.name_regex, self.children, dict(self.attrs), self.content)
 
     def __repr__(self):
-        return 'ElementMatcher[name_regex={0},content={1},attrs={2}]'.format(self.name_regex, self.content, self.attrs)
+        return 'ElementMatcher[name_regex={0},content={1},attrs={2}]'.format(self.name_regex, self.content,
+                                                                            dict(self.attrs))
 
     def __str__(self):
         name = self.name_regex[1:-1]
@@ -52,23 +93,75 @@ class ElementDef(object):
         return elem_def
 
 
+class _ElementDefRef(weakref.ref):
+    """ A weak reference to a shared element def, which knows the key the element def is shared under. """
+
+    __slots__ = ('key',)
+
+
+def _forget_element_def(shared):
+    # An element def built since, identical to the one which has gone, can already be shared under the key
+    if _ELEMENT_DEFS.get(shared.key) is shared:
+        del _ELEMENT_DEFS[shared.key]
+
+
+def _compile_name_regex(name_regex):
+    name_regex = sys.intern(name_regex)
+    name_matcher = _NAME_MATCHERS[name_regex] = re.compile(name_regex)
+    while len(_NAME_MATCHERS) > _NAME_MATCHERS_MAX:
+        _NAME_MATCHERS.popitem(last=False)
+    return name_matcher
+
+
+def _unescaped_attrs(attrs):
+    if '_' not in ''.join(attrs):
+        return attrs
+    new_attrs = {}
+    for key, value in attrs.items():
+        if key.endswith('_'):
+            new_attrs[sys.intern(key.replace('_', ''))] = value
+        else:
+            new_attrs[key] = value
+    return new_attrs
+
+
+def _element_def_key(name_regex, children, attrs, content):
+    """ The key identical element defs share, which can't be hashed when any of the values can't be. """
+
+    # Content other than a string (which only ever equals a string) is keyed with its type, so that content of 1 isn't
+    # shared with content of True, which is matched as 'True'. Attribute values are only ever matched as strings.
+    # Children are keyed by identity, as identical children are already the same object. The attributes follow as one
+    # flat run of keys and values, sorted by key, which saves a tuple per attribute.
+    if content is not None and type(content) is not str:
+        content = (type(content), content)
+    if not attrs:
+        return name_regex, content, children
+    return sum(sorted(attrs.items()), (name_regex, content, children))
+
+
+def _element_def(name_regex, children, attrs, content):
+    """ Builds an element def when unpickling. """
+
+    return ElementDef(name_regex, *children, content=content, **attrs)
+
+
 def elem(name, *children, **attrs):
     elem_regex = r'^{0}$'.format(name)
-    return ElementDef(elem_regex, None, *children, **attrs)
+    return ElementDef(elem_regex, *children, **attrs)
 
 
 def html(*children, **attrs):
-    return str(ElementDef(r'^html$', None, *children, **attrs))
+    return ElementDef(r'^html$', *children, **attrs)
 
 
 def heading(heading_text, *children, **attrs):
     attrs['content'] = heading_text
-    return str(ElementDef(r'^(h1|h2|h3|h4|h5|h6)$', *children, **attrs))
+    return ElementDef(r'^(h1|h2|h3|h4|h5|h6)$', *children, **attrs)
 
 
 def text(text_content, *children, **attrs):
     attrs['content'] = text_content
-    return str(ElementDef(r'^.*$', *children, **attrs))
+    return ElementDef(r'^.*$', *children, **attrs)
 
 
 def a(href=None, link_text=None, *children, **attrs):
@@ -76,7 +169,7 @@ def a(href=None, link_text=None, *children, **attrs):
         attrs['href'] = href
     if link_text:
         attrs['content'] = link_text
-    return str(ElementDef(r'^a$', *children, **attrs))
+    return ElementDef(r'^a$', *children, **attrs)
 
 
 def accordion(*children, **attrs):
@@ -100,19 +193,19 @@ def acc_body(*children, **attrs):
 
 
 def div(*children, **attrs):
-    return str(ElementDef(r'^div$', *children, **attrs))
+    return ElementDef(r'^div$', *children, **attrs)
 
 
 def input(id, value=None, *children, **attrs):
     attrs['id'] = id
     if value:
         attrs['value'] = value
-    return str(ElementDef(r'^input$', *children, **attrs))
+    return ElementDef(r'^input$', *children, **attrs)
 
 
 def select(id, *children, **attrs):
     attrs['id'] = id
-    return str(ElementDef(r'^select$', *children, **attrs))
+    return ElementDef(r'^select$', *children, **attrs)
 
 
 def option(value, content=None, selected=False, *children, **attrs):
@@ -121,7 +214,7 @@ def option(value, content=None, selected=False, *children, **attrs):
         attrs['content'] = content
     if selected:
         attrs['selected'] = ''
-    return str(ElementDef(r'^option$', *children, **attrs))
+    return ElementDef(r'^option$', *children, **attrs)
 
 
 def option_xhtml(value, content=None, selected=False, *children, **attrs):
@@ -130,9 +223,9 @@ def option_xhtml(value, content=None, selected=False, *children, **attrs):
         attrs['content'] = content
     if selected:
         attrs['selected'] = 'selected'
-    return str(ElementDef(r'^option$', *children, **attrs))
+    return ElementDef(r'^option$', *children, **attrs)
 
 
 def img(src, *children, **attrs):
     attrs['src'] = src
-    return str(ElementDef(r'^img$', *children, **attrs))
+    return ElementDef(r'^img$', *children, **attrs)
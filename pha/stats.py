@@ -0,0 +1,152 @@
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from .index import DocumentIndex
+
+
+class MatchStats(object):
+    """
+    How long each phase of a match took, and how much work the matcher did, for finding out why a match is slow.
+
+    Phases are timed in seconds and kept in the order they ran, which for the linear matcher is parse, compile (which
+    flattens the spec), prune, scan and, when the match failed, diagnose. The counters are the elements visited, the
+    calls to _matches, the name regexes evaluated and the content tests (each looking for a needle in an element).
+    Definitions are looked up by tag name, and a compiled spec remembers which of its name regexes match each tag name
+    once it has evaluated them, so regexes are counted when they are actually evaluated rather than for every lookup.
+
+    Matchers only collect stats when asked to, with stats=True, and the result then has them as result.stats.
+    """
+
+    COUNTERS = ('elements_visited', 'matches_calls', 'regex_evaluations', 'content_tests')
+
+    def __init__(self):
+        self.phases = OrderedDict()
+        self.elements_visited = 0
+        self.matches_calls = 0
+        self.regex_evaluations = 0
+        self.content_tests = 0
+
+    @property
+    def total_time(self):
+        return sum(self.phases.values())
+
+    @contextmanager
+    def phase(self, name):
+        """ Times the phase, adding to the time already taken if it has run before. """
+
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - started
+
+    def counting_matches(self, matches):
+        """ Wraps the matches function to count its calls. """
+
+        def counted_matches(element_def, document_index, position):
+            self.matches_calls += 1
+            return matches(element_def, document_index, position)
+        return counted_matches
+
+    def counting_spec(self, compiled_spec):
+        """ A view of the compiled spec which counts the name regexes it evaluates. """
+
+        return _CountingCompiledSpec(compiled_spec, self)
+
+    def counting_index(self, document_index):
+        """ A view of the document index which counts its content tests, as do the views made from it. """
+
+        return _CountingDocumentIndex(document_index, self)
+
+    def as_dict(self):
+        stats = OrderedDict([('phases', OrderedDict(self.phases)), ('total_time', self.total_time)])
+        stats.update((counter, getattr(self, counter)) for counter in self.COUNTERS)
+        return stats
+
+    def __repr__(self):
+        return 'MatchStats[total_time={0:.6f},{1}]'.format(
+            self.total_time, ','.join('{0}={1}'.format(counter, getattr(self, counter)) for counter in self.COUNTERS))
+
+    def __str__(self):
+        lines = ['{0:<20} {1:>10.6f}s'.format(name, elapsed) for name, elapsed in self.phases.items()]
+        lines.append('{0:<20} {1:>10.6f}s'.format('total', self.total_time))
+        lines.extend('{0:<20} {1:>10}'.format(counter, getattr(self, counter)) for counter in self.COUNTERS)
+        return '\n'.join(lines)
+
+
+class _CountingCompiledSpec(object):
+    """
+    A compiled spec whose definitions count each evaluation of their name regexes, as does looking up the definitions
+    for a tag name the compiled spec hasn't seen before.
+    """
+
+    def __init__(self, compiled_spec, stats):
+        self.compiled_spec = compiled_spec
+        self.stats = stats
+        # Identical element defs share their compiled definition, and still do in the view
+        counted = {}
+        for definition in compiled_spec.definitions:
+            if id(definition) not in counted:
+                counted[id(definition)] = definition._replace(
+                    name_matcher=_CountingNameMatcher(definition.name_matcher, stats))
+        self.definitions = tuple(counted[id(definition)] for definition in compiled_spec.definitions)
+
+    def __getattr__(self, name):
+        return getattr(self.compiled_spec, name)
+
+    def __len__(self):
+        return len(self.compiled_spec)
+
+    def candidates(self, name):
+        if name not in self.compiled_spec._candidates_by_name:
+            self.stats.regex_evaluations += len(self.compiled_spec.defs_by_regex)
+        return self.compiled_spec.candidates(name)
+
+
+class _CountingNameMatcher(object):
+
+    __slots__ = ('name_matcher', 'stats')
+
+    def __init__(self, name_matcher, stats):
+        self.name_matcher = name_matcher
+        self.stats = stats
+
+    @property
+    def pattern(self):
+        return self.name_matcher.pattern
+
+    def match(self, name):
+        self.stats.regex_evaluations += 1
+        return self.name_matcher.match(name)
+
+
+class _CountingDocumentIndex(DocumentIndex):
+    """ A view of a document index which counts its content tests, as do the views made from it. """
+
+    def __init__(self, document_index, stats):
+        # The view shares everything with the index, as the views made by with_kept do, rather than indexing again
+        vars(self).update(vars(document_index))
+        self.stats = stats
+
+    def content_contains(self, position, needle, pruned=False):
+        self.stats.content_tests += 1
+        return DocumentIndex.content_contains(self, position, needle, pruned)
+
+
+class _Untimed(object):
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_UNTIMED = _Untimed()
+
+
+def phase(stats, name):
+    """ Times the phase when collecting stats, and does nothing otherwise. """
+
+    return _UNTIMED if stats is None else stats.phase(name)
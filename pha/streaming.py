@@ -0,0 +1,539 @@
+import io
+import itertools
+from html.parser import HTMLParser
+from tempfile import SpooledTemporaryFile
+
+from .compiler import compile_spec
+from .document import Document
+from .matchers import MatcherResult, _attributes_match, _element_def_at
+from .parsers import (
+    _BUILDER,
+    _PRESERVE_WHITESPACE_ELEMENTS,
+    _STRING_CONTAINERS,
+    _VOID_ELEMENTS,
+    DEFAULT_CHUNK_SIZE,
+    HTML_PARSER,
+    _collapse_whitespace,
+    decode_html,
+    decode_html_chunks,
+    html_chunks,
+    is_html_stream,
+)
+from .stats import MatchStats, phase
+
+
+# We mirror the tree building rules of the html.parser builder in BeautifulSoup, so that the stream matcher sees
+# exactly the same elements, attributes and strings as the linear matcher does.
+
+# The html read from a stream is kept in memory up to this size, and in a temporary file after that
+_SPOOL_MEMORY = 1024 * 1024
+
+# The encoding BeautifulSoup falls back to when the html doesn't declare one and isn't UTF-8
+_FALLBACK_ENCODING = 'windows-1252'
+
+
+class _Satisfied(Exception):
+    """ Raised from within the parser callbacks to stop parsing once the spec has been matched. """
+
+
+class _OpenElement(object):
+    """ An element in the document which the parser has opened, along with what we know so far about its text. """
+
+    __slots__ = ('name', 'attrs', 'parent', 'text_kind', 'candidates', 'kept', 'found', 'kept_found', 'closed')
+
+    def __init__(self, name, attrs, parent):
+        self.name = name
+        self.attrs = attrs
+        self.parent = parent
+        self.text_kind = name if name in _STRING_CONTAINERS else None
+        self.candidates = ()
+        self.kept = False
+        self.found = set()
+        self.kept_found = set()
+        self.closed = False
+
+    def ancestors_and_self(self):
+        element = self
+        while element is not None:
+            yield element
+            element = element.parent
+
+
+class _Assumption(object):
+    """ An assumption that an open element does, or does not, contain a needle once the tree has been pruned. """
+
+    __slots__ = ('element', 'needle', 'expected', 'previous')
+
+    def __init__(self, element, needle, expected, previous):
+        self.element = element
+        self.needle = needle
+        self.expected = expected
+        self.previous = previous
+
+    def holds(self):
+        """ True or False once we know whether the assumption holds, or None if we can't tell yet. """
+
+        if (self.element.text_kind, self.needle) in self.element.kept_found:
+            return self.expected
+        if self.element.closed:
+            return not self.expected
+        return None
+
+
+class _TrailEntry(object):
+    """ Records the definition an element was tested against, so we can report the definition we failed on. """
+
+    __slots__ = ('element', 'index', 'previous')
+
+    def __init__(self, element, index, previous):
+        self.element = element
+        self.index = index
+        self.previous = previous
+
+
+class _Thread(object):
+    """ One possible position in the flattened spec, valid only while its chain of assumptions holds. """
+
+    __slots__ = ('index', 'assumption', 'trail')
+
+    def __init__(self, index, assumption, trail):
+        self.index = index
+        self.assumption = assumption
+        self.trail = trail
+
+    def assumptions(self):
+        assumption = self.assumption
+        while assumption is not None:
+            yield assumption
+            assumption = assumption.previous
+
+    def assumed_absent(self, element, needle):
+        """
+        True if the thread assumes an ancestor of the newly opened element doesn't contain the needle.
+
+        Needles found in a kept element are passed up to all of its ancestors, so the element can't contain the needle
+        either. Following only the outcome which can still hold keeps the number of threads linear in the depth of the
+        nesting, rather than doubling at every level.
+        """
+
+        return any(not assumption.expected and assumption.needle == needle
+                   and assumption.element.text_kind == element.text_kind for assumption in self.assumptions())
+
+    @property
+    def alive(self):
+        return all(assumption.holds() is not False for assumption in self.assumptions())
+
+    @property
+    def certain(self):
+        return all(assumption.holds() for assumption in self.assumptions())
+
+    def element_closed(self, element):
+        """
+        Resolves the assumption on an element which has just closed, and tidies the trail.
+
+        Everything assumed or recorded after the element opened belongs to its descendants, which have already closed,
+        so anything about this element is always at the head of the chains. The linear matcher never sees elements
+        which are pruned, so they are dropped from the trail, and once an element is known to survive the pruning
+        nothing recorded before it can be the last element seen.
+        """
+
+        if self.assumption is not None and self.assumption.element is element:
+            if not self.assumption.holds():
+                return False
+            self.assumption = self.assumption.previous
+
+        if self.trail is not None and self.trail.element is element:
+            if element.kept:
+                self.trail = _TrailEntry(element, self.trail.index, None)
+            else:
+                self.trail = self.trail.previous
+        return True
+
+
+class _StreamMatcher(HTMLParser):
+    """
+    Replays the linear matcher against html.parser events, without ever building a tree.
+
+    The linear matcher prunes the tree before scanning it, and an element's content is only known once the element
+    closes, so whether an element matches a definition with content can't be decided when it opens. Rather than
+    buffering, we follow both outcomes as separate threads, and drop the thread whose assumption turns out to be false
+    as soon as the content is known. A thread never follows an outcome its own assumptions rule out, so nested
+    candidates for the same content add a thread per level rather than doubling them.
+    """
+
+    def __init__(self, compiled_spec):
+        HTMLParser.__init__(self, convert_charrefs=True)
+        self.compiled_spec = compiled_spec
+        self.all_element_definitions = all_element_definitions = compiled_spec.definitions
+        self.needles = [elem_def.content for elem_def in all_element_definitions]
+        self.needle_search = compiled_spec.needle_search
+        self.root = _OpenElement(None, {}, None)
+        self.current = self.root
+        self.threads = [_Thread(0, None, None)]
+        self.content_changed = False
+        self.element_defs_found = set()
+        self.already_closed_void_elements = []
+        self.preserve_whitespace_depth = 0
+        self.string_container_stack = []
+        self.pending_data = []
+        self.elements_opened = 0
+        # The candidates for each tag name, split into those with no attributes to test and those with some
+        self.candidates_by_name = {}
+
+    def handle_starttag(self, tag, attrs):
+        self._start_element(tag, attrs)
+        if tag in _VOID_ELEMENTS:
+            self._end_element(tag)
+            self.already_closed_void_elements.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self._start_element(tag, attrs)
+        self._end_element(tag)
+
+    def handle_endtag(self, tag):
+        if tag in self.already_closed_void_elements:
+            self.already_closed_void_elements.remove(tag)
+        else:
+            self._end_element(tag)
+
+    def handle_data(self, data):
+        self.pending_data.append(data)
+
+    def handle_comment(self, data):
+        self._flush_data()
+
+    def handle_decl(self, decl):
+        self._flush_data()
+
+    def handle_pi(self, data):
+        self._flush_data()
+
+    def unknown_decl(self, data):
+        self._flush_data()
+        if data.upper().startswith('CDATA['):
+            self._add_string(data[len('CDATA['):], None)
+
+    def close(self):
+        HTMLParser.close(self)
+        self._flush_data()
+        while self.current is not self.root:
+            self._pop_element()
+        self._check_satisfied()
+
+    def failed_on_index(self):
+        # Once the whole document is read every assumption is resolved, so exactly one thread remains
+        thread, = self.threads
+        return None if thread.trail is None else thread.trail.index
+
+    def unmatched_index(self):
+        thread, = self.threads
+        return thread.index
+
+    def _start_element(self, name, attrs):
+        self._flush_data()
+        self.elements_opened += 1
+
+        element_attrs = {}
+        for key, value in attrs:
+            element_attrs[key] = '' if value is None else value
+        element_attrs = _BUILDER._replace_cdata_list_attribute_values(name, element_attrs)
+
+        element = _OpenElement(name, element_attrs, self.current)
+        element.candidates = self._candidates(element)
+        self.current = element
+        if name in _PRESERVE_WHITESPACE_ELEMENTS:
+            self.preserve_whitespace_depth += 1
+        if name in _STRING_CONTAINERS:
+            self.string_container_stack.append(element)
+
+        found_without_content = [index for index in element.candidates if not self.needles[index]]
+        if found_without_content:
+            self._keep(element)
+            self.element_defs_found.update(found_without_content)
+
+        self._advance_threads(element)
+
+    def _candidates(self, element):
+        """ The indexes of the definitions the element matches, by name and attributes, as a frozenset. """
+
+        by_name = self.candidates_by_name.get(element.name)
+        if by_name is None:
+            candidates = self.compiled_spec.candidates(element.name)
+            by_name = self.candidates_by_name[element.name] = (
+                frozenset(index for index in candidates if not self.all_element_definitions[index].attrs),
+                tuple(index for index in candidates if self.all_element_definitions[index].attrs))
+        without_attrs, with_attrs = by_name
+        if not with_attrs:
+            return without_attrs
+        return without_attrs.union(index for index in with_attrs
+                                   if _attributes_match(self.all_element_definitions[index], element))
+
+    def _advance_threads(self, element):
+        """ Tests the newly opened element against the current definition of every live thread. """
+
+        if self.content_changed:
+            self.threads = [thread for thread in self.threads if thread.alive]
+            self.content_changed = False
+
+        threads = []
+        for thread in self.threads:
+            index = thread.index
+            if index == len(self.all_element_definitions):
+                threads.append(thread)
+                continue
+            trail = _TrailEntry(element, index, thread.trail)
+            if index not in element.candidates:
+                threads.append(_Thread(index, thread.assumption, trail))
+            elif not self.needles[index]:
+                threads.append(_Thread(index + 1, thread.assumption, trail))
+                if index + 1 == len(self.all_element_definitions) and threads[-1].certain:
+                    raise _Satisfied()
+            elif thread.assumed_absent(element, self.needles[index]):
+                threads.append(_Thread(index, thread.assumption, trail))
+            else:
+                needle = self.needles[index]
+                threads.append(_Thread(index + 1, _Assumption(element, needle, True, thread.assumption), trail))
+                threads.append(_Thread(index, _Assumption(element, needle, False, thread.assumption), trail))
+        self.threads = threads
+
+    def _end_element(self, name):
+        self._flush_data()
+        if self.current.name != name and not any(element.name == name for element in self.current.ancestors_and_self()
+                                                 if element is not self.root):
+            return
+        while True:
+            element = self._pop_element()
+            if element.name == name:
+                break
+
+    def _pop_element(self):
+        element = self.current
+        element.closed = True
+        self.current = element.parent
+        if element.name in _PRESERVE_WHITESPACE_ELEMENTS:
+            self.preserve_whitespace_depth -= 1
+        if self.string_container_stack and self.string_container_stack[-1] is element:
+            self.string_container_stack.pop()
+
+        if element.kept:
+            for index in element.candidates:
+                needle = self.needles[index]
+                if needle and (element.text_kind, needle) in element.kept_found:
+                    self.element_defs_found.add(index)
+
+        threads = []
+        for thread in self.threads:
+            resolving = thread.assumption is not None and thread.assumption.element is element
+            if thread.element_closed(element):
+                threads.append(thread)
+                if resolving and thread.index == len(self.all_element_definitions) and thread.certain:
+                    raise _Satisfied()
+        self.threads = threads
+        return element
+
+    def _flush_data(self):
+        if not self.pending_data:
+            return
+        data = ''.join(self.pending_data)
+        self.pending_data = []
+        data = _collapse_whitespace(data, self.preserve_whitespace_depth)
+        text_kind = self.string_container_stack[-1].name if self.string_container_stack else None
+        self._add_string(data, text_kind)
+
+    def _add_string(self, string, text_kind):
+        """ Records which needles appear in a string, for the element holding it and all of its ancestors. """
+
+        found = set((text_kind, needle) for needle in self.needle_search.needles_in(string))
+        if not found:
+            return
+
+        self.current.kept_found |= found
+        for element in self.current.ancestors_and_self():
+            element.found |= found
+            if not element.kept and self._content_found(element, element.found):
+                self._keep(element)
+        if self.current.kept:
+            self._keep(self.current)
+        self.content_changed = True
+        self._check_satisfied()
+
+    def _content_found(self, element, found):
+        return any(self.needles[index] and (element.text_kind, self.needles[index]) in found
+                   for index in element.candidates)
+
+    def _keep(self, element):
+        """
+        Marks an element as surviving the pruning, which means all its ancestors survive too.
+
+        The needles found in a kept element have already been passed up to all of its ancestors, so we only pass up
+        what they haven't seen yet, and stop at the first ancestor which is already kept once there is nothing new.
+        """
+
+        passed_up = element.kept_found
+        while True:
+            if not element.kept:
+                element.kept = True
+                passed_up = passed_up | element.kept_found
+            parent = element.parent
+            if parent is None:
+                break
+            passed_up = passed_up - parent.kept_found
+            if passed_up:
+                parent.kept_found |= passed_up
+                self.content_changed = True
+            elif parent.kept:
+                break
+            element = parent
+
+    def _check_satisfied(self):
+        """ We can stop as soon as a thread which has matched every definition is known to be the real one. """
+
+        if any(thread.index == len(self.all_element_definitions) and thread.certain for thread in self.threads):
+            raise _Satisfied()
+
+
+def stream_match(spec, html_src, parser=None, encoding=None, chunk_size=DEFAULT_CHUNK_SIZE, stats=False):
+    """
+    Checks all spec elements appear in order, reading html parser events without building a tree.
+
+    The html is decoded and parsed a chunk at a time, and reading stops as soon as the spec has been matched, so a spec
+    for the top of a large page never reads the rest of it. The result says how much of the html was read, in bytes
+    for html given as bytes and in characters for a string.
+
+    The html can also be a file-like object or an iterator of bytes or string chunks, such as the body of a streamed
+    response, which is never held in memory all at once. What has been read is kept in a temporary file in case the
+    match fails, and the result of a failed match keeps the file, reading the html back only when it is asked for
+    (such as by the report).
+
+    With stats set, the result has a MatchStats timing the compile and match phases (reading, parsing and matching
+    all happen together) and, when it failed, the diagnose phase, and counting the elements opened and the name
+    regexes evaluated.
+    """
+
+    if parser not in (None, HTML_PARSER):
+        raise ValueError('The stream matcher can only use the {0} parser'.format(HTML_PARSER))
+    if isinstance(html_src, Document):
+        # The stream matcher doesn't need a tree, so it just reads the document's source again
+        html_src, encoding = html_src.html_src, encoding or html_src.encoding
+
+    stats = MatchStats() if stats else None
+    with phase(stats, 'compile'):
+        compiled_spec = compile_spec(spec)
+    if stats is not None:
+        compiled_spec = stats.counting_spec(compiled_spec)
+    if is_html_stream(html_src):
+        return _stream_match_chunks(spec, compiled_spec, html_src, encoding, chunk_size, stats)
+
+    with phase(stats, 'match'):
+        try:
+            matcher, satisfied, bytes_consumed = _feed_chunks(compiled_spec, decode_html_chunks(html_src, encoding,
+                                                                                                 chunk_size))
+        except UnicodeDecodeError:
+            if encoding:
+                raise
+            # The encoding detected from the start of the html was wrong, so we start again and decode it all at once
+            matcher, satisfied, bytes_consumed = _feed_chunks(compiled_spec, [(decode_html(html_src), len(html_src))])
+    return _stream_result(spec, compiled_spec, html_src, matcher, satisfied, bytes_consumed, stats)
+
+
+def _stream_match_chunks(spec, compiled_spec, html_stream, encoding, chunk_size, stats):
+    """ Matches html read from a file-like object or an iterator of chunks, spooling it for the report. """
+
+    chunks = html_chunks(html_stream, chunk_size)
+    spool = _Spool()
+    try:
+        with phase(stats, 'match'):
+            try:
+                matcher, satisfied, bytes_consumed = _feed_chunks(
+                    compiled_spec, decode_html_chunks(spool.tee(chunks), encoding, chunk_size))
+            except UnicodeDecodeError:
+                if encoding:
+                    raise
+                # We can't detect the encoding from the whole html without reading it all, so when the encoding
+                # detected from the start turns out to be wrong we fall back to windows-1252, as BeautifulSoup does
+                # once UTF-8 has failed. What has been read so far is replayed from the spool.
+                spooled, spool = spool, _Spool()
+                try:
+                    replayed = itertools.chain(html_chunks(spooled.rewound(), chunk_size), chunks)
+                    matcher, satisfied, bytes_consumed = _feed_chunks(
+                        compiled_spec, decode_html_chunks(spool.tee(replayed), _FALLBACK_ENCODING, chunk_size))
+                finally:
+                    spooled.close()
+        # The html of a failed match is only read back from the spool if the report is rendered
+        html_file = None if satisfied else spool.detach()
+    finally:
+        spool.close()
+    return _stream_result(spec, compiled_spec, None, matcher, satisfied, bytes_consumed, stats, html_file=html_file)
+
+
+def _stream_result(spec, compiled_spec, html_src, matcher, satisfied, bytes_consumed, stats, html_file=None):
+    if stats is not None:
+        stats.elements_visited += matcher.elements_opened
+    if satisfied:
+        return MatcherResult(spec, html_src, None, passed=True, bytes_consumed=bytes_consumed, stats=stats)
+
+    with phase(stats, 'diagnose'):
+        element_defs = compiled_spec.element_defs_for(spec)
+        element_defs_not_found = [element_def for index, element_def in enumerate(element_defs)
+                                  if index not in matcher.element_defs_found]
+    return MatcherResult(spec,
+                         html_src,
+                         None,
+                         passed=False,
+                         element_defs_not_found=element_defs_not_found,
+                         failed_on_def=_element_def_at(element_defs, matcher.failed_on_index()),
+                         unmatched_def=element_defs[matcher.unmatched_index()],
+                         bytes_consumed=bytes_consumed,
+                         stats=stats,
+                         html_file=html_file)
+
+
+def _feed_chunks(compiled_spec, chunks):
+    """ Feeds the chunks to a new matcher until it is satisfied, returning it and how much of the html it read. """
+
+    matcher = _StreamMatcher(compiled_spec)
+    bytes_consumed = 0
+    try:
+        for chunk, bytes_consumed in chunks:
+            matcher.feed(chunk)
+        matcher.close()
+    except _Satisfied:
+        return matcher, True, bytes_consumed
+    return matcher, False, bytes_consumed
+
+
+class _Spool(object):
+    """ Keeps the chunks of html read from a stream, in memory while there are only a few and in a file after that. """
+
+    def __init__(self):
+        self.file = None
+
+    def tee(self, chunks):
+        for chunk in chunks:
+            if self.file is None:
+                if isinstance(chunk, str):
+                    self.file = SpooledTemporaryFile(_SPOOL_MEMORY, mode='w+', encoding='utf-8', newline='')
+                else:
+                    self.file = SpooledTemporaryFile(_SPOOL_MEMORY, mode='w+b')
+            self.file.write(chunk)
+            yield chunk
+
+    def rewound(self):
+        """ The spooled html as a file-like object, read from the start. """
+
+        if self.file is None:
+            return io.BytesIO()
+        self.file.seek(0)
+        return self.file
+
+    def detach(self):
+        """ The spooled html as a file-like object, which is left open for whoever reads it to close. """
+
+        if self.file is None:
+            return io.StringIO()
+        spooled, self.file = self.rewound(), None
+        return spooled
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
@@ -0,0 +1,198 @@
+from bisect import bisect_left
+
+from .compiler import compile_spec
+from .document import Document
+from .index import DocumentIndex
+from .matchers import MatcherResult, _attribute_candidates, _attribute_indexed, _attributes_match, _content_matches,\
+    _element_def_at
+from .parsers import parse_html, read_html
+from .stats import MatchStats, phase
+
+
+def structural_match(spec, html_src, parser=None, encoding=None, stats=False):
+    """
+    Checks the spec tree is embedded in the html tree, keeping both ancestry and order.
+
+    Each element def must match an element, the children of a def must match descendants of that element, and the
+    siblings in the spec must match elements which come one after another in the document (neither inside the other).
+    This is ordered tree inclusion, which we decide bottom up with dynamic programming rather than by searching, so
+    repetitive markup such as tables and lists can't make it blow up. With P element defs and T elements it takes
+    O(P * T * log T) time and O(P * T) space at worst, and in practice far less, as only the elements whose name,
+    attributes and content match a def are ever considered for it.
+
+    With stats set, the result has a MatchStats timing the parse, compile, label (matching elements to defs by
+    themselves), embed and diagnose phases.
+    """
+
+    stats = MatchStats() if stats else None
+    with phase(stats, 'parse'):
+        if isinstance(html_src, Document):
+            html_src, root_element, document_index = html_src.html_src, html_src.root_element, html_src.index
+        else:
+            html_src = read_html(html_src)
+            root_element = parse_html(html_src, parser, encoding)
+            document_index = DocumentIndex(root_element)
+    with phase(stats, 'compile'):
+        compiled_spec = compile_spec(spec)
+        element_defs = compiled_spec.element_defs_for(spec)
+        children = _child_indexes(compiled_spec)
+        label_ids, tree_ids = _structure_ids(compiled_spec, children)
+    if stats is not None:
+        compiled_spec = stats.counting_spec(compiled_spec)
+        document_index = stats.counting_index(document_index)
+        stats.elements_visited += len(document_index)
+
+    with phase(stats, 'label'):
+        labelled = _labelled_positions(compiled_spec, document_index, label_ids)
+
+    # Working backwards through the flattened spec we see every def's children before the def itself. Repeated parts
+    # of the spec, such as the rows of a table, are only embedded once.
+    with phase(stats, 'embed'):
+        embeddings = [None] * len(compiled_spec)
+        embeddings_by_tree = {}
+        for index in range(len(compiled_spec) - 1, -1, -1):
+            tree_embeddings = embeddings_by_tree.get(tree_ids[index])
+            if tree_embeddings is None:
+                tree_embeddings = _Embeddings([position for position in labelled[label_ids[index]]
+                                               if _children_embed(children[index], embeddings, document_index,
+                                                                  position)],
+                                              document_index)
+                embeddings_by_tree[tree_ids[index]] = tree_embeddings
+            embeddings[index] = tree_embeddings
+
+    if embeddings[0].positions:
+        return MatcherResult(spec, html_src, root_element, passed=True, bytes_consumed=len(html_src), stats=stats)
+
+    # The def we failed on is the first whose children all embed somewhere, but which can't itself be embedded
+    with phase(stats, 'diagnose'):
+        failed_index = next(index for index in range(len(compiled_spec))
+                            if not embeddings[index].positions
+                            and all(embeddings[child].positions for child in children[index]))
+        first_matches = dict((element_defs[index], document_index.elements[labelled[label_ids[index]][0]])
+                             for index in range(len(compiled_spec)) if labelled[label_ids[index]])
+    return MatcherResult(spec,
+                         html_src,
+                         root_element,
+                         passed=False,
+                         element_defs_not_found=[element_defs[index] for index in range(len(compiled_spec))
+                                                 if not labelled[label_ids[index]]],
+                         failed_on_def=_element_def_at(element_defs, failed_index),
+                         first_matches=first_matches,
+                         unmatched_def=element_defs[failed_index],
+                         bytes_consumed=len(html_src),
+                         stats=stats)
+
+
+class _Embeddings(object):
+    """
+    The elements a def can be embedded at, in document order, ready to find the one whose subtree ends first.
+
+    Embedding the children of a def greedily, each at the element which ends soonest, leaves the most room for the
+    siblings which follow, so it finds an embedding whenever there is one.
+    """
+
+    __slots__ = ('positions', 'earliest_ends')
+
+    def __init__(self, positions, document_index):
+        self.positions = positions
+        self.earliest_ends = [0] * len(positions)
+        earliest_end = len(document_index)
+        for hit in range(len(positions) - 1, -1, -1):
+            earliest_end = min(earliest_end, document_index.ends[positions[hit]])
+            self.earliest_ends[hit] = earliest_end
+
+    def earliest_end_from(self, start):
+        """ The end of the first subtree, among the elements at or after the start, which the def embeds in. """
+
+        hit = bisect_left(self.positions, start)
+        return self.earliest_ends[hit] if hit < len(self.positions) else None
+
+
+def _children_embed(child_indexes, embeddings, document_index, position):
+    """ Checks the defs can be embedded, in order and without overlapping, among the descendants of the element. """
+
+    start, end = position + 1, document_index.ends[position]
+    for child_index in child_indexes:
+        child_end = embeddings[child_index].earliest_end_from(start)
+        # Any element starting inside this one ends inside it too, so an end beyond it means nothing fitted inside
+        if child_end is None or child_end > end:
+            return False
+        start = child_end
+    return True
+
+
+def _child_indexes(compiled_spec):
+    """ The indexes of the children of each def in the flattened spec. """
+
+    # Identical element defs are shared, so the same def can be at several places in the spec, and the children are
+    # found from the positions of the defs rather than their identities: the first child follows its parent, and each
+    # later child follows the subtree of the one before
+    element_defs = compiled_spec.element_defs
+    sizes = [1] * len(element_defs)
+    for index in range(len(element_defs) - 1, -1, -1):
+        child_index = index + 1
+        for _ in element_defs[index].children:
+            sizes[index] += sizes[child_index]
+            child_index += sizes[child_index]
+
+    child_indexes = []
+    for index, element_def in enumerate(element_defs):
+        child_index = index + 1
+        children = []
+        for _ in element_def.children:
+            children.append(child_index)
+            child_index += sizes[child_index]
+        child_indexes.append(children)
+    return child_indexes
+
+
+def _structure_ids(compiled_spec, children):
+    """
+    Numbers the defs so that defs matching the same elements share a label id, and defs which also have the same
+    children (all the way down) share a tree id.
+    """
+
+    labels = {}
+    trees = {}
+    label_ids = [labels.setdefault((definition.name_matcher.pattern, definition.content, definition.attrs), len(labels))
+                 for definition in compiled_spec.definitions]
+    tree_ids = [None] * len(compiled_spec)
+    for index in range(len(compiled_spec) - 1, -1, -1):
+        tree = (label_ids[index], tuple(tree_ids[child] for child in children[index]))
+        tree_ids[index] = trees.setdefault(tree, len(trees))
+    return label_ids, tree_ids
+
+
+def _labelled_positions(compiled_spec, document_index, label_ids):
+    """ The positions of the elements matched by the defs with each label id, before considering their children. """
+
+    document_index.search_needles(compiled_spec.needle_search)
+    # Only the first def with each label id needs testing, as the others match the same elements
+    representatives = {}
+    for index, label_id in enumerate(label_ids):
+        representatives.setdefault(label_id, index)
+    # Defs with attributes can go straight to the elements which have them, and the others are tested against each one
+    attributed = _attribute_indexed(sorted(representatives.values()), compiled_spec.definitions, document_index)
+    scanned = frozenset(representatives.values()).difference(attributed)
+    candidates_by_name = {}
+
+    labelled = [[] for _ in range(len(representatives))]
+    for index in attributed:
+        element_def = compiled_spec.definitions[index]
+        labelled[label_ids[index]] = [
+            position for position in _attribute_candidates(element_def, document_index)
+            if position and element_def.name_matcher.match(document_index.elements[position].name)
+            and _attributes_match(element_def, document_index.elements[position])
+            and _content_matches(element_def, document_index, position)]
+
+    for position in range(1, len(document_index)):
+        element = document_index.elements[position]
+        candidates = candidates_by_name.get(element.name)
+        if candidates is None:
+            candidates = [index for index in compiled_spec.candidates(element.name) if index in scanned]
+            candidates_by_name[element.name] = candidates
+        for index in candidates:
+            element_def = compiled_spec.definitions[index]
+            if _attributes_match(element_def, element) and _content_matches(element_def, document_index, position):
+                labelled[label_ids[index]].append(position)
+    return labelled
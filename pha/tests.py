@@ -1,18 +1,69 @@
 import unittest
 
+from bs4 import BeautifulSoup
+
+try:
+    import lxml
+except ImportError:
+    lxml = None
+
+try:
+    import html5lib
+except ImportError:
+    html5lib = None
+
+try:
+    import xdist
+except ImportError:
+    xdist = None
+
+import asyncio
+import gc
+import io
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import weakref
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from unittest import mock
+
+from pha.benchmarks.generators import generate_document, generate_spec, generate_tree, render_document
+from pha.benchmarks.suite import compare
+from pha.compiler import RECENTLY_COMPILED_MAX
+from pha.index import DocumentIndex
+from pha.structural import structural_match
+import pha.compiler
+import pha.matchers
+import pha.reports
+from pha.matchers import MatcherResult, _prune_unmatched_elements
+from pha.pytest_plugin import HtmlMatchCache, pytest_configure, timings_table
+from pha.spec import _NAME_MATCHERS, _NAME_MATCHERS_MAX
+from pha.streaming import _StreamMatcher
+from pha.textsearch import NeedleSearch
+from pha.xpath import _XPATHS
 from pha import elem, html_match, html, heading, text, a, accordion, acc_group, acc_body, acc_heading, div, input,\
-    img, select, option, option_xhtml
+    img, select, option, option_xhtml, stream_match, compile_spec, CompiledSpec, prune_unmatched_elements, \
+    html_match_many, Document, linear_match, html_match_file, xpath_match, pretty_spec, write_spec, ReportLimits, \
+    html_match_async, ResultCache, set_max_compiled_specs
 
 
 class BaseElementDefTests(unittest.TestCase):
 
+    matcher = None
+    options = {}
+
     def assert_match(self, html_src, spec):
-        result = html_match(spec, html_src)
+        result = html_match(spec, html_src, matcher=self.matcher, **self.options)
         print(str(result))
         self.assertTrue(result.passed)
 
     def assert_not_match(self, html_src, spec):
-        result = html_match(spec, html_src)
+        result = html_match(spec, html_src, matcher=self.matcher, **self.options)
         print(str(result))
         self.assertTrue(result.failed)
 
@@ -26,14 +77,12 @@ class ElementDefConstructionTests(BaseElementDefTests):
         self.assertEqual(r'^parent$', parent_element_def.name_regex)
         self.assertIsNotNone(parent_element_def.name_matcher)
         self.assertIsNone(parent_element_def.content)
-        self.assertIsNone(parent_element_def.parent)
         self.assertEqual(1, len(parent_element_def.children))
         self.assertIn(child_element_def, parent_element_def.children)
         self.assertEqual(2, len(parent_element_def.attrs))
         self.assertEqual('abc', parent_element_def.attrs['id'])
         self.assertEqual('the parent', parent_element_def.attrs['title'])
 
-        self.assertEqual(parent_element_def, child_element_def.parent)
         self.assertEqual('child', child_element_def.content)
 
     def test_element_def_construction_with_content_as_keyword(self):
@@ -48,6 +97,46 @@ class ElementDefConstructionTests(BaseElementDefTests):
         self.assertEqual('some-class', element_def.attrs['class'])
         self.assertFalse('class_' in element_def.attrs)
 
+    def test_identical_element_defs_are_shared(self):
+        self.assertIs(elem('td', content='Cell', id='a'), elem('td', content='Cell', id='a'))
+        self.assertIs(acc_group(acc_heading(text('Heading'))), acc_group(acc_heading(text('Heading'))))
+        self.assertIsNot(elem('td', content='Cell'), elem('td', content='Other'))
+        self.assertIsNot(elem('td', content=1), elem('td', content='1'))
+        self.assertIsNot(elem('tr', elem('td')), elem('tr', elem('td'), elem('td')))
+
+        spec = html(*[elem('tr', elem('td', content='Cell')) for _ in range(100)])
+        self.assertEqual(1, len(set(map(id, spec.children))))
+
+    def test_element_defs_share_name_matchers(self):
+        self.assertIs(elem('td', id='a').name_matcher, elem('td', id='b').name_matcher)
+
+    def test_name_matchers_cache_is_bounded(self):
+        for i in range(_NAME_MATCHERS_MAX + 10):
+            elem('generated-{0}'.format(i))
+
+        self.assertEqual(_NAME_MATCHERS_MAX, len(_NAME_MATCHERS))
+        self.assertNotIn(r'^generated-0$', _NAME_MATCHERS)
+        self.assertIn(r'^generated-{0}$'.format(_NAME_MATCHERS_MAX + 9), _NAME_MATCHERS)
+
+    def test_element_def_with_unhashable_attribute(self):
+        element_def = elem('td', data=['a', 'b'])
+
+        self.assertEqual(['a', 'b'], element_def.attrs['data'])
+        self.assertIsNot(element_def, elem('td', data=['a', 'b']))
+
+    def test_element_defs_are_immutable(self):
+        element_def = elem('td', content='Cell', id='a')
+
+        self.assertRaises(AttributeError, setattr, element_def, 'content', 'Other')
+        with self.assertRaises(TypeError):
+            element_def.attrs['id'] = 'b'
+        self.assertRaises(AttributeError, getattr, element_def, '__dict__')
+
+    def test_element_defs_pickle(self):
+        spec = html(elem('tr', elem('td', content='Cell', class_='cell')))
+
+        self.assertIs(spec, pickle.loads(pickle.dumps(spec)))
+
 
 class SimpleMatchingTests(BaseElementDefTests):
 
@@ -175,6 +264,62 @@ class MatchingResultTests(BaseElementDefTests):
         self.assertEqual(0, len(result.element_defs_not_found))
         self.assertEqual(heading_not_found_def, result.failed_on_def)
 
+    def test_result_object_failed_records_first_matches(self):
+        html_src = '<html>\n<p class="intro">Content found</p>\n<h1>Heading</h1>\n<h1>Heading again</h1>\n</html>'
+
+        heading_def = heading('Heading')
+        content_def = elem('p', content='Content found')
+        missing_def = text('Missing')
+        spec = html(heading_def, content_def, missing_def)
+
+        result = html_match(spec, html_src, parser='html.parser')
+
+        self.assertEqual('h1', result.first_matches[heading_def].name)
+        self.assertEqual(3, result.first_matches[heading_def].sourceline)
+        self.assertEqual('p', result.first_matches[content_def].name)
+        self.assertNotIn(missing_def, result.first_matches)
+        self.assertEqual([missing_def], result.element_defs_not_found)
+        self.assertEqual(content_def, result.unmatched_def)
+
+    def test_result_text_explains_out_of_order_match(self):
+        html_src = '<html>\n<p class="intro">Content found</p>\n<h1>Heading</h1>\n</html>'
+
+        result = html_match(html(heading('Heading'), elem('p', content='Content found')), html_src)
+
+        self.assertIn('is in the HTML, but not in order, first matching <p class="intro"> on line 2', str(result))
+
+    def test_report_sections_are_remembered(self):
+        result = html_match(html(text('Missing')), '<html><p>Content</p></html>')
+
+        self.assertIs(str(result), str(result))
+        self.assertIs(result.pretty_spec(), result.pretty_spec())
+        self.assertIs(result.pretty_html_src(), result.pretty_html_src())
+
+    def test_full_source_keeps_pruned_elements(self):
+        result = html_match(html(text('Content')), '<html><p>Content</p><span>Other</span></html>',
+                            parser='html.parser')
+
+        self.assertEqual(['html', 'p'], [element.name for element in result.kept_elements])
+        self.assertIn('Other', result.pretty_html_src())
+        self.assertNotIn('Other', result.pretty_pruned_html())
+
+    def test_matching_leaves_tree_unchanged(self):
+        html_src = '<html><p>Content</p><span>Other</span></html>'
+
+        result = html_match(html(text('Missing')), html_src)
+        str(result)
+
+        self.assertEqual(html_src, str(result.root_element))
+        self.assertEqual('<html>\n</html>\n', result.pretty_pruned_html())
+
+    def test_report_shows_pruned_and_full_source(self):
+        result = html_match(html(text('Missing')), '<html><p>Content</p><span>Other</span></html>')
+
+        report = str(result)
+        pruned_html = report[report.index('Pruned HTML Source:'):report.index('Full HTML Source:')]
+        self.assertNotIn('Other', pruned_html)
+        self.assertIn('Other', report[report.index('Full HTML Source:'):])
+
 
 class ElementDefHelperTests(BaseElementDefTests):
 
@@ -847,5 +992,1487 @@ class ComplexElementDefTests(BaseElementDefTests):
         self.assert_match(html_src, spec)
 
 
+class CompiledSpecTests(BaseElementDefTests):
+
+    def test_compile_spec(self):
+        spec = html(div(text('Hello', id='greeting')))
+
+        compiled_spec = compile_spec(spec)
+
+        self.assertIsInstance(compiled_spec, CompiledSpec)
+        self.assertEqual(spec, compiled_spec.spec)
+        self.assertEqual(3, len(compiled_spec))
+        self.assertEqual((('id', 'greeting'),), compiled_spec.definitions[2].attrs)
+        self.assertEqual('Hello', compiled_spec.definitions[2].content)
+        self.assertIs(compiled_spec, compile_spec(compiled_spec))
+
+    def test_candidates_by_tag_name(self):
+        compiled_spec = compile_spec(html(div(heading('Title'), elem('p'), text('Hello'), div(id='inner'))))
+
+        self.assertEqual((1, 5), compiled_spec.defs_by_name['div'])
+        self.assertEqual((2, 4), compiled_spec.defs_by_regex)
+        self.assertEqual((1, 4, 5), compiled_spec.candidates('div'))
+        self.assertEqual((2, 4), compiled_spec.candidates('h2'))
+        self.assertEqual((4,), compiled_spec.candidates('span'))
+
+    def test_compiled_spec_is_immutable(self):
+        compiled_spec = compile_spec(html())
+
+        with self.assertRaises(AttributeError):
+            compiled_spec.definitions = ()
+
+    def test_identical_specs_share_compiled_spec(self):
+        self.assertIs(compile_spec(html(text('Shared'))), compile_spec(html(text('Shared'))))
+        self.assertIsNot(compile_spec(html(text('Shared'))), compile_spec(html(text('Not shared'))))
+        self.assertIsNot(compile_spec(div(class_='a')), compile_spec(div(id='a')))
+
+    def test_compiled_specs_are_not_kept_forever(self):
+        compiled_refs = [weakref.ref(compile_spec(html(text('Spec {0}'.format(number)))))
+                         for number in range(RECENTLY_COMPILED_MAX * 2)]
+        gc.collect()
+
+        self.assertEqual(RECENTLY_COMPILED_MAX, sum(1 for compiled_ref in compiled_refs if compiled_ref() is not None))
+        self.assertIsNotNone(compiled_refs[-1]())
+        self.assertIsNone(compiled_refs[0]())
+
+    def test_max_compiled_specs_can_be_set(self):
+        self.addCleanup(set_max_compiled_specs, RECENTLY_COMPILED_MAX)
+        compiled_refs = [weakref.ref(compile_spec(html(text('Spec {0}'.format(number))))) for number in range(8)]
+
+        set_max_compiled_specs(4)
+        gc.collect()
+
+        self.assertEqual([None] * 4, [compiled_ref() for compiled_ref in compiled_refs[:4]])
+        self.assertNotIn(None, [compiled_ref() for compiled_ref in compiled_refs[4:]])
+
+    def test_match_compiled_spec(self):
+        compiled_spec = compile_spec(html(div(text('Hello'))))
+
+        self.assert_match('<html><div><p>Hello</p></div></html>', compiled_spec)
+        self.assert_not_match('<html><div><p>Goodbye</p></div></html>', compiled_spec)
+
+    def test_result_reports_element_defs_from_matched_spec(self):
+        compile_spec(html(text('Not found')))
+
+        not_found_def = text('Not found')
+        spec = html(not_found_def)
+
+        result = html_match(spec, '<html></html>')
+
+        self.assertEqual([not_found_def], result.element_defs_not_found)
+        self.assertEqual(spec, result.failed_on_def)
+
+    def test_prune_with_compiled_spec(self):
+        root_element = BeautifulSoup('<html><div><p>Hello</p></div><p>Goodbye</p></html>', 'html.parser')
+
+        self.assertTrue(prune_unmatched_elements(root_element, compile_spec(elem('div', text('Hello')))))
+        self.assertEqual('<html><div><p>Hello</p></div></html>', str(root_element))
+
+
+class DocumentIndexTests(unittest.TestCase):
+
+    def build_index(self, html_src):
+        return DocumentIndex(BeautifulSoup(html_src, 'html.parser'))
+
+    def test_elements_in_document_order(self):
+        document_index = self.build_index('<html><div><p>One</p><p>Two</p></div><span>Three</span></html>')
+
+        self.assertEqual(['[document]', 'html', 'div', 'p', 'p', 'span'],
+                         [element.name for element in document_index.elements])
+        self.assertEqual([-1, 0, 1, 2, 2, 1], document_index.parents)
+        self.assertEqual([6, 6, 5, 4, 5, 6], document_index.ends)
+
+    def test_text_ranges(self):
+        document_index = self.build_index('<div><b>One</b>Two<!-- Comment --></div><p>Three</p>')
+
+        self.assertEqual(['One', 'Two', ' Comment ', 'Three'], document_index.texts)
+        self.assertEqual((0, 3), (document_index.text_starts[1], document_index.text_ends[1]))
+        self.assertEqual((0, 1), (document_index.text_starts[2], document_index.text_ends[2]))
+        self.assertEqual((3, 4), (document_index.text_starts[3], document_index.text_ends[3]))
+
+    def test_content_contains(self):
+        document_index = self.build_index('<div><b>One</b>Two<!-- Comment --></div><p>Three</p>')
+
+        self.assertTrue(document_index.content_contains(1, 'One'))
+        self.assertTrue(document_index.content_contains(1, 'Two'))
+        self.assertFalse(document_index.content_contains(1, 'Comment'))
+        self.assertFalse(document_index.content_contains(1, 'Three'))
+        self.assertFalse(document_index.content_contains(2, 'Two'))
+
+    def test_content_contains_when_pruned(self):
+        document_index = self.build_index('<div><b>One</b>Two</div>')
+        document_index.set_kept([True, True, False])
+
+        self.assertTrue(document_index.content_contains(1, 'One'))
+        self.assertFalse(document_index.content_contains(1, 'One', pruned=True))
+        self.assertTrue(document_index.content_contains(1, 'Two', pruned=True))
+
+    def test_render_kept_elements(self):
+        html_src = '<html><div><p>One<b>Bold</b></p>Tail<span>Two</span></div><i>Three</i></html>'
+        spec = html(elem('p', content='One'))
+        pruned_root = BeautifulSoup(html_src, 'html.parser')
+        prune_unmatched_elements(pruned_root, spec)
+
+        document_index = _prune_unmatched_elements(self.build_index(html_src), compile_spec(spec))
+
+        self.assertEqual(str(pruned_root), document_index.render())
+        self.assertEqual(pruned_root.prettify(), document_index.render(pretty=True))
+        self.assertEqual(html_src, str(document_index.elements[0]))
+
+    def test_script_content_only_belongs_to_script(self):
+        document_index = self.build_index('<div><script>var a;</script></div>')
+
+        self.assertFalse(document_index.content_contains(1, 'var a'))
+        self.assertTrue(document_index.content_contains(2, 'var a'))
+
+    def test_search_needles(self):
+        document_index = self.build_index('<div><b>One</b>Two<script>One</script></div><p>Three One</p>')
+        document_index.search_needles(NeedleSearch(['One', 'Tw', 'Four']))
+
+        self.assertTrue(document_index.content_contains(1, 'Tw'))
+        self.assertFalse(document_index.content_contains(1, 'Four'))
+        self.assertFalse(document_index.content_contains(2, 'Tw'))
+        self.assertTrue(document_index.content_contains(4, 'One'))
+        self.assertTrue(document_index.content_contains(3, 'One'))
+
+    def test_attribute_positions(self):
+        document_index = self.build_index('<div id="main" class="box wide"><p id="main-text" class="boxed">One</p>'
+                                          '<a rel="nofollow" title="main">Two</a><p class="box">Three</p></div>')
+
+        self.assertEqual([1, 2], document_index.attribute_positions('id', 'main'))
+        self.assertEqual([2], document_index.attribute_positions('id', '-t'))
+        self.assertEqual([1, 4], document_index.attribute_positions('class', 'box'))
+        self.assertEqual([], document_index.attribute_positions('class', 'bo'))
+        self.assertEqual([], document_index.attribute_positions('class', 'box wide'))
+        self.assertEqual([3], document_index.attribute_positions('rel', 'nofollow'))
+        self.assertEqual([], document_index.attribute_positions('title', 'One'))
+        self.assertEqual([], document_index.attribute_positions('lang', 'en'))
+
+    def test_attribute_positions_do_not_span_values(self):
+        document_index = self.build_index('<p id="ab"></p><p id="cd"></p><p id="abcd"></p><p id=""></p>')
+
+        self.assertEqual([3], document_index.attribute_positions('id', 'bc'))
+        self.assertEqual([1, 3], document_index.attribute_positions('id', 'ab'))
+        self.assertEqual([1, 2, 3, 4], document_index.attribute_positions('id', ''))
+
+    def test_attribute_index_is_shared_with_views(self):
+        document_index = self.build_index('<p id="one"></p>')
+        view = document_index.with_kept([True, True])
+        view.attribute_positions('id', 'one')
+
+        self.assertTrue(document_index.has_attribute_index('id'))
+        self.assertFalse(document_index.has_attribute_index('class'))
+
+
+class NeedleSearchTests(unittest.TestCase):
+
+    def build_search(self, *needles):
+        # Padded with needles which never appear, so the combined pattern is used rather than testing each in turn
+        return NeedleSearch(list(needles) + ['unused {0}'.format(index) for index in range(10)])
+
+    def test_uses_combined_pattern_for_many_needles(self):
+        self.assertIsNotNone(self.build_search('One').pattern)
+        self.assertIsNone(NeedleSearch(['One', 'Two']).pattern)
+
+    def test_needles_in(self):
+        needle_search = self.build_search('One', 'Two', 'Three')
+
+        self.assertEqual({'One', 'Three'}, needle_search.needles_in('One, Three'))
+        self.assertEqual(set(), needle_search.needles_in('Four'))
+
+    def test_needles_sharing_a_start(self):
+        needle_search = self.build_search('Item', 'Item 1', 'Item 10', 'Item 2')
+
+        self.assertEqual({'Item', 'Item 1', 'Item 10'}, needle_search.needles_in('Item 10'))
+        self.assertEqual({'Item', 'Item 1'}, needle_search.needles_in('Item 1'))
+
+    def test_overlapping_needles(self):
+        needle_search = self.build_search('abc', 'bcd', 'cd')
+
+        self.assertEqual({'abc', 'bcd', 'cd'}, needle_search.needles_in('abcd'))
+
+    def test_special_characters(self):
+        needle_search = self.build_search('1 + 1', '(a)', '[b]')
+
+        self.assertEqual({'1 + 1', '(a)'}, needle_search.needles_in('1 + 1 = (a)'))
+
+    def test_search(self):
+        needle_search = self.build_search('One', 'Two', 'Four')
+
+        hits = needle_search.search(['One', 'Two and One', 'Three', 'One One'])
+
+        self.assertEqual([0, 1, 3], hits['One'])
+        self.assertEqual([1], hits['Two'])
+        self.assertEqual([], hits['Four'])
+
+    def test_needles_never_match_across_texts(self):
+        needle_search = self.build_search('OneTwo')
+
+        self.assertEqual([], needle_search.search(['One', 'Two'])['OneTwo'])
+
+    def test_match_many_content_definitions(self):
+        rows = ['<tr><td>Row {0}</td></tr>'.format(index) for index in range(100)]
+        spec = html(elem('table', *[elem('td', content='Row {0}'.format(index)) for index in range(100)]))
+
+        self.assertTrue(html_match(spec, '<html><table>{0}</table></html>'.format(''.join(rows))).passed)
+        self.assertTrue(stream_match(spec, '<html><table>{0}</table></html>'.format(''.join(rows))).passed)
+        self.assertFalse(html_match(spec, '<html><table>{0}</table></html>'.format(''.join(rows[:-1]))).passed)
+
+
+class StreamMatchingTests(BaseElementDefTests):
+
+    matcher = staticmethod(stream_match)
+
+    def test_result_object_passing(self):
+        html_src = '<html><p>Content found</p></html>'
+        spec = html(text('Content found'))
+
+        result = html_match(spec, html_src, matcher=stream_match)
+
+        self.assertEqual(spec, result.spec)
+        self.assertEqual(html_src, result.html_src)
+        self.assertIsNone(result.root_element)
+        self.assertTrue(result.passed)
+
+    def test_result_object_failed_with_element_def_not_matching_any_element(self):
+        html_src = '<html><p>Content found</p></html>'
+
+        heading_not_found_def = text('Heading not found')
+        text_not_found_def = text('Text not found')
+        spec = html(
+            heading_not_found_def,
+            text('Content found'),
+            text_not_found_def
+        )
+
+        result = html_match(spec, html_src, matcher=stream_match)
+
+        self.assertTrue(result.failed)
+        self.assertEqual([heading_not_found_def, text_not_found_def], result.element_defs_not_found)
+        self.assertEqual(heading_not_found_def, result.failed_on_def)
+        self.assertIn('Failed when attempting to match against', str(result))
+
+    def test_result_object_failed_because_html_out_of_order(self):
+        html_src = '<html><p>Content found</p><h1>Heading not found</h1></html>'
+
+        heading_not_found_def = text('Heading not found')
+        spec = html(
+            heading_not_found_def,
+            text('Content found'),
+        )
+
+        result = html_match(spec, html_src, matcher=stream_match)
+
+        self.assertTrue(result.failed)
+        self.assertEqual(0, len(result.element_defs_not_found))
+        self.assertEqual(heading_not_found_def, result.failed_on_def)
+
+    def test_content_only_found_in_pruned_elements_not_matched(self):
+        self.assert_not_match('<html><div><span>Hello</span></div></html>', elem('div', content='Hello'))
+
+    def test_content_found_in_nested_matching_element(self):
+        self.assert_match('<html><div><span>Hello</span></div></html>', elem('div', text('Hello')))
+
+    def test_content_split_by_comment_not_matched(self):
+        self.assert_not_match('<html><p>Hello <!-- comment -->World</p></html>', text('Hello World'))
+
+    def test_class_attribute_matches_whole_tokens(self):
+        self.assert_match('<html><div class="btn btn-small"></div></html>', div(class_='btn-small'))
+        self.assert_not_match('<html><div class="btn btn-small"></div></html>', div(class_='small'))
+
+    def test_void_and_self_closing_elements(self):
+        html_src = '<html><div><img src="/a.png"><br/><div/></div><p>After</p></html>'
+        self.assert_match(html_src, html(div(img('/a.png')), text('After')))
+        self.assert_not_match(html_src, html(text('After'), img('/a.png')))
+
+    def test_unclosed_elements(self):
+        self.assert_match('<html><div><p>Hello', html(div(text('Hello'))))
+
+    def test_script_content_not_matched_by_ancestors(self):
+        self.assert_match('<html><script>var a = 1;</script></html>', elem('script', content='var a'))
+        self.assert_not_match('<html><script>var a = 1;</script></html>', elem('html', content='var a'))
+
+    def test_bytes_source(self):
+        self.assert_match('<html><p>Caf\u00e9</p></html>'.encode('utf-8'), text('Caf\u00e9'))
+
+    def test_stops_reading_once_matched(self):
+        html_src = '<html><h1>Title</h1>{0}</html>'.format('<p>Filler</p>' * 1000).encode('utf-8')
+
+        result = stream_match(html(text('Title')), html_src, encoding='utf-8', chunk_size=100)
+
+        self.assertTrue(result.passed)
+        self.assertEqual(100, result.bytes_consumed)
+
+    def test_reads_everything_when_not_matched(self):
+        html_src = '<html><h1>Title</h1>{0}</html>'.format('<p>Filler</p>' * 100)
+
+        result = stream_match(html(text('Missing')), html_src, chunk_size=100)
+
+        self.assertTrue(result.failed)
+        self.assertEqual(len(html_src), result.bytes_consumed)
+
+    def test_markup_split_across_chunks(self):
+        html_src = '<html><p class="a b">Fish &amp; chips</p><!-- note --><p>Caf\u00e9</p></html>'
+        for chunk_size in range(1, 8):
+            self.assertTrue(stream_match(html(elem('p', content='Fish & chips', class_='b'), text('Caf\u00e9')),
+                                         html_src.encode('utf-8'), chunk_size=chunk_size).passed)
+
+    def test_encoding_detected_from_start_of_bytes(self):
+        html_src = '<html><meta charset="latin-1"><p>Caf\u00e9</p>{0}</html>'.format(' ' * 100)
+
+        self.assert_match(html_src.encode('latin-1'), text('Caf\u00e9'))
+        self.assert_match(b'\xef\xbb\xbf' + html_src.encode('utf-8'), html(text('Caf\u00e9')))
+
+    def test_encoding_detected_wrongly_from_start_of_bytes(self):
+        html_src = '<html><p>Start</p>{0}<p>Caf\u00e9</p></html>'.format('<p>Filler</p>' * 1000).encode('latin-1')
+
+        self.assertTrue(stream_match(html(text('Caf\u00e9')), html_src, chunk_size=10).passed)
+
+    def test_nested_content_candidates_add_a_thread_per_level(self):
+        depth = 20
+        spec = elem('div', *[text('needle')] * depth, elem('p', content='nomatch'))
+        html_src = '<div>' * (depth + 1) + 'needle' + '</div>' * (depth + 1) + '<p>end</p>'
+
+        matcher = _StreamMatcher(compile_spec(spec))
+        matcher.feed('<div>' * (depth + 1))
+
+        self.assertLessEqual(len(matcher.threads), depth + 1)
+        self.assertEqual(linear_match(spec, html_src).failed_on_def, stream_match(spec, html_src).failed_on_def)
+
+
+class ChunkedInputTests(unittest.TestCase):
+
+    html_src = '<html><h1>Title</h1>{0}<p>Caf\u00e9</p></html>'.format('<p>Filler</p>' * 1000)
+
+    def chunks(self, html_src, chunk_size=100):
+        return (html_src[start:start + chunk_size] for start in range(0, len(html_src), chunk_size))
+
+    def test_match_iterator_of_bytes(self):
+        result = html_match(html(text('Title'), text('Caf\u00e9')), self.chunks(self.html_src.encode('utf-8')))
+
+        self.assertTrue(result.passed)
+        self.assertIsNone(result.html_src)
+
+    def test_match_iterator_of_strings(self):
+        self.assertTrue(html_match(html(text('Caf\u00e9')), self.chunks(self.html_src)).passed)
+
+    def test_match_file(self):
+        html_file = io.BytesIO(self.html_src.encode('utf-8'))
+
+        result = html_match(html(text('Title')), html_file, encoding='utf-8', chunk_size=100)
+
+        self.assertTrue(result.passed)
+        self.assertEqual(100, result.bytes_consumed)
+        self.assertEqual(100, html_file.tell())
+
+    def test_failed_match_keeps_source_for_report(self):
+        html_src = self.html_src.encode('utf-8')
+
+        result = html_match(html(text('Missing')), self.chunks(html_src))
+
+        self.assertTrue(result.failed)
+        self.assertEqual(html_src, result.html_src)
+        self.assertEqual(len(html_src), result.bytes_consumed)
+        self.assertIn('Caf\u00e9', str(result))
+
+    def test_failed_match_keeps_large_source(self):
+        html_src = '<html><p>{0}</p></html>'.format('Filler\r\n' * 200000)
+
+        result = html_match(html(text('Missing')), self.chunks(html_src, 64 * 1024))
+
+        self.assertIsNone(result._html_src)
+        self.assertEqual(html_src, result.html_src)
+        self.assertIsNone(result.html_file)
+
+    def test_encoding_detected_wrongly_from_start_of_chunks(self):
+        html_src = self.html_src.encode('windows-1252')
+
+        self.assertTrue(html_match(html(text('Title'), text('Caf\u00e9')), self.chunks(html_src)).passed)
+        self.assertEqual(html_src, html_match(html(text('Missing')), self.chunks(html_src)).html_src)
+
+    def test_empty_iterator(self):
+        self.assertFalse(html_match(html(), iter([])).passed)
+
+    def test_tree_matchers_read_everything(self):
+        spec = html(text('Title'), text('Caf\u00e9'))
+
+        self.assertTrue(html_match(spec, self.chunks(self.html_src), matcher=linear_match).passed)
+        self.assertTrue(html_match(spec, io.StringIO(self.html_src), matcher='structural').passed)
+        self.assertEqual(1003, len(Document(self.chunks(self.html_src.encode('utf-8')))))
+
+
+class FileMatchingTests(unittest.TestCase):
+
+    html_src = '<html><h1>Title</h1>{0}<p>Fish &amp; chips</p><p>Caf&eacute;</p></html>'.format(
+        '<p>Filler</p>' * 1000)
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write_file(self, html_src, name='page.html'):
+        path = Path(self.directory.name) / name
+        path.write_bytes(html_src)
+        return path
+
+    def test_match_file(self):
+        path = self.write_file(self.html_src.encode('utf-8'))
+
+        result = html_match_file(html(text('Title'), text('Fish & chips'), text('Caf\u00e9')), path)
+
+        self.assertTrue(result.passed)
+        self.assertIsNone(result.html_src)
+
+    def test_stops_reading_once_matched(self):
+        path = self.write_file(self.html_src.encode('utf-8'))
+
+        result = html_match_file(html(text('Title')), path, encoding='utf-8', chunk_size=100)
+
+        self.assertTrue(result.passed)
+        self.assertEqual(100, result.bytes_consumed)
+
+    def test_failed_match_keeps_source_for_report(self):
+        html_src = self.html_src.encode('utf-8')
+        path = self.write_file(html_src)
+
+        result = html_match_file(html(text('Fish & chips'), text('Title')), path)
+
+        self.assertTrue(result.failed)
+        self.assertEqual(path, result.html_path)
+        self.assertIsNone(result._html_src)
+        self.assertIn('Full HTML Source', str(result))
+        self.assertEqual(html_src, result.html_src)
+
+    def test_missing_content_fails_without_parsing(self):
+        path = self.write_file(self.html_src.encode('utf-8'))
+        missing_def = text('Missing')
+
+        result = html_match_file(html(text('Title'), missing_def), path)
+
+        self.assertTrue(result.failed)
+        self.assertEqual([missing_def], result.element_defs_not_found)
+        self.assertEqual(missing_def, result.unmatched_def)
+        self.assertIsNone(result.html_src)
+        self.assertNotIn('Full HTML Source', str(result))
+
+    def test_content_written_with_character_references_not_missing(self):
+        path = self.write_file('<html><p>Caf&#233; &amp; bar</p><p>&#x54;itle</p></html>'.encode('ascii'))
+
+        self.assertTrue(html_match_file(html(text('Caf\u00e9 & bar'), text('Title')), path, encoding='ascii').passed)
+        self.assertTrue(html_match_file(html(text('Title')), path).passed)
+
+    def test_many_needles_written_with_character_references(self):
+        path = self.write_file(self.html_src.replace('Title', '&#x54;itle').encode('ascii'))
+        missing_defs = [text('Missing {0}'.format(number)) for number in range(10)]
+        spec = html(text('Fish & chips'), *missing_defs[:5], text('Title'), text('Caf\u00e9'), *missing_defs[5:])
+
+        self.assertEqual(missing_defs, html_match_file(spec, path, encoding='ascii').element_defs_not_found)
+
+    def test_content_with_newlines_normalized_by_parser_not_missing(self):
+        path = self.write_file(b'<html><p>Fish\r\nchips</p></html>')
+        spec = html(text('Fish\nchips'))
+
+        self.assertEqual(1, len(html_match_file(spec, path).element_defs_not_found))
+        for parser in [parser for parser, module in [('lxml', lxml), ('html5lib', html5lib), ('lxml.html', lxml)]
+                       if module]:
+            self.assertTrue(html_match_file(spec, path, matcher='linear', parser=parser).passed)
+
+    def test_many_needles_found_in_one_pass(self):
+        path = self.write_file(self.html_src.encode('utf-8'))
+        spec = html(text('Title'), *[text('Filler {0}'.format(number)) for number in range(10)])
+
+        result = html_match_file(spec, path)
+
+        self.assertEqual(list(spec.children[1:]), result.element_defs_not_found)
+
+    def test_encoded_content(self):
+        path = self.write_file(self.html_src.replace('&eacute;', '\u00e9').encode('latin-1'))
+
+        self.assertTrue(html_match_file(html(text('Caf\u00e9')), path, encoding='latin-1').passed)
+        self.assertTrue(html_match_file(html(text('Caf\u00e9')), path).passed)
+        self.assertEqual(1, len(html_match_file(html(text('Th\u00e9')), path, encoding='latin-1')
+                                .element_defs_not_found))
+
+    def test_tree_matcher(self):
+        path = self.write_file(self.html_src.encode('utf-8'))
+
+        self.assertTrue(html_match_file(html(text('Title'), text('Caf\u00e9')), path, matcher='linear').passed)
+        self.assertTrue(html_match_file(html(text('Caf\u00e9'), text('Title')), path, matcher='linear').failed)
+
+    def test_empty_file(self):
+        self.assertTrue(html_match_file(html(), self.write_file(b'')).failed)
+
+
+class WindowedReportTests(unittest.TestCase):
+
+    html_src = '<html><body><h1>Title</h1><table id="t">{0}</table></body></html>'.format(
+        ''.join('<tr><td class="c{0}">row {0}</td></tr>'.format(row) for row in range(500)))
+
+    def failed_result(self, **options):
+        spec = html(heading('Title'), elem('td', class_='c400'), elem('td', content='row 100'))
+        return html_match(spec, self.html_src, **options)
+
+    def test_last_match_and_nearest_candidate(self):
+        result = self.failed_result()
+
+        self.assertEqual('row 400', result.last_match.get_text())
+        self.assertEqual('row 100', result.nearest_candidate.get_text())
+
+    def test_nearest_candidate_follows_the_last_match(self):
+        spec = html(heading('Title'), elem('td', class_='c400'), elem('td', content='missing'))
+
+        self.assertEqual('row 401', html_match(spec, self.html_src).nearest_candidate.get_text())
+
+    def test_windows_around_the_last_match_and_nearest_candidate(self):
+        report = self.failed_result().windowed_report(ReportLimits(context_lines=3))
+
+        self.assertTrue(report.startswith('HTML Matching: FAILED\n\n'))
+        self.assertIn('row 100\n', report)
+        self.assertIn('row 400\n', report)
+        self.assertNotIn('row 250\n', report)
+        self.assertIn('lines left out ...\n', report)
+        self.assertLess(len(report), len(str(self.failed_result())) / 10)
+
+    def test_sections_are_cut_off(self):
+        report = self.failed_result().windowed_report(ReportLimits(context_lines=100, max_lines=10))
+
+        self.assertIn('Full HTML Source:\n', report)
+        self.assertIn('... cut off after 10 lines and ', report)
+        self.assertLess(len(report.splitlines()), 60)
+
+    def test_sections_are_cut_off_in_bytes(self):
+        result = html_match(html(text('Missing')), '<html><p>{0}</p></html>'.format('\u00e9' * 1000))
+
+        report = result.windowed_report(ReportLimits(max_bytes=101))
+        source = report.split('Full HTML Source:\n', 1)[1].split('\n... cut off', 1)[0]
+
+        self.assertIn('... cut off after 2 lines and 100 bytes\n', report)
+        self.assertEqual(100, len(source.encode('utf-8')))
+
+    def test_internals_known_for_supported_beautifulsoup_versions(self):
+        # setup.py only allows the versions of BeautifulSoup whose internals the reports are known to follow
+        self.assertTrue(pha.reports._PRETTIFIES_BY_PIECE)
+
+    def test_trees_prettified_by_piece_as_beautifulsoup_prettifies_them(self):
+        root_element = BeautifulSoup('<html><body><h1 class="a b">Fish &amp; chips</h1><!-- note --><br/>'
+                                     '<pre>  kept\n as is </pre><textarea> <b>raw</b></textarea>'
+                                     '<script>if (a < b) {}</script><p>Caf\u00e9 <i>really</i></p></body></html>',
+                                     'html.parser')
+
+        lines = pha.reports._pretty_lines(root_element, [])
+
+        self.assertEqual(root_element.prettify(), ''.join(line for line, _ in lines))
+
+    def test_whole_trees_prettified_without_known_internals(self):
+        result = self.failed_result()
+        with mock.patch('pha.reports._PRETTIFIES_BY_PIECE', False):
+            report = result.windowed_report(ReportLimits(context_lines=3))
+            lines = list(pha.reports._pretty_lines(result.root_element, [result.last_match]))
+
+        self.assertEqual(result.root_element.prettify(), ''.join(line for line, _ in lines))
+        self.assertEqual(0, sum(anchored for _, anchored in lines))
+
+        self.assertIn('Pruned HTML Source:\n<html>\n <body>\n', report)
+        self.assertIn('Full HTML Source:\n<html>\n <body>\n  <h1>\n', report)
+        self.assertNotIn('row 400\n', report)
+
+    def test_write_report(self):
+        result = self.failed_result()
+        writer = io.StringIO()
+
+        result.write_report(writer, ReportLimits(context_lines=3))
+
+        self.assertEqual(result.windowed_report(ReportLimits(context_lines=3)), writer.getvalue())
+
+    def test_window_at_the_start_without_a_tree(self):
+        report = self.failed_result(matcher=stream_match).windowed_report(ReportLimits(context_lines=3))
+
+        self.assertIn('Full HTML Source:\n<html>\n <body>\n  <h1>\n   Title\n...\n', report)
+        self.assertNotIn('Pruned HTML Source', report)
+
+    def test_passed(self):
+        result = html_match(html(heading('Title')), self.html_src)
+
+        self.assertEqual('HTML Matching: PASSED\n\n', result.windowed_report())
+
+    def test_report_limits(self):
+        MatcherResult.report_limits = ReportLimits(context_lines=3)
+        try:
+            report = str(self.failed_result())
+        finally:
+            MatcherResult.report_limits = None
+
+        self.assertNotIn('row 250\n', report)
+        self.assertIn('row 250\n', str(self.failed_result()))
+
+
+class PrettySpecTests(unittest.TestCase):
+
+    def test_pretty_spec(self):
+        spec = html(div(text('Hello'), elem('table', id='t', class_='a b')), heading('My  Doc'))
+
+        self.assertEqual('<html>\n'
+                         ' <div>\n'
+                         '  <*>\n'
+                         '   Hello\n'
+                         '  </*>\n'
+                         '  <table class="a b" id="t">\n'
+                         '  </table>\n'
+                         ' </div>\n'
+                         ' <h1|h2|h3|h4|h5|h6>\n'
+                         '  My  Doc\n'
+                         ' </h1|h2|h3|h4|h5|h6>\n'
+                         '</html>\n', pretty_spec(spec))
+
+    def test_what_is_inside_a_void_element_follows_it(self):
+        spec = div(input('x', 'v', elem('span', content='child')))
+
+        self.assertEqual('<div>\n <input id="x" value="v"/>\n <span>\n  child\n </span>\n</div>\n', pretty_spec(spec))
+
+    def test_markup_in_content_is_parsed(self):
+        spec = div(text('a &amp; b <b>c</b>'))
+
+        self.assertEqual('<div>\n <*>\n  a &amp; b\n  <b>\n   c\n  </b>\n </*>\n</div>\n', pretty_spec(spec))
+
+    def test_write_spec(self):
+        spec = html(div(*[elem('tr', elem('td', content='row {0}'.format(row % 3))) for row in range(100)]))
+        writer = io.StringIO()
+
+        write_spec(spec, writer)
+
+        self.assertEqual(pretty_spec(spec), writer.getvalue())
+        self.assertEqual(4 + 100 * 5, len(writer.getvalue().splitlines()))
+
+    def test_max_depth(self):
+        spec = html(div(elem('p'), elem('p', text('x'))), div())
+
+        self.assertEqual('<html>\n'
+                         ' <div>\n'
+                         '  <!-- 3 more element defs -->\n'
+                         ' </div>\n'
+                         ' <div>\n'
+                         ' </div>\n'
+                         '</html>\n', pretty_spec(spec, max_depth=2))
+
+    def test_max_width(self):
+        spec = html(div(elem('p'), elem('p', text('x'))), div())
+
+        self.assertEqual('<html>\n'
+                         ' <div>\n'
+                         '  <p>\n'
+                         '  </p>\n'
+                         '  <!-- 2 more element defs -->\n'
+                         ' </div>\n'
+                         ' <!-- 1 more element def -->\n'
+                         '</html>\n', pretty_spec(spec, max_width=1))
+
+    def test_bounds_when_the_spec_is_parsed(self):
+        spec = html(div(text('<b>x</b>'), elem('p')), div())
+
+        self.assertEqual('<html>\n'
+                         ' <div>\n'
+                         '  <!-- 2 more element defs -->\n'
+                         ' </div>\n'
+                         ' <!-- 1 more element def -->\n'
+                         '</html>\n', pretty_spec(spec, max_depth=2, max_width=1))
+
+
+class BenchmarkTests(unittest.TestCase):
+
+    def test_generated_documents_repeatable(self):
+        self.assertEqual(generate_document(depth=3, fan_out=3, seed=1), generate_document(depth=3, fan_out=3, seed=1))
+        self.assertNotEqual(generate_document(depth=3, fan_out=3, seed=1),
+                            generate_document(depth=3, fan_out=3, seed=2))
+
+    def test_generated_document_shape(self):
+        root = generate_tree(depth=3, fan_out=2, text_words=5, attributes=4)
+        elements = list(root.descendants())
+
+        self.assertEqual(len(elements), len(Document(render_document(root))))
+        self.assertEqual(6, len(elements[1].attrs))
+        self.assertEqual(6, len(elements[1].text.split()))
+
+    def test_generated_specs_pass_and_fail(self):
+        root = generate_tree(depth=3, fan_out=4)
+        html_src = render_document(root)
+        for nested in (True, False):
+            for content in (True, False):
+                spec = generate_spec(root, definitions=20, nested=nested, content=content)
+                self.assertTrue(html_match(spec, html_src).passed)
+                self.assertEqual(21, len(compile_spec(spec)))
+                spec = generate_spec(root, definitions=20, nested=nested, content=content, passing=False)
+                self.assertTrue(html_match(spec, html_src).failed)
+
+    def test_compare_with_baseline(self):
+        baseline = {'timings': {'case': {'linear_match': 0.1, 'pretty_html': 0.1, 'pretty_spec': 0.0001}}}
+        results = {'timings': {'case': {'linear_match': 0.2, 'pretty_html': 0.11, 'pretty_spec': 0.0002,
+                                        'prune_unmatched_elements': 0.1}}}
+
+        comparisons = dict(((operation, regressed) for _, operation, _, _, _, regressed in compare(results, baseline)))
+
+        self.assertEqual({'linear_match': True, 'pretty_html': False, 'pretty_spec': False}, comparisons)
+
+
+class MatchStatsTests(unittest.TestCase):
+
+    html_src = '<html><div><p>One</p><p>Two</p></div><div><p>Three</p></div></html>'
+
+    def test_no_stats_unless_asked(self):
+        self.assertIsNone(html_match(html(text('One')), self.html_src).stats)
+
+    def test_linear_match_stats(self):
+        stats = html_match(html(div(text('One')), text('Three')), self.html_src, stats=True).stats
+
+        self.assertEqual(['parse', 'compile', 'prune', 'scan'], list(stats.phases))
+        self.assertTrue(all(elapsed >= 0 for elapsed in stats.phases.values()))
+        self.assertAlmostEqual(sum(stats.phases.values()), stats.total_time)
+        # Pruning visits every element, and the scan stops at the last match, the second div
+        self.assertEqual(7 + 4, stats.elements_visited)
+        self.assertEqual(4, stats.matches_calls)
+        self.assertEqual(7, stats.content_tests)
+
+    def test_regex_evaluations_counted_where_evaluated(self):
+        spec = html(div(text('One')), text('Three'), id='regex-evaluations')
+        html_src = self.html_src.replace('<html>', '<html id="regex-evaluations">')
+
+        first_stats = html_match(spec, html_src, stats=True).stats
+        second_stats = html_match(spec, html_src, stats=True).stats
+        stream_stats = html_match(spec, html_src, matcher='stream', stats=True).stats
+
+        # Each of the 4 calls to _matches tests a name, and the first prune also tests the 2 text defs against p (the
+        # divs and the html element are kept for their paragraphs without looking anything up), which the compiled
+        # spec then remembers
+        self.assertEqual(4 + 2, first_stats.regex_evaluations)
+        self.assertEqual(4, second_stats.regex_evaluations)
+        # The stream matcher looks up every tag name, so it tests the text defs against html and div
+        self.assertEqual(2 * 2, stream_stats.regex_evaluations)
+
+    def test_failed_linear_match_stats(self):
+        stats = html_match(html(text('Three'), text('One')), self.html_src, stats=True).stats
+
+        self.assertEqual(['parse', 'compile', 'prune', 'scan', 'diagnose'], list(stats.phases))
+        # The diagnostics find where every def first matches at the html element
+        self.assertEqual(7 + 5 + 1, stats.elements_visited)
+        self.assertEqual(5 + 3, stats.matches_calls)
+
+    def test_stats_for_document_leave_index_as_it_is(self):
+        document = Document(self.html_src)
+
+        self.assertTrue(html_match(html(text('One')), document, stats=True).passed)
+        self.assertNotIn('stats', vars(document.index))
+        self.assertTrue(html_match(html(text('One')), document).passed)
+
+    def test_stats_as_dict(self):
+        stats = html_match(html(text('One')), self.html_src, stats=True).stats.as_dict()
+
+        self.assertEqual(['phases', 'total_time', 'elements_visited', 'matches_calls', 'regex_evaluations',
+                          'content_tests'], list(stats))
+
+    def test_structural_and_stream_match_stats(self):
+        spec = html(div(text('One')), text('Three'))
+
+        structural_stats = html_match(spec, self.html_src, matcher='structural', stats=True).stats
+        stream_stats = html_match(spec, self.html_src, matcher='stream', stats=True).stats
+
+        self.assertEqual(['parse', 'compile', 'label', 'embed'], list(structural_stats.phases))
+        self.assertEqual(['compile', 'match'], list(stream_stats.phases))
+        self.assertEqual(6, stream_stats.elements_visited)
+
+
+class StreamSimpleMatchingTests(SimpleMatchingTests):
+
+    matcher = staticmethod(stream_match)
+
+
+class StreamElementDefHelperTests(ElementDefHelperTests):
+
+    matcher = staticmethod(stream_match)
+
+
+class StreamNestedElementDefTests(NestedElementDefTests):
+
+    matcher = staticmethod(stream_match)
+
+
+class StreamComplexElementDefTests(ComplexElementDefTests):
+
+    matcher = staticmethod(stream_match)
+
+
 if __name__ == '__main__':
     unittest.main()        
+
+
+class DocumentTests(BaseElementDefTests):
+
+    html_src = '<html><div id="main"><p>One</p><p>Two</p></div><span>Three</span></html>'
+
+    def test_match_document_many_times(self):
+        document = Document(self.html_src)
+
+        self.assertTrue(html_match(html(elem('p', content='One'), elem('p', content='Two')), document).passed)
+        self.assertTrue(html_match(html(elem('span', content='Three')), document).passed)
+        self.assertTrue(html_match(html(elem('p', content='Two'), elem('p', content='One')), document).failed)
+        self.assertTrue(html_match(html(elem('div', id='main')), document).passed)
+
+    def test_matching_leaves_document_unchanged(self):
+        document = Document(self.html_src)
+
+        result = html_match(html(elem('p', content='Two'), text('Missing')), document)
+        str(result)
+
+        self.assertEqual(self.html_src, str(document.root_element))
+        self.assertIs(document.root_element, result.root_element)
+        self.assertTrue(html_match(html(elem('span', content='Three')), document).passed)
+
+    def test_result_shows_pruned_html(self):
+        result = html_match(html(elem('p', content='Two'), text('Missing')), Document(self.html_src))
+
+        self.assertNotIn('One', result.pretty_pruned_html())
+        self.assertIn('Two', result.pretty_pruned_html())
+        self.assertIn('One', result.pretty_html_src())
+
+    def test_prune_document(self):
+        document = Document(self.html_src)
+
+        self.assertTrue(prune_unmatched_elements(document, elem('span')))
+        self.assertFalse(prune_unmatched_elements(document, elem('table')))
+        self.assertEqual(self.html_src, str(document.root_element))
+
+    def test_stream_match_document(self):
+        document = Document(self.html_src)
+
+        self.assertTrue(html_match(html(elem('p', content='Two')), document, matcher=stream_match).passed)
+
+    @unittest.skipUnless(lxml, 'lxml is not installed')
+    def test_lxml_html_document(self):
+        document = Document(self.html_src, parser='lxml.html')
+
+        result = html_match(html(elem('p', content='Two'), text('Missing')), document)
+
+        self.assertNotIn('One', result.pretty_pruned_html())
+        self.assertTrue(html_match(html(elem('p', content='One')), document).passed)
+
+
+class BatchMatchingTests(unittest.TestCase):
+
+    spec = html(elem('p', content='One'), elem('p', content='Two'))
+    documents = ['<html><p>One</p><p>Two</p></html>',
+                 '<html><p>Two</p><p>One</p></html>',
+                 '<html><p>One</p></html>',
+                 '<html><div><p>One</p></div><p>Two</p></html>']
+
+    def assert_results(self, results):
+        self.assertEqual([True, False, False, True], [result.passed for result in results])
+        self.assertEqual([], results[1].element_defs_not_found)
+        self.assertEqual([self.spec.children[1]], results[2].element_defs_not_found)
+        self.assertIs(self.spec.children[1], results[1].unmatched_def)
+        self.assertEqual(self.documents[2], results[2].html_src)
+        self.assertIn('Full HTML Source', str(results[2]))
+
+    def test_match_many_in_process(self):
+        self.assert_results(html_match_many(self.spec, self.documents, workers=1, chunk_size=3).results())
+
+    def test_match_many_in_workers(self):
+        self.assert_results(html_match_many(self.spec, self.documents, workers=2, chunk_size=1).results())
+
+    def test_match_many_as_completed(self):
+        batch = html_match_many(self.spec, iter(self.documents), workers=2, chunk_size=1, ordered=False)
+
+        matched = list(batch)
+
+        self.assertEqual([0, 1, 2, 3], sorted(document.index for document in matched))
+        self.assertEqual(4, batch.matched)
+        self.assertEqual((2, 2), (batch.passed, batch.failed))
+        self.assertIn('Matched 4 documents', str(batch))
+
+    def test_match_many_paths(self):
+        with tempfile.TemporaryDirectory() as directory:
+            paths = []
+            for index, html_src in enumerate(self.documents):
+                path = Path(directory, '{0}.html'.format(index))
+                path.write_text(html_src)
+                paths.append(path)
+
+            results = html_match_many(self.spec, paths, workers=1, encoding='utf-8').results()
+
+            self.assertEqual([True, False, False, True], [result.passed for result in results])
+            self.assertEqual(self.documents[2].encode('utf-8'), results[2].html_src)
+            self.assertIsNone(results[0].html_src)
+
+    def test_match_many_with_stream_matcher(self):
+        self.assert_results(html_match_many(self.spec, self.documents, workers=1, matcher=stream_match).results())
+
+    def test_match_many_documents(self):
+        results = html_match_many(self.spec, [Document(html_src) for html_src in self.documents], workers=1).results()
+
+        self.assertEqual([True, False, False, True], [result.passed for result in results])
+        self.assertEqual(self.documents[2], results[2].html_src)
+        self.assertIn('Full HTML Source', str(results[2]))
+
+    def test_compiled_spec_pickles(self):
+        compiled_spec = compile_spec(self.spec)
+
+        self.assertIs(compiled_spec, pickle.loads(pickle.dumps(compiled_spec)))
+
+
+class AsyncMatchingTests(unittest.TestCase):
+
+    spec = BatchMatchingTests.spec
+    documents = BatchMatchingTests.documents
+
+    def run_async(self, coroutine):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            loop.close()
+
+    def match_all(self, **options):
+        async def match_all():
+            return await asyncio.gather(*[html_match_async(self.spec, html_src, **options)
+                                          for html_src in self.documents])
+        return self.run_async(match_all())
+
+    def test_match_in_threads(self):
+        results = self.match_all()
+
+        self.assertEqual([True, False, False, True], [result.passed for result in results])
+        self.assertIn('Pruned HTML Source', str(results[2]))
+
+    def test_match_in_processes(self):
+        with ProcessPoolExecutor(2) as executor:
+            results = self.match_all(executor=executor)
+
+        BatchMatchingTests.assert_results(self, results)
+
+    def test_concurrency_limit(self):
+        running = []
+        most_running = []
+        lock = threading.Lock()
+
+        def slow_match(spec, html_src, **options):
+            with lock:
+                running.append(html_src)
+                most_running.append(len(running))
+            time.sleep(0.02)
+            with lock:
+                running.remove(html_src)
+            return linear_match(spec, html_src, **options)
+
+        with ThreadPoolExecutor(4) as executor:
+            results = self.match_all(matcher=slow_match, executor=executor, max_concurrent=2)
+
+        self.assertEqual([True, False, False, True], [result.passed for result in results])
+        self.assertEqual(2, max(most_running))
+
+    def test_async_chunks_are_matched_as_they_arrive(self):
+        fetched = []
+
+        async def chunks():
+            for chunk in [b'<html><p>One</p>', b'<p>Two</p>', b'<p>Three</p>'] + [b'<p>More</p>'] * 100:
+                fetched.append(chunk)
+                await asyncio.sleep(0)
+                yield chunk
+
+        result = self.run_async(html_match_async(self.spec, chunks(), encoding='utf-8'))
+
+        self.assertTrue(result.passed)
+        self.assertLess(len(fetched), 10)
+
+    def test_async_chunks_closed_when_matched_early(self):
+        closed = []
+
+        async def chunks():
+            try:
+                for chunk in [b'<html><p>One</p><p>Two</p><p>Three</p>'] + [b'<p>More</p>'] * 100:
+                    yield chunk
+            finally:
+                closed.append(True)
+
+        self.assertTrue(self.run_async(html_match_async(self.spec, chunks(), encoding='utf-8')).passed)
+        self.assertEqual([True], closed)
+
+    def test_match_document_in_processes(self):
+        with ProcessPoolExecutor(1) as executor:
+            result = self.run_async(html_match_async(self.spec, Document(self.documents[2]), executor=executor))
+
+        self.assertTrue(result.failed)
+        self.assertEqual(self.documents[2], result.html_src)
+        self.assertIn('Full HTML Source', str(result))
+
+    def test_async_chunks_in_processes(self):
+        async def chunks():
+            for chunk in ['<html><p>Two</p>', '<p>One</p></html>']:
+                yield chunk
+
+        with ProcessPoolExecutor(1) as executor:
+            result = self.run_async(html_match_async(self.spec, chunks(), executor=executor))
+
+        self.assertTrue(result.failed)
+        self.assertEqual('<html><p>Two</p><p>One</p></html>', result.html_src)
+
+
+class PytestPluginTests(unittest.TestCase):
+
+    test_module = '''
+from pha import elem, html, linear_match, stream_match
+
+PAGE = '<html><body><h1>Title</h1><p class="intro">Hello</p></body></html>'
+
+
+def test_passes(assert_html_match, html_match_cache):
+    assert assert_html_match(html(elem('h1', content='Title')), PAGE).passed
+    assert assert_html_match(html(elem('p', class_='intro')), PAGE).passed
+    assert len(html_match_cache.documents) == 1
+    assert len(html_match_cache.compiled_specs) == 2
+
+
+def test_stream(assert_html_match, html_match_cache):
+    assert assert_html_match(html(elem('h1')), PAGE, matcher=stream_match).passed
+
+
+def test_fails(assert_html_match):
+    assert_html_match(html(elem('p', content='Goodbye')), PAGE)
+
+
+def test_own_stats(assert_html_match):
+    assert assert_html_match(html(elem('h1')), PAGE, stats=False).stats is None
+
+
+def test_matcher_without_stats(assert_html_match):
+    def without_stats(spec, html_src):
+        return linear_match(spec, html_src)
+
+    assert assert_html_match(html(elem('h1')), PAGE, matcher=without_stats).passed
+
+
+def test_without_assertions():
+    pass
+'''
+
+    def run_pytest(self, *args):
+        with tempfile.TemporaryDirectory() as directory:
+            Path(directory, 'test_pages.py').write_text(self.test_module)
+            python_path = [os.path.dirname(os.path.dirname(os.path.abspath(__file__))), os.environ.get('PYTHONPATH')]
+            environment = dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in python_path if path))
+            completed = subprocess.run([sys.executable, '-m', 'pytest', '-p', 'no:pha', '-p', 'pha.pytest_plugin',
+                                        '-p', 'no:cacheprovider', '--rootdir', directory, directory] + list(args),
+                                       stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=environment)
+        return completed.stdout.decode('utf-8')
+
+    def test_plugin(self):
+        output = self.run_pytest()
+
+        self.assertIn('1 failed, 5 passed', output)
+        self.assertIn('HTML Matching: FAILED', output)
+        self.assertIn('slowest 5 html assertions', output)
+        self.assertIn('test_pages.py::test_fails', output)
+        self.assertNotIn('test_pages.py::test_without_assertions', output)
+
+    @unittest.skipUnless(xdist, 'pytest-xdist is not installed')
+    def test_timings_collected_from_xdist_workers(self):
+        output = self.run_pytest('-n', '2')
+
+        self.assertIn('1 failed, 5 passed', output)
+        self.assertIn('slowest 5 html assertions', output)
+        self.assertIn('test_pages.py::test_fails', output)
+        self.assertNotIn('test_pages.py::test_without_assertions', output)
+
+    def test_no_slowest(self):
+        self.assertNotIn('slowest', self.run_pytest('--pha-slowest', '0'))
+
+    def test_html_match_cache(self):
+        cache = HtmlMatchCache(max_documents=2)
+
+        first = cache.document('<p>One</p>')
+        cache.document('<p>Two</p>')
+        self.assertIs(first, cache.document('<p>One</p>'))
+        cache.document('<p>Three</p>')
+
+        self.assertEqual(['<p>One</p>', '<p>Three</p>'], [html_src for html_src, _, _ in cache.documents])
+
+    def test_max_compiled_specs_ini_option(self):
+        self.addCleanup(set_max_compiled_specs, RECENTLY_COMPILED_MAX)
+        config = mock.Mock()
+        config.getini.return_value = '300'
+
+        pytest_configure(config)
+
+        config.getini.assert_called_once_with('pha_max_compiled_specs')
+        self.assertEqual(300, pha.compiler.RECENTLY_COMPILED_MAX)
+
+    def test_html_match_cache_keeps_compiled_specs(self):
+        cache = HtmlMatchCache()
+
+        with mock.patch('pha.compiler.RECENTLY_COMPILED_MAX', 1):
+            compiled_refs = [weakref.ref(cache.compiled_spec(html(text('Page {0}'.format(number)))))
+                             for number in range(3)]
+            gc.collect()
+            recompiled = [compile_spec(html(text('Page {0}'.format(number)))) for number in range(3)]
+
+        self.assertEqual([compiled_ref() for compiled_ref in compiled_refs], recompiled)
+        self.assertTrue(all(compiled_ref() is compiled for compiled_ref, compiled in zip(compiled_refs, recompiled)))
+        self.assertEqual(3, len(cache.compiled_specs))
+
+    def test_timings_table(self):
+        lines = timings_table({'fast': {'parse': 0.001, 'prune': 0.0, 'match': 0.001, 'report': 0.0},
+                               'slow': {'parse': 0.5, 'prune': 0.25, 'match': 0.125, 'report': 1.0}}, 1)
+
+        self.assertEqual(2, len(lines))
+        self.assertEqual(['parse', 'prune', 'match', 'report', 'total', 'test'], lines[0].split())
+        self.assertEqual(['0.500s', '0.250s', '0.125s', '1.000s', '1.875s', 'slow'], lines[1].split())
+
+
+class ResultCacheTests(unittest.TestCase):
+
+    spec = BatchMatchingTests.spec
+    documents = BatchMatchingTests.documents
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'results.sqlite')
+        self.cache = ResultCache(self.path)
+
+    def tearDown(self):
+        self.cache._connect().close()
+        self.directory.cleanup()
+
+    def test_cached_results(self):
+        results = [html_match(self.spec, html_src, cache=self.cache) for html_src in self.documents]
+        cached = [html_match(html(elem('p', content='One'), elem('p', content='Two')), html_src, cache=self.cache)
+                  for html_src in self.documents]
+
+        self.assertEqual([result.passed for result in results], [result.passed for result in cached])
+        self.assertIsNotNone(results[0].root_element)
+        self.assertEqual([None] * 4, [result.root_element for result in cached])
+        self.assertEqual(4, len(self.cache))
+        BatchMatchingTests.assert_results(self, cached)
+
+    def test_results_are_kept_across_runs(self):
+        html_match(self.spec, self.documents[2], cache=self.cache)
+
+        result = html_match(self.spec, self.documents[2], cache=ResultCache(self.path))
+
+        self.assertIsNone(result.root_element)
+        self.assertEqual([self.spec.children[1]], result.element_defs_not_found)
+
+    def test_keys(self):
+        key = self.cache.key(self.spec, self.documents[0])
+
+        self.assertEqual(key, self.cache.key(html(elem('p', content='One'), elem('p', content='Two')),
+                                             self.documents[0]))
+        self.assertEqual(key, self.cache.key(compile_spec(self.spec), self.documents[0]))
+        self.assertNotEqual(key, self.cache.key(html(elem('p', content='One')), self.documents[0]))
+        self.assertNotEqual(key, self.cache.key(self.spec, self.documents[0].encode('utf-8')))
+        self.assertNotEqual(key, self.cache.key(self.spec, self.documents[0], 'structural'))
+        self.assertNotEqual(key, self.cache.key(self.spec, self.documents[0], options={'parser': 'lxml'}))
+        self.assertIsNone(self.cache.key(self.spec, self.documents[0], options={'stats': True}))
+        self.assertIsNone(self.cache.key(self.spec, iter([self.documents[0]])))
+        self.assertIsNotNone(self.cache.key(self.spec, self.documents[0], structural_match))
+        self.assertIsNone(self.cache.key(self.spec, self.documents[0], lambda spec, html_src: None))
+
+    def test_hits_only_marked_as_used_once_in_a_while(self):
+        html_match(self.spec, self.documents[0], cache=self.cache)
+        used = self.cache._connect().execute('SELECT used FROM results').fetchone()[0]
+        time.sleep(0.01)
+
+        self.assertTrue(html_match(self.spec, self.documents[0], cache=self.cache).passed)
+        self.assertEqual(used, self.cache._connect().execute('SELECT used FROM results').fetchone()[0])
+
+    def test_least_recently_used_are_evicted(self):
+        self.cache.used_resolution = 0
+        for html_src in self.documents[:3]:
+            html_match(self.spec, html_src, cache=self.cache)
+            time.sleep(0.01)
+        html_match(self.spec, self.documents[0], cache=self.cache)
+        time.sleep(0.01)
+        self.cache.max_bytes = 3 * max(size for size, in self.cache._connect().execute('SELECT size FROM results'))
+
+        html_match(self.spec, self.documents[3], cache=self.cache)
+
+        self.assertEqual(3, len(self.cache))
+        self.assertIsNone(self.cache.get(self.cache.key(self.spec, self.documents[1]), self.spec, self.documents[1]))
+        self.assertIsNotNone(self.cache.get(self.cache.key(self.spec, self.documents[0]), self.spec, self.documents[0]))
+
+    def test_pytest_plugin(self):
+        output = PytestPluginTests().run_pytest('--pha-result-cache', self.path)
+        self.assertIn('1 failed, 5 passed', output)
+        # The local matcher of test_matcher_without_stats can't be told apart from others, so it isn't cached
+        self.assertEqual(5, len(self.cache))
+
+        # The results come from the cache the second time, so test_passes finds that no documents were parsed
+        output = PytestPluginTests().run_pytest('--pha-result-cache', self.path)
+        self.assertIn('2 failed, 4 passed', output)
+        self.assertIn('assert 0 == 1', output)
+        self.assertIn('HTML Matching: FAILED', output)
+
+
+class ParserTests(BaseElementDefTests):
+
+    html_src = '<html><body><div class="main"><p>Caf\u00e9</p><script>var p;</script></div></body></html>'
+    spec = html(elem('div', elem('p', content='Caf\u00e9'), class_='main'))
+
+    def assert_parser_matches(self, parser):
+        self.assertTrue(html_match(self.spec, self.html_src, parser=parser).passed)
+        html_bytes = self.html_src.encode('latin-1')
+        self.assertTrue(html_match(self.spec, html_bytes, parser=parser, encoding='latin-1').passed)
+        self.assertTrue(html_match(html(elem('p', content='var p')), self.html_src, parser=parser).failed)
+
+    def test_html_parser(self):
+        self.assert_parser_matches('html.parser')
+        self.assertTrue(html_match(html(elem('script', content='var p')), self.html_src, parser='html.parser').passed)
+
+    @unittest.skipUnless(lxml, 'lxml is not installed')
+    def test_lxml(self):
+        self.assert_parser_matches('lxml')
+
+    @unittest.skipUnless(html5lib, 'html5lib is not installed')
+    def test_html5lib(self):
+        self.assert_parser_matches('html5lib')
+
+    @unittest.skipUnless(lxml, 'lxml is not installed')
+    def test_lxml_html(self):
+        self.assert_parser_matches('lxml.html')
+        self.assertTrue(html_match(html(elem('script', content='var p')), self.html_src, parser='lxml.html').passed)
+
+    @unittest.skipUnless(lxml, 'lxml is not installed')
+    def test_lxml_html_result(self):
+        result = html_match(html(elem('p', content='One'), elem('b', content='Missing')),
+                            '<html><p>One</p><!-- Note --><b>Two</b></html>', parser='lxml.html')
+
+        self.assertTrue(result.failed)
+        self.assertIn('<b>Two</b>', result.pretty_html_src())
+        self.assertNotIn('<b>', result.pretty_pruned_html())
+        self.assertIn('<!-- Note -->', result.pretty_pruned_html())
+        self.assertEqual(['html', 'body', 'p'], [element.name for element in result.kept_elements])
+
+    @unittest.skipUnless(lxml, 'lxml is not installed')
+    def test_lxml_html_empty_document(self):
+        self.assertTrue(html_match(html(), '', parser='lxml.html').failed)
+
+    def test_stream_matcher_encoding(self):
+        self.assertTrue(stream_match(self.spec, self.html_src.encode('latin-1'), encoding='latin-1').passed)
+
+    def test_unknown_parser(self):
+        self.assertRaises(ValueError, html_match, self.spec, self.html_src, parser='xml')
+        self.assertRaises(ValueError, stream_match, self.spec, self.html_src, parser='lxml')
+
+
+@unittest.skipUnless(lxml, 'lxml is not installed')
+class LxmlHtmlSimpleMatchingTests(SimpleMatchingTests):
+
+    options = {'parser': 'lxml.html'}
+
+
+@unittest.skipUnless(lxml, 'lxml is not installed')
+class LxmlHtmlElementDefHelperTests(ElementDefHelperTests):
+
+    options = {'parser': 'lxml.html'}
+
+
+@unittest.skipUnless(lxml, 'lxml is not installed')
+class LxmlHtmlNestedElementDefTests(NestedElementDefTests):
+
+    options = {'parser': 'lxml.html'}
+
+
+@unittest.skipUnless(lxml, 'lxml is not installed')
+class LxmlHtmlComplexElementDefTests(ComplexElementDefTests):
+
+    options = {'parser': 'lxml.html'}
+
+
+@unittest.skipUnless(lxml, 'lxml is not installed')
+class XPathMatchingTests(BaseElementDefTests):
+
+    matcher = staticmethod(xpath_match)
+    options = {'cross_check': True}
+
+    def test_pruned_content(self):
+        # As with the linear matcher, content belonging to an element which is pruned doesn't count for its ancestors
+        self.assert_not_match('<html><div><span>One</span></div></html>', html(elem('div', content='One')))
+        self.assert_match('<html><div><span>One</span></div></html>',
+                          html(elem('div', content='One'), elem('span')))
+
+    def test_content_follows_string_types(self):
+        self.assert_not_match('<html><div><script>var one;</script></div></html>', html(div(content='var')))
+        self.assert_match('<html><div><script>var one;</script></div></html>', html(elem('script', content='var')))
+        self.assert_match('<html><div><!-- One -->Two</div></html>', html(div(content='Two')))
+        self.assert_not_match('<html><div><!-- One -->Two</div></html>', html(div(content='One')))
+
+    def test_class_matches_tokens(self):
+        self.assert_match('<html><div class="box wide">One</div></html>', html(div(class_='box')))
+        self.assert_not_match('<html><div class="boxed">One</div></html>', html(div(class_='box')))
+        self.assert_match('<html><div id="boxed">One</div></html>', html(div(id='box')))
+
+    def test_name_regexes(self):
+        self.assert_match('<html><h2>One</h2><p>Two</p></html>', html(heading('One'), text('Two')))
+        self.assert_not_match('<html><p>Two</p><h2>One</h2></html>', html(heading('One'), text('Two')))
+
+    def test_failure_reported_by_linear_matcher(self):
+        spec = html(elem('p', content='One'), elem('p', content='Three'))
+        html_src = '<html><p>One</p><p>Two</p></html>'
+
+        result = xpath_match(spec, html_src, stats=True)
+        linear_result = linear_match(spec, html_src, parser='lxml.html')
+
+        self.assertTrue(result.failed)
+        self.assertEqual(linear_result.element_defs_not_found, result.element_defs_not_found)
+        self.assertIs(linear_result.failed_on_def, result.failed_on_def)
+        self.assertIn('diagnose', result.stats.phases)
+
+    def test_failure_diagnosed_on_parsed_tree(self):
+        spec = html(elem('p', content='One'), elem('p', content='Three'))
+
+        with mock.patch('pha.document.parse_html', side_effect=AssertionError('parsed again')):
+            result = xpath_match(spec, '<html><p>One</p><p>Two</p></html>', cross_check=True)
+
+        self.assertTrue(result.failed)
+        self.assertIn('Pruned HTML Source', str(result))
+
+    def test_expressions_shared_by_groups_with_the_same_shape(self):
+        xpath_match(html(div(id='box', content='One')), '<html><div id="box">One</div></html>')
+        expressions = len(_XPATHS)
+
+        for number in range(10):
+            xpath_match(html(div(id=str(number), content=str(number))), '<html><div id="box">One</div></html>')
+
+        self.assertEqual(expressions, len(_XPATHS))
+
+    def test_document(self):
+        document = Document('<html><p>One</p></html>', parser='lxml.html')
+
+        self.assertTrue(xpath_match(html(text('One')), document, cross_check=True).passed)
+        self.assertTrue(xpath_match(html(text('One')), Document('<html><p>One</p></html>')).passed)
+
+    def test_other_parsers_rejected(self):
+        self.assertRaises(ValueError, xpath_match, html(), '<html></html>', parser='html.parser')
+
+    def test_matcher_by_name(self):
+        self.assertTrue(html_match(html(text('One')), '<html><p>One</p></html>', matcher='xpath').passed)
+
+
+@unittest.skipUnless(lxml, 'lxml is not installed')
+class XPathSimpleMatchingTests(SimpleMatchingTests):
+
+    matcher = staticmethod(xpath_match)
+    options = {'cross_check': True}
+
+
+@unittest.skipUnless(lxml, 'lxml is not installed')
+class XPathElementDefHelperTests(ElementDefHelperTests):
+
+    matcher = staticmethod(xpath_match)
+    options = {'cross_check': True}
+
+
+@unittest.skipUnless(lxml, 'lxml is not installed')
+class XPathNestedElementDefTests(NestedElementDefTests):
+
+    matcher = staticmethod(xpath_match)
+    options = {'cross_check': True}
+
+
+@unittest.skipUnless(lxml, 'lxml is not installed')
+class XPathComplexElementDefTests(ComplexElementDefTests):
+
+    matcher = staticmethod(xpath_match)
+    options = {'cross_check': True}
+
+
+class StructuralMatchingTests(BaseElementDefTests):
+
+    matcher = staticmethod(structural_match)
+
+    def test_children_must_be_descendants(self):
+        spec = html(elem('ul', elem('li', content='One'), elem('li', content='Two')))
+
+        self.assert_match('<html><ul><li>One</li><li>Two</li></ul></html>', spec)
+        self.assert_match('<html><ul><div><li>One</li></div><li>Two</li></ul></html>', spec)
+        self.assert_not_match('<html><ul><li>One</li></ul><ul><li>Two</li></ul></html>', spec)
+
+    def test_siblings_must_be_in_order(self):
+        spec = html(elem('ul', elem('li', content='One'), elem('li', content='Two')))
+
+        self.assert_not_match('<html><ul><li>Two</li><li>One</li></ul></html>', spec)
+
+    def test_siblings_must_not_be_nested(self):
+        spec = html(elem('div', elem('div', content='One'), elem('div', content='Two')))
+
+        self.assert_not_match('<html><div><div>One<div>Two</div></div></div></html>', spec)
+        self.assert_match('<html><div><div>One</div><div><div>Two</div></div></div></html>', spec)
+
+    def test_siblings_may_share_an_ancestor(self):
+        spec = html(elem('tr', elem('td', content='One'), elem('td', content='Two')))
+
+        self.assert_match('<html><table><tr><td>One</td><td>Two</td></tr></table></html>', spec)
+
+    def test_repetitive_markup(self):
+        rows = ['<tr><td>Row</td><td>Cell</td></tr>' for _ in range(200)]
+        spec = html(elem('table', *[elem('tr', elem('td', content='Row'), elem('td', content='Cell'))
+                                    for _ in range(200)]))
+
+        self.assert_match('<html><table>{0}</table></html>'.format(''.join(rows)), spec)
+        self.assert_not_match('<html><table>{0}</table></html>'.format(''.join(rows[:-1])), spec)
+
+    def test_result_reports_failed_def(self):
+        missing_def = elem('li', content='Two')
+        inner_def = elem('li', content='One')
+        spec = html(elem('ul', inner_def, missing_def))
+
+        result = html_match(spec, '<html><ul><li>Two</li><li>One</li></ul><p>Other</p></html>', matcher='structural')
+
+        self.assertTrue(result.failed)
+        self.assertEqual([], result.element_defs_not_found)
+        self.assertIs(spec.children[0], result.failed_on_def)
+        self.assertIn(missing_def, result.first_matches)
+
+    def test_matcher_by_name(self):
+        self.assertTrue(html_match(html(text('One')), '<html><p>One</p></html>', matcher='structural').passed)
+        self.assertTrue(html_match(html(text('One')), '<html><p>One</p></html>', matcher='stream').passed)
+        self.assertRaises(ValueError, html_match, html(), '<html></html>', matcher='recursive')
+
+
+class StructuralSimpleMatchingTests(SimpleMatchingTests):
+
+    matcher = staticmethod(structural_match)
+
+
+class StructuralElementDefHelperTests(ElementDefHelperTests):
+
+    matcher = staticmethod(structural_match)
+
+
+class StructuralNestedElementDefTests(NestedElementDefTests):
+
+    matcher = staticmethod(structural_match)
+
+
+class StructuralComplexElementDefTests(ComplexElementDefTests):
+
+    matcher = staticmethod(structural_match)
+
+
+class AttributeIndexedMatchingTests(object):
+    """ Runs the tests with definitions always finding their candidates through the document's attribute index. """
+
+    def setUp(self):
+        self.min_work = pha.matchers._ATTRIBUTE_INDEX_MIN_WORK
+        pha.matchers._ATTRIBUTE_INDEX_MIN_WORK = 0
+
+    def tearDown(self):
+        pha.matchers._ATTRIBUTE_INDEX_MIN_WORK = self.min_work
+
+
+class AttributeIndexedElementDefHelperTests(AttributeIndexedMatchingTests, ElementDefHelperTests):
+    pass
+
+
+class AttributeIndexedComplexElementDefTests(AttributeIndexedMatchingTests, ComplexElementDefTests):
+    pass
+
+
+class AttributeIndexedStructuralComplexElementDefTests(AttributeIndexedMatchingTests, StructuralComplexElementDefTests):
+    pass
+
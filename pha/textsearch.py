@@ -0,0 +1,126 @@
+import re
+from bisect import bisect_right
+
+
+# Joins text nodes when searching them all in one go, so no needle can match across two of them
+_SEPARATOR = '\x00'
+
+# Below this many needles it is quicker to look for each needle in turn than to run the combined pattern
+_MIN_PATTERN_NEEDLES = 8
+
+
+class NeedleSearch(object):
+    """
+    Finds which of many needles occur in a text in a single pass, however many needles there are.
+
+    The needles are compiled into a trie, and the trie into one regex, so the search runs in the regex engine rather
+    than testing each needle in turn (a handful of needles are still just tested in turn, which is quicker). At each
+    position the regex finds the longest needle starting there, and any
+    needle which is a prefix of that one must occur there too, so every occurrence of every needle is accounted for.
+    """
+
+    def __init__(self, needles):
+        self.needles = tuple(sorted(set(needle for needle in needles if needle)))
+        # Needles given as bytes are looked for in bytes, or in anything else holding bytes such as a memory map, with
+        # each byte standing for the character with the same code in the trie
+        self.encoded = bool(self.needles) and isinstance(self.needles[0], bytes)
+        needle_chars = [needle.decode('latin-1') if self.encoded else needle for needle in self.needles]
+        trie = _build_trie(needle_chars)
+        self.prefixes = dict((needle, _needle_prefixes(trie, chars, needle))
+                             for needle, chars in zip(self.needles, needle_chars))
+        self.pattern = None
+        if len(self.needles) >= _MIN_PATTERN_NEEDLES and not any(_SEPARATOR in chars for chars in needle_chars):
+            try:
+                regex = '(?=({0}))'.format(_trie_regex(trie))
+                self.pattern = re.compile(regex.encode('latin-1') if self.encoded else regex)
+            except (RecursionError, re.error):
+                # Pathological needles, nested too deeply for the regex engine, are tested in turn instead
+                self.pattern = None
+
+    def __len__(self):
+        return len(self.needles)
+
+    def needles_in(self, text):
+        """ The set of needles which occur somewhere in the text. """
+
+        if self.pattern is None:
+            if self.encoded:
+                # A memory map only finds single bytes with in
+                return set(needle for needle in self.needles if text.find(needle) != -1)
+            return set(needle for needle in self.needles if needle in text)
+        found = set()
+        for match in self.pattern.finditer(text):
+            found.update(self.prefixes[match.group(1)])
+            if len(found) == len(self.needles):
+                break
+        return found
+
+    def search(self, texts):
+        """ Maps each needle to the positions of the texts which contain it, in order. """
+
+        if self.pattern is None:
+            return dict((needle, [position for position, text in enumerate(texts) if needle in text])
+                        for needle in self.needles)
+
+        starts = []
+        offset = 0
+        for text in texts:
+            starts.append(offset)
+            offset += len(text) + len(_SEPARATOR)
+
+        hits = dict((needle, []) for needle in self.needles)
+        for match in self.pattern.finditer(_SEPARATOR.join(texts)):
+            position = bisect_right(starts, match.start()) - 1
+            for needle in self.prefixes[match.group(1)]:
+                needle_hits = hits[needle]
+                if not needle_hits or needle_hits[-1] != position:
+                    needle_hits.append(position)
+        return hits
+
+
+def _build_trie(needles):
+    trie = {}
+    for needle in needles:
+        node = trie
+        for char in needle:
+            node = node.setdefault(char, {})
+        node[None] = True
+    return trie
+
+
+def _needle_prefixes(trie, chars, needle):
+    """ The needles which are prefixes of the given needle (whose characters are in the trie), including itself. """
+
+    prefixes = []
+    node = trie
+    for length, char in enumerate(chars, 1):
+        node = node[char]
+        if None in node:
+            prefixes.append(needle[:length])
+    return tuple(prefixes)
+
+
+def _trie_regex(node):
+    """ A regex matching the longest path through the trie, each branch being tried greedily. """
+
+    branches = [_trie_branch_regex(char, child) for char, child in sorted(node.items(), key=_trie_sort_key)
+                if char is not None]
+    if not branches:
+        return ''
+    regex = branches[0] if len(branches) == 1 else '(?:{0})'.format('|'.join(branches))
+    if None in node:
+        regex = '(?:{0})?'.format(regex)
+    return regex
+
+
+def _trie_branch_regex(char, node):
+    # Runs of characters without any choice are written out in a loop, so only branches and ends need recursion
+    chars = [char]
+    while len(node) == 1 and None not in node:
+        (char, node), = node.items()
+        chars.append(char)
+    return re.escape(''.join(chars)) + _trie_regex(node)
+
+
+def _trie_sort_key(item):
+    return item[0] or ''
@@ -0,0 +1,270 @@
+import re
+from bisect import bisect_right
+from collections import OrderedDict
+
+from bs4.element import NavigableString
+
+from .compiler import _LITERAL_NAME_REGEX, compile_spec
+from .document import Document
+from .matchers import MatcherResult, _attributes_match, linear_match
+from .parsers import (
+    LXML_HTML,
+    _MAIN_STRING_TYPES,
+    _PRESERVE_WHITESPACE_ELEMENTS,
+    _STRING_CONTAINERS,
+    LxmlElement,
+    _collapse_whitespace,
+    _element_attrs,
+    lxml,
+    parse_html,
+    read_html
+)
+from .stats import MatchStats, phase
+
+
+_REGEX_NAMESPACES = {'re': 'http://exslt.org/regular-expressions'}
+
+# Tag and attribute names which can be written as they are in XPath (one with a colon would need a namespace)
+_XPATH_NAME = re.compile(r'^[A-Za-z_][\w.-]*$')
+
+_TEXTS = lxml.etree.XPath('.//text()') if lxml else None
+_TEXTS_CONTAINING = lxml.etree.XPath('.//text()[contains(., $needle)]') if lxml else None
+
+# The compiled XPath expressions, by expression. The values a group of definitions looks for are passed as variables,
+# so every group with the same shape shares an expression, and the most recently used are kept.
+_XPATHS = OrderedDict()
+_XPATHS_MAX = 256
+
+
+def xpath_match(spec, html_src, parser=None, encoding=None, cross_check=False, stats=False):
+    """
+    Matches the html against the spec as the linear matcher does, finding the elements each def matches with XPath.
+
+    Each def is translated to an XPath expression testing the element name (local-name() against the name regex), the
+    attributes (contains(@attr, ...)) and the content (contains() on the text nodes inside the element), which lxml
+    evaluates over an lxml.html tree in C. XPath can't tell every string type apart as BeautifulSoup does, so the few
+    elements it selects are then checked exactly, and the defs are matched in order against them with the same pruning
+    rules as the linear matcher. When the match fails, the result (with its diagnostics) comes from the linear matcher
+    on the same tree.
+
+    The html is always parsed with lxml.html, so on broken html the verdict is the linear matcher's with that parser.
+    With cross_check set the linear matcher is run too, and an AssertionError raised if the verdicts differ. With stats
+    set, the result has a MatchStats timing the parse, compile, select and scan phases (and diagnose on failure).
+    """
+
+    if parser not in (None, LXML_HTML):
+        raise ValueError('The xpath matcher only works with the {0} parser'.format(LXML_HTML))
+
+    stats = MatchStats() if stats else None
+    with phase(stats, 'parse'):
+        document = html_src if isinstance(html_src, Document) and html_src.parser == LXML_HTML else None
+        if document is not None:
+            html_src, root_element = document.html_src, document.root_element
+        else:
+            if isinstance(html_src, Document):
+                html_src, encoding = html_src.html_src, html_src.encoding
+            html_src = read_html(html_src)
+            root_element = parse_html(html_src, LXML_HTML, encoding)
+    with phase(stats, 'compile'):
+        compiled_spec = compile_spec(spec)
+        groups = _definition_groups(compiled_spec.definitions)
+
+    tree = _XPathTree(root_element)
+    with phase(stats, 'select'):
+        selected = {}
+        for definitions, xpath in groups:
+            selected.update(tree.select(definitions, xpath))
+        tree.keep(selected.values())
+
+    with phase(stats, 'scan'):
+        passed = _matches_in_order(tree, compiled_spec.definitions, selected)
+
+    if document is None and (cross_check or not passed):
+        # The linear matcher works from the tree already parsed, rather than parsing the html again
+        document = Document(html_src, LXML_HTML, encoding, root_element=root_element)
+    if passed:
+        result = MatcherResult(spec, html_src, root_element, passed=True, bytes_consumed=len(html_src), stats=stats)
+    else:
+        with phase(stats, 'diagnose'):
+            result = linear_match(spec, document)
+        result.stats = stats
+
+    if cross_check:
+        linear_result = result if not passed else linear_match(spec, document)
+        if linear_result.passed != passed:
+            raise AssertionError('The xpath matcher {0} where the linear matcher {1}'.format(
+                'passed' if passed else 'failed', linear_result.result_text.lower()))
+    return result
+
+
+def _matches_in_order(tree, definitions, selected):
+    """ Matches the defs to the kept elements in document order, as the linear matcher's scan does. """
+
+    position = 0
+    for definition in definitions:
+        candidates = selected[definition]
+        position = next((candidate for candidate in candidates[bisect_right(candidates, position):]
+                         if tree.content_contains(candidate, definition.content, pruned=True)), None)
+        if position is None:
+            return False
+    return True
+
+
+class _XPathTree(object):
+    """
+    The elements of an lxml.html tree numbered in document order, which the XPath expressions select from.
+
+    The content of an element follows the rules of the document index for lxml.html trees, which are those of
+    BeautifulSoup: strings inside a script (or another string container) only belong to that element, and strings of
+    whitespace are collapsed. Once the elements each def selects are known, the elements which weren't selected and
+    have nothing selected inside them are pruned, and pruned content only counts strings belonging to the elements
+    which are kept.
+    """
+
+    def __init__(self, root_element):
+        self.node = root_element.node
+        self.nodes = [] if self.node is None else list(self.node.iter(lxml.etree.Element))
+        self.positions = dict((node, position) for position, node in enumerate(self.nodes, 1))
+        self.kept = None
+
+    def select(self, definitions, xpath):
+        """ The positions of the elements matching each of the defs, before any pruning, in document order. """
+
+        selected = dict((definition, []) for definition in definitions)
+        if self.node is None:
+            return selected
+
+        for node in xpath(self.node, **_variables(definitions)):
+            position = self.positions[node]
+            element = None
+            for definition in definitions:
+                if not definition.name_matcher.match(node.tag):
+                    continue
+                if definition.attrs:
+                    element = element or LxmlElement(node, node.tag, _element_attrs(node))
+                    if not _attributes_match(definition, element):
+                        continue
+                if definition.content and not self.content_contains(position, definition.content):
+                    continue
+                selected[definition].append(position)
+        return selected
+
+    def keep(self, selections):
+        kept = [False] * (len(self.nodes) + 1)
+        for positions in selections:
+            for position in positions:
+                node = self.nodes[position - 1]
+                while node is not None and not kept[self.positions[node]]:
+                    kept[self.positions[node]] = True
+                    node = node.getparent()
+        self.kept = kept
+
+    def content_contains(self, position, needle, pruned=False):
+        """ Checks whether any string inside the element contains the needle, as the document index does. """
+
+        if not needle:
+            return True
+        node = self.nodes[position - 1]
+        string_types = frozenset([_STRING_CONTAINERS[node.tag]]) if node.tag in _STRING_CONTAINERS \
+            else _MAIN_STRING_TYPES
+        # Strings of whitespace are collapsed, so the only needles which can be in a string as it is written but not
+        # as it is collapsed are whitespace too
+        texts = _TEXTS_CONTAINING(node, needle=needle) if needle.strip() else _TEXTS(node)
+        for text in texts:
+            owner = text.getparent().getparent() if text.is_tail else text.getparent()
+            if pruned and not self.kept[self.positions[owner]]:
+                continue
+            string_type, preserve_whitespace = _string_type(owner)
+            if string_type in string_types and needle in _collapse_whitespace(text, preserve_whitespace):
+                return True
+        return False
+
+
+def _string_type(node):
+    """ The type of the strings belonging to the element, and whether their whitespace is kept as it is. """
+
+    container = None
+    preserve_whitespace = False
+    while node is not None:
+        if container is None and node.tag in _STRING_CONTAINERS:
+            container = node.tag
+        preserve_whitespace = preserve_whitespace or node.tag in _PRESERVE_WHITESPACE_ELEMENTS
+        node = node.getparent()
+    return _STRING_CONTAINERS[container] if container else NavigableString, preserve_whitespace
+
+
+def _definition_groups(definitions):
+    """
+    The distinct defs grouped by the tag name they match, with the XPath expression selecting (at least) every element
+    any of them matches.
+
+    Each group is selected with one pass over the tree, testing each element with that tag name against each def in the
+    group. Tag names are a name test, which lxml evaluates quickest, and other name regexes are grouped together, and
+    tested with the EXSLT regular expression extension. Multi-valued attributes such as class match when one of their
+    values is the value in the def, which contains() on the whole attribute also finds, along with a few more elements
+    which are then ruled out.
+    """
+
+    groups = OrderedDict()
+    for definition in definitions:
+        groups.setdefault(_tag_name(definition), OrderedDict())[definition] = None
+    return [(tuple(group), _group_xpath(name, tuple(group))) for name, group in groups.items()]
+
+
+def _group_xpath(name, definitions):
+    tests = [_definition_test(name, definition, index) for index, definition in enumerate(definitions)]
+    if 'true()' in tests:
+        # One of the defs matches every element with the name, whatever else the others want
+        tests = []
+    expression = '//{0}'.format(name or '*')
+    if tests:
+        expression += '[{0}]'.format(' or '.join(tests))
+
+    xpath = _XPATHS.pop(expression, None)
+    if xpath is None:
+        xpath = lxml.etree.XPath(expression, namespaces=_REGEX_NAMESPACES)
+    _XPATHS[expression] = xpath
+    while len(_XPATHS) > _XPATHS_MAX:
+        _XPATHS.popitem(last=False)
+    return xpath
+
+
+def _definition_test(name, definition, index):
+    """ The XPath test for an element with the tag name, with the def's values as variables numbered by its index. """
+
+    tests = [] if name else ['re:test(local-name(), $n{0})'.format(index)]
+    for attr_index, (key, value) in enumerate(definition.attrs):
+        attribute = '@{0}'.format(key) if _XPATH_NAME.match(key) \
+            else '@*[name() = $k{0}_{1}]'.format(index, attr_index)
+        if isinstance(value, str):
+            tests.append('contains({0}, $v{1}_{2})'.format(attribute, index, attr_index))
+        else:
+            tests.append(attribute)
+    if definition.content and definition.content.strip():
+        tests.append('.//text()[contains(., $c{0})]'.format(index))
+    if not tests:
+        return 'true()'
+    return '({0})'.format(' and '.join(tests)) if len(tests) > 1 else tests[0]
+
+
+def _variables(definitions):
+    """ The values of the defs in a group, as variables for its XPath expression. """
+
+    variables = {}
+    for index, definition in enumerate(definitions):
+        variables['n{0}'.format(index)] = definition.name_matcher.pattern
+        variables['c{0}'.format(index)] = definition.content or ''
+        for attr_index, (key, value) in enumerate(definition.attrs):
+            variables['k{0}_{1}'.format(index, attr_index)] = key
+            if isinstance(value, str):
+                variables['v{0}_{1}'.format(index, attr_index)] = value
+    return variables
+
+
+def _tag_name(definition):
+    """ The tag name the def matches, when its name regex just matches one name which XPath can test for. """
+
+    literal_name = _LITERAL_NAME_REGEX.match(definition.name_matcher.pattern)
+    if literal_name and _XPATH_NAME.match(literal_name.group(1)):
+        return literal_name.group(1)
+    return None
@@ -1,8 +1,28 @@
+import os
+import re
+
 from setuptools import find_packages, setup
 
 
+def read_version():
+    """ The version from pha/version.py, which is kept in one place as cached results are keyed by it. """
+
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pha', 'version.py')) as version_file:
+        return re.search(r"^__version__ = '([^']+)'", version_file.read(), re.MULTILINE).group(1)
+
+
 REQUIREMENTS = [
-    'beautifulsoup4']
+    'beautifulsoup4>=4.13,<4.16']
+
+
+EXTRAS = {
+    'lxml': ['lxml'],
+    'html5lib': ['html5lib'],
+    'pytest': ['pytest']}
+
+
+ENTRY_POINTS = {
+    'pytest11': ['pha = pha.pytest_plugin']}
 
 
 PACKAGES = [
@@ -15,15 +35,25 @@ CLASSIFIERS = [
     'License :: OSI Approved :: MIT License',
     'Operating System :: MacOS :: MacOS X',
     'Operating System :: POSIX :: Linux',
-    'Programming Language :: Python :: 3.6',
+    'Programming Language :: Python :: 3',
+    'Programming Language :: Python :: 3 :: Only',
+    'Programming Language :: Python :: 3.7',
+    'Programming Language :: Python :: 3.8',
+    'Programming Language :: Python :: 3.9',
+    'Programming Language :: Python :: 3.10',
+    'Programming Language :: Python :: 3.11',
+    'Programming Language :: Python :: 3.12',
     'Topic :: Software Development :: Testing',
     'Topic :: Utilities']
 
 setup(
     name='python-html-assert',
-    version='0.2.1.1',
+    version=read_version(),
     packages=find_packages(),
+    python_requires='>=3.7',
     install_requires=REQUIREMENTS,
+    extras_require=EXTRAS,
+    entry_points=ENTRY_POINTS,
     author='Robert Cox',
     author_email='robjohncox@gmail.com',
     description='partial matching of html using a tree-based specification',